@@ -0,0 +1,85 @@
+"""Measure rank card and chart rendering throughput.
+
+    python benchmarks/render_bench.py
+    python benchmarks/render_bench.py --cards 500 --workers 4
+
+Compares rendering inline, through the RenderService process pool, and
+repeated requests served from the content-addressed cache.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.render import RenderService, render  # noqa: E402
+
+
+def make_cards(count, seed):
+    rng = random.Random(seed)
+    cards = []
+    for n in range(count):
+        xp = rng.randint(0, 50000)
+        cards.append({
+            'name': f'member{n}',
+            'level': xp // 100,
+            'xp': xp,
+            'into_level': xp % 100,
+            'level_span': 100,
+            'rank': n + 1,
+        })
+    return cards
+
+
+def report(label, count, elapsed):
+    print(f'  {label:<22} {count / elapsed:8.1f} images/s  ({elapsed * 1000 / count:6.2f} ms each)')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    cards = make_cards(args.cards, args.seed)
+    chart = {'title': 'XP Leaderboard', 'rows': [[f'#{i} member{i}', 1000 - i * 37] for i in range(10)]}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = RenderService(workers=args.workers, avatar_dir=tmp)
+        if not service.available:
+            print('Pillow is not installed; nothing to benchmark.')
+            return
+        print(f'Rendering {args.cards} rank cards ({service.workers} workers)')
+
+        started = time.perf_counter()
+        for card in cards:
+            render('rank_card', card)
+        report('inline', len(cards), time.perf_counter() - started)
+
+        # Warm the pool so process start-up is not counted
+        await asyncio.gather(*(service.render('bar_chart', {**chart, 'title': str(i)})
+                               for i in range(service.workers)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(service.render('rank_card', card) for card in cards))
+        report('process pool', len(cards), time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(service.render('rank_card', card) for card in cards))
+        report('cache hits', len(cards), time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(args.cards):
+            render('bar_chart', chart)
+        report('bar chart inline', args.cards, time.perf_counter() - started)
+
+        await service.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
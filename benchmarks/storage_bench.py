@@ -0,0 +1,96 @@
+"""Compare storage backends under the same synthetic workload.
+
+    python benchmarks/storage_bench.py
+    python benchmarks/storage_bench.py --ops 50000 --users 20000
+    python benchmarks/storage_bench.py --postgres postgresql://localhost/bot_bench
+
+The workload mixes XP grants, level reads, prefix lookups and leaderboard
+pages in roughly the proportions the bot sees. PostgreSQL is only run when a
+DSN is given; point it at a throwaway local database since the bench writes to
+the real tables.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_storage  # noqa: E402
+
+# (operation, weight)
+WORKLOAD = [
+    ('add_xp', 70),
+    ('get_xp', 15),
+    ('prefix', 10),
+    ('leaderboard', 5),
+]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def run_workload(storage, ops, guilds, users, seed):
+    rng = random.Random(seed)
+    names = [name for name, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    latencies = {name: [] for name in names}
+
+    for guild_id in range(1, guilds + 1):
+        await storage.ensure_guild(guild_id, '!')
+
+    started = time.perf_counter()
+    for op in rng.choices(names, weights, k=ops):
+        guild_id = rng.randint(1, guilds)
+        user_id = rng.randint(1, users)
+        t = time.perf_counter()
+        if op == 'add_xp':
+            await storage.add_xp(guild_id, user_id, rng.randint(1, 5))
+        elif op == 'get_xp':
+            await storage.get_xp(guild_id, user_id)
+        elif op == 'prefix':
+            await storage.get_guild_settings(guild_id)
+        else:
+            await storage.leaderboard(guild_id, 10, rng.randint(0, 4) * 10)
+        latencies[op].append(time.perf_counter() - t)
+    return time.perf_counter() - started, latencies
+
+
+async def bench(label, url, args):
+    storage = open_storage(url)
+    await storage.connect()
+    try:
+        elapsed, latencies = await run_workload(storage, args.ops, args.guilds, args.users, args.seed)
+    finally:
+        await storage.close()
+
+    print(f'\n{label}: {args.ops / elapsed:,.0f} ops/s ({elapsed:.2f}s)')
+    for op, samples in latencies.items():
+        if samples:
+            print(f'  {op:<12} n={len(samples):<7} p50={percentile(samples, 0.5) * 1e6:8.1f}us '
+                  f'p99={percentile(samples, 0.99) * 1e6:8.1f}us')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--postgres', help='PostgreSQL DSN to include in the comparison')
+    args = parser.parse_args()
+
+    await bench('memory', 'memory://', args)
+    with tempfile.TemporaryDirectory() as tmp:
+        await bench('sqlite', f"sqlite:///{os.path.join(tmp, 'bench.db')}", args)
+    if args.postgres:
+        await bench('postgres', args.postgres, args)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
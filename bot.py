@@ -1,12 +1,27 @@
+import time
+START_TIME = time.perf_counter()
+
 import os
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
 import sqlite3
 from datetime import datetime
 import json
 import asyncio
-from better_profanity import profanity
+import signal
+import tempfile
+from storage import DEFAULT_URL, open_storage
+from utils import guild_data
+from utils.raid import JoinRateTracker, RaidSettings
+from utils.dispatch import COMMAND, PRIORITY_NAMES, GuildDispatcher
+from utils.member_index import GuildLookup
+from utils.render import RenderService
+from utils.snapshot import SnapshotStore
+
+# Startup time breakdown, reported once the bot is ready
+startup_timings = [('imports', time.perf_counter() - START_TIME)]
+COGS = ['moderation', 'fun', 'analytics', 'roles']
 
 # Load environment variables
 load_dotenv()
@@ -21,12 +36,8 @@ async def get_prefix(bot, message):
         return DEFAULT_PREFIX
     
     try:
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT prefix FROM guild_settings WHERE guild_id = ?', 
-                         (message.guild.id,))
-            result = cursor.fetchone()
-            return result[0] if result else DEFAULT_PREFIX
+        settings = await bot.storage.get_guild_settings(message.guild.id)
+        return settings['prefix'] if settings else DEFAULT_PREFIX
     except:
         return DEFAULT_PREFIX
 
@@ -34,90 +45,294 @@ async def get_prefix(bot, message):
 intents = discord.Intents.all()
 bot = commands.Bot(command_prefix=get_prefix, intents=intents, help_command=None)
 
-# Database initialization
-def init_db():
-    with sqlite3.connect('bot.db') as conn:
-        cursor = conn.cursor()
-        
-        # Guild settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS guild_settings (
-                guild_id INTEGER PRIMARY KEY,
-                prefix TEXT DEFAULT '!',
-                welcome_channel_id INTEGER,
-                log_channel_id INTEGER
-            )
-        ''')
-        
-        # User XP table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_xp (
-                user_id INTEGER,
-                guild_id INTEGER,
-                xp INTEGER DEFAULT 0,
-                level INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
-        
-        # Custom commands table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS custom_commands (
-                guild_id INTEGER,
-                command TEXT,
-                response TEXT,
-                PRIMARY KEY (guild_id, command)
-            )
-        ''')
-        
-        # Reminders table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reminders (
-                user_id INTEGER,
-                guild_id INTEGER,
-                reminder_text TEXT,
-                reminder_time TIMESTAMP
-            )
-        ''')
+# Storage backend, selected with DATABASE_URL (sqlite:///bot.db by default)
+bot.storage = open_storage(os.getenv('DATABASE_URL', DEFAULT_URL))
+
+# Image rendering for rank cards and charts, done in a process pool
+bot.renderer = RenderService()
+
+# Per-server queues so one busy server cannot starve the rest
+bot.dispatcher = GuildDispatcher()
+
+# In-memory state saved on shutdown and every few minutes, restored on startup
+bot.snapshot = SnapshotStore(os.getenv('SNAPSHOT_PATH', '.cache/state.snapshot'))
+
+# Member and role name indexes for command arguments, kept current by the events below
+bot.lookup = GuildLookup()
+
+# Raid detection state
+join_tracker = JoinRateTracker()
+raid_settings_cache = {}
+RAID_SUMMARY_INTERVAL = 15
+RAID_SUMMARY_MENTIONS = 40
+IMPORT_MAX_BYTES = 100 * 1024 * 1024
+MAX_SLOWMODE = 21600   # Discord's limit, in seconds
+
+async def get_raid_settings(guild_id):
+    # Cached so a raid does not cost one query per join
+    settings = raid_settings_cache.get(guild_id)
+    if settings is None:
+        result = await bot.storage.get_raid_settings(guild_id)
+        settings = RaidSettings(*result) if result else RaidSettings()
+        raid_settings_cache[guild_id] = settings
+    return settings
+
+async def get_guild_channel(guild, setting):
+    settings = await bot.storage.get_guild_settings(guild.id)
+    return guild.get_channel(settings[setting]) if settings and settings[setting] else None
+
+async def notify_moderators(guild, title, description):
+    log_channel = await get_guild_channel(guild, 'log_channel_id')
+    if log_channel:
+        embed = discord.Embed(title=title, description=description,
+                              color=discord.Color.orange(), timestamp=discord.utils.utcnow())
+        try:
+            await log_channel.send(embed=embed)
+        except discord.HTTPException:
+            pass
+
+async def send_welcome_summary(guild, channel):
+    pending = join_tracker.take_pending(guild.id)
+    if not pending or not channel:
+        return
+    shown = ' '.join(pending[:RAID_SUMMARY_MENTIONS])
+    extra = len(pending) - RAID_SUMMARY_MENTIONS
+    if extra > 0:
+        shown += f' and {extra} more'
+    try:
+        await channel.send(f"Welcome {shown} to {guild.name}! 🎉",
+                           allowed_mentions=discord.AllowedMentions.none())
+    except discord.HTTPException:
+        pass
+
+async def start_raid_mode(guild, settings):
+    restore = join_tracker.guilds[guild.id].restore
+    welcome_channel = None
+    try:
+        welcome_channel = await get_guild_channel(guild, 'welcome_channel_id')
+        if settings.slowmode and welcome_channel:
+            restore['slowmode'] = welcome_channel.slowmode_delay
+            try:
+                await welcome_channel.edit(slowmode_delay=settings.slowmode)
+            except discord.HTTPException as e:
+                print(f'Could not set raid slowmode in guild {guild.id}: {e}')
+        if settings.raise_verification and guild.verification_level < discord.VerificationLevel.high:
+            restore['verification'] = guild.verification_level.value
+            try:
+                await guild.edit(verification_level=discord.VerificationLevel.high)
+            except discord.HTTPException as e:
+                print(f'Could not raise verification in guild {guild.id}: {e}')
         
-        conn.commit()
+        rate = join_tracker.rate(guild.id, settings)
+        await notify_moderators(guild, "🚨 Raid mode enabled",
+                                f"Join rate: {rate:.0f} joins/minute\n"
+                                f"Welcome messages are batched every {RAID_SUMMARY_INTERVAL}s.")
+    finally:
+        # raid_since is already set, so without the watch the guild would never leave raid mode
+        bot.loop.create_task(raid_watch(guild, settings, welcome_channel))
+
+async def restore_raid_settings(guild, welcome_channel, restore):
+    if 'slowmode' in restore and welcome_channel:
+        try:
+            await welcome_channel.edit(slowmode_delay=restore['slowmode'])
+        except discord.HTTPException as e:
+            print(f'Could not restore slowmode in guild {guild.id}: {e}')
+    if 'verification' in restore:
+        try:
+            await guild.edit(verification_level=discord.VerificationLevel(restore['verification']))
+        except discord.HTTPException as e:
+            print(f'Could not restore verification in guild {guild.id}: {e}')
+
+async def raid_watch(guild, settings, welcome_channel):
+    # Post batched welcomes until the join rate calms down
+    try:
+        while not join_tracker.should_end(guild.id, settings):
+            await asyncio.sleep(RAID_SUMMARY_INTERVAL)
+            await send_welcome_summary(guild, welcome_channel)
+        await send_welcome_summary(guild, welcome_channel)
+    except Exception as e:
+        # Still leave raid mode; cancellation at shutdown is not caught, so the raid resumes after a restart
+        print(f'Raid watch for guild {guild.id} failed: {e}')
+    
+    duration, joins, restore = join_tracker.end_raid(guild.id)
+    await restore_raid_settings(guild, welcome_channel, restore)
+    await notify_moderators(guild, "✅ Raid mode ended",
+                            f"{joins} joins over {duration / 60:.1f} minutes")
+
+async def load_cog(cog):
+    started = time.perf_counter()
+    try:
+        await bot.load_extension(f'cogs.{cog}')
+        print(f'Loaded {cog} cog')
+    except Exception as e:
+        print(f'Failed to load {cog} cog: {str(e)}')
+    startup_timings.append((f'cog {cog}', time.perf_counter() - started))
+
+@tasks.loop(hours=6)
+async def database_maintenance():
+    """Prune rows for departed guilds and members, then refresh statistics and reclaim space"""
+    if not bot.guilds:
+        return  # an empty guild list during an outage must not wipe the database
+    started = time.perf_counter()
+    try:
+        removed = await bot.storage.prune_guilds({guild.id for guild in bot.guilds})
+        for guild in bot.guilds:
+            # Only chunked guilds have a complete member list to compare against
+            if guild.chunked:
+                removed += await bot.storage.prune_members(guild.id, {member.id for member in guild.members})
+        result = await bot.storage.optimize()
+    except Exception as e:
+        print(f'Database maintenance failed: {e}')
+        return
+    details = ', '.join(f'{key}={value}' for key, value in result.items())
+    print(f'Database maintenance: pruned {removed} rows in {time.perf_counter() - started:.1f}s'
+          + (f' ({details})' if details else ''))
+
+@database_maintenance.before_loop
+async def before_database_maintenance():
+    await bot.wait_until_ready()
+
+async def resume_raid_watches():
+    # Raids still running when the snapshot was taken get their batching loop back
+    await bot.wait_until_ready()
+    for guild_id in join_tracker.raiding_guilds():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            join_tracker.end_raid(guild_id)
+            continue
+        settings = await get_raid_settings(guild_id)
+        welcome_channel = await get_guild_channel(guild, 'welcome_channel_id')
+        bot.loop.create_task(raid_watch(guild, settings, welcome_channel))
+
+def load_raid_state(state):
+    join_tracker.load_state(state)
+    bot.loop.create_task(resume_raid_watches())
+
+@tasks.loop(minutes=5)
+async def save_snapshot():
+    try:
+        await bot.snapshot.save()
+    except Exception as e:
+        print(f'Failed to save snapshot: {e}')
+
+@save_snapshot.before_loop
+async def before_save_snapshot():
+    await bot.wait_until_ready()
+
+@bot.event
+async def setup_hook():
+    # Runs once before connecting, unlike on_ready which fires on every reconnect
+    started = time.perf_counter()
+    await bot.storage.connect()
+    startup_timings.append(('storage', time.perf_counter() - started))
+    
+    bot.dispatcher.start()
+    
+    # Components restore their sections from the last snapshot as they register
+    bot.snapshot.open()
+    bot.snapshot.register('raid', join_tracker.dump_state, load_raid_state)
+    bot.snapshot.register('render_cache', bot.renderer.dump_cache, bot.renderer.load_cache)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(load_cog(cog) for cog in COGS))
+    startup_timings.append(('cogs total', time.perf_counter() - started))
+    
+    restored = bot.snapshot.finish_restore()
+    if restored:
+        print(f'Restored from snapshot: {", ".join(restored)}')
+    database_maintenance.start()
+    save_snapshot.start()
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
-    init_db()
-    # Load all cogs
-    for cog in ['moderation', 'fun', 'analytics']:
-        try:
-            await bot.load_extension(f'cogs.{cog}')
-            print(f'Loaded {cog} cog')
-        except Exception as e:
-            print(f'Failed to load {cog} cog: {str(e)}')
+    if startup_timings and startup_timings[-1][0] != 'ready':
+        startup_timings.append(('ready', time.perf_counter() - START_TIME))
+        print('Startup timings:')
+        for label, seconds in startup_timings:
+            print(f'  {label}: {seconds * 1000:.0f} ms')
     await bot.change_presence(activity=discord.Game(name=f"Type {DEFAULT_PREFIX}help"))
 
+@bot.event
+async def on_message(message):
+    # Commands run through the server's queue, after moderation and before XP
+    if message.author.bot:
+        return
+    if message.guild:
+        bot.dispatcher.submit(message.guild.id, COMMAND, process_message, message)
+    else:
+        await bot.process_commands(message)
+
+async def process_message(message):
+    """Invoke a built-in command, or a custom command if no built-in matches"""
+    ctx = await bot.get_context(message)
+    if ctx.command is None and ctx.invoked_with:
+        fun = bot.get_cog('Fun')
+        if fun and await fun.run_custom_command(ctx):
+            return
+    await bot.invoke(ctx)
+
 @bot.event
 async def on_guild_join(guild):
     # Initialize guild settings when bot joins a new server
-    with sqlite3.connect('bot.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR IGNORE INTO guild_settings (guild_id, prefix) VALUES (?, ?)',
-                      (guild.id, DEFAULT_PREFIX))
-        conn.commit()
+    await bot.storage.ensure_guild(guild.id, DEFAULT_PREFIX)
+
+@bot.event
+async def on_guild_remove(guild):
+    bot.lookup.forget_guild(guild.id)
 
 @bot.event
 async def on_member_join(member):
+    bot.lookup.update_member(member)
+    # Track join rate; during a raid welcomes are batched instead of sent per join
+    settings = await get_raid_settings(member.guild.id)
+    entered_raid = join_tracker.record(member.guild.id, settings)
+    if join_tracker.in_raid(member.guild.id):
+        join_tracker.queue_welcome(member.guild.id, member.mention)
+        if entered_raid:
+            await start_raid_mode(member.guild, settings)
+        return
+    
     # Welcome message
-    with sqlite3.connect('bot.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT welcome_channel_id FROM guild_settings WHERE guild_id = ?',
-                      (member.guild.id,))
-        result = cursor.fetchone()
-        
-        if result and result[0]:
-            welcome_channel = member.guild.get_channel(result[0])
-            if welcome_channel:
-                welcome_msg = f"Welcome {member.mention} to {member.guild.name}! 🎉"
-                await welcome_channel.send(welcome_msg)
+    welcome_channel = await get_guild_channel(member.guild, 'welcome_channel_id')
+    if welcome_channel:
+        welcome_msg = f"Welcome {member.mention} to {member.guild.name}! 🎉"
+        await welcome_channel.send(welcome_msg)
+
+@bot.event
+async def on_member_remove(member):
+    bot.lookup.remove_member(member.guild.id, member.id)
+
+@bot.event
+async def on_member_update(before, after):
+    if before.nick != after.nick:
+        bot.lookup.update_member(after)
+
+@bot.event
+async def on_user_update(before, after):
+    if before.name != after.name or before.global_name != after.global_name:
+        bot.lookup.update_user(bot, after)
+
+@bot.event
+async def on_guild_role_create(role):
+    bot.lookup.update_role(role)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        bot.lookup.update_role(after)
+
+@bot.event
+async def on_guild_role_delete(role):
+    bot.lookup.remove_role(role)
+
+@bot.event
+async def on_command_error(ctx, error):
+    # Explain rejected arguments, such as an unknown member with suggested matches
+    if isinstance(error, commands.BadArgument) and not ctx.command.has_error_handler():
+        await ctx.send(f'❌ {error}')
+        return
+    await commands.Bot.on_command_error(bot, ctx, error)
 
 @bot.command(name='help')
 async def help_command(ctx):
@@ -129,9 +344,13 @@ async def help_command(ctx):
         `{prefix}help` - Show this message
         `{prefix}ping` - Check bot latency
         `{prefix}prefix <new_prefix>` - Change server prefix
-        `{prefix}getrole <role>` - Get a role
+        `{prefix}getrole <role>[, role...]` - Get self-assignable roles
+        `{prefix}removerole <role>[, role...]` - Remove self-assignable roles
+        `{prefix}selfrole [add|remove <role>]` - List or manage self-assignable roles
+        `{prefix}rolemenu [title]` - Post a role picker menu
         `{prefix}remind <time> <reminder>` - Set a reminder
         `{prefix}poll "<title>" "<option1>" "<option2>"` - Create a poll
+        `{prefix}exportdata` / `{prefix}importdata` - Back up or restore server data
     """, inline=False)
     
     # Moderation
@@ -140,21 +359,32 @@ async def help_command(ctx):
         `{prefix}ban <user> [reason]` - Ban a user
         `{prefix}mute <user> [duration]` - Mute a user
         `{prefix}unmute <user>` - Unmute a user
+        `{prefix}warn <user> [reason]` - Warn a user
+        `{prefix}warnings <user...>` / `{prefix}warnings clear <user>` - Show or clear warnings
+        `{prefix}warnrule [add <count> <window> <mute>|remove <count>]` - Automatic mutes for repeat warnings
         `{prefix}slowmode <seconds>` - Set slowmode
+        `{prefix}purge <amount> [user:] [match:] [attachments:] [newer:] [older:]` - Bulk delete messages
+        `{prefix}linkfilter [allow|deny|remove <domain>]` - Show or manage link rules
+        `{prefix}raidstatus` - Show join rate and raid mode
+        `{prefix}raidconfig <joins> <seconds> [slowmode] [verify]` - Configure raid detection
+        `{prefix}queuestats` - Show this server's event queue and shed work
     """, inline=False)
     
     # Fun/Engagement
     embed.add_field(name="🎉 Fun & Engagement", value=f"""
         `{prefix}trivia` - Start a trivia game
         `{prefix}meme` - Get a random meme
-        `{prefix}addcommand <name> <response>` - Add custom command
+        `{prefix}addcommand <name> <response>` - Add custom command (`{{user}}`, `{{args}}`, `{{count}}`, `{{choice:a|b}}`)
         `{prefix}level` - Check your level
+        `{prefix}levelcurve [type] [params]` - Show or set the level curve
     """, inline=False)
     
     # Analytics
     embed.add_field(name="📈 Analytics", value=f"""
         `{prefix}stats` - View server stats
         `{prefix}leaderboard` - View XP leaderboard
+        `{prefix}topgainers [days]` - Top XP gainers
+        `{prefix}xpgrowth [user] [days]` - XP gained over time
     """, inline=False)
     
     await ctx.send(embed=embed)
@@ -167,24 +397,135 @@ async def ping(ctx):
 @bot.command(name='prefix')
 @commands.has_permissions(administrator=True)
 async def change_prefix(ctx, new_prefix: str):
-    with sqlite3.connect('bot.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE guild_settings SET prefix = ? WHERE guild_id = ?',
-                      (new_prefix, ctx.guild.id))
-        conn.commit()
+    await bot.storage.set_prefix(ctx.guild.id, new_prefix)
     await ctx.send(f'Prefix has been updated to: {new_prefix}')
 
-@bot.command(name='getrole')
-async def get_role(ctx, *, role_name: str):
-    role = discord.utils.get(ctx.guild.roles, name=role_name)
-    if role:
-        try:
-            await ctx.author.add_roles(role)
-            await ctx.send(f'✅ Added role: {role.name}')
-        except discord.Forbidden:
-            await ctx.send("❌ I don't have permission to assign that role.")
-    else:
-        await ctx.send("❌ Role not found.")
+@bot.command(name='raidstatus')
+@commands.has_permissions(manage_guild=True)
+async def raid_status(ctx):
+    settings = await get_raid_settings(ctx.guild.id)
+    rate = join_tracker.rate(ctx.guild.id, settings)
+    mode = '🚨 Raid mode' if join_tracker.in_raid(ctx.guild.id) else '✅ Normal'
+    await ctx.send(f'{mode} | Join rate: {rate:.0f} joins/minute | '
+                   f'Trigger: {settings.threshold} joins in {settings.window}s')
+
+@bot.command(name='queuestats')
+@commands.has_permissions(manage_guild=True)
+async def queue_stats(ctx):
+    stats = bot.dispatcher.stats(ctx.guild.id)
+    embed = discord.Embed(title="📬 Event Queue", color=discord.Color.blue())
+    for name in PRIORITY_NAMES:
+        embed.add_field(name=name.capitalize(),
+                        value=f"{stats['queued'][name]} queued\n{stats['shed'][name]} shed", inline=True)
+    embed.set_footer(text=f"{stats['processed']} processed · {stats['running']} running, "
+                          f"{stats['detached']} long-running · peak depth {stats['peak']}/"
+                          f"{bot.dispatcher.max_depth} · {bot.dispatcher.backlog} queued across all servers")
+    await ctx.send(embed=embed)
+
+@bot.command(name='raidconfig')
+@commands.has_permissions(administrator=True)
+async def raid_config(ctx, threshold: int, window: int, slowmode: int = 0, verification: bool = False):
+    if threshold < 2 or window < 1:
+        await ctx.send('❌ Threshold must be at least 2 joins and the window at least 1 second.')
+        return
+    if not 0 <= slowmode <= MAX_SLOWMODE:
+        await ctx.send(f'❌ Slowmode must be between 0 and {MAX_SLOWMODE} seconds.')
+        return
+    await bot.storage.set_raid_settings(ctx.guild.id, threshold, window, slowmode, verification)
+    raid_settings_cache[ctx.guild.id] = RaidSettings(threshold, window, slowmode, verification)
+    await ctx.send(f'✅ Raid mode triggers at {threshold} joins in {window}s'
+                   + (f', slowmode {slowmode}s' if slowmode else '')
+                   + (', raises verification' if verification else ''))
+
+@bot.command(name='exportdata')
+@commands.has_permissions(administrator=True)
+async def export_data(ctx):
+    db_path = getattr(bot.storage, 'path', None)
+    if db_path is None:
+        await ctx.send('❌ Export is only available with SQLite storage.')
+        return
+    
+    path = os.path.join(tempfile.gettempdir(), f'guild-{ctx.guild.id}.jsonl.gz')
+    async with ctx.typing():
+        counts = await bot.loop.run_in_executor(None, guild_data.export_guild,
+                                                db_path, ctx.guild.id, path)
+    summary = ', '.join(f'{table}: {count}' for table, count in counts.items())
+    try:
+        if os.path.getsize(path) <= ctx.guild.filesize_limit:
+            await ctx.send(f'📦 Exported {summary}', file=discord.File(path))
+        else:
+            await ctx.send(f'📦 Exported {summary}\n'
+                           f'The file is too large to upload; it was saved on the bot host as `{path}`.')
+            return
+    except discord.HTTPException:
+        await ctx.send('❌ Failed to upload the export.')
+    os.remove(path)
+
+async def staged_chunks(staging_path, tables):
+    # Staged rows are read in a worker thread; small chunks keep each write on the shared connection short
+    rows = guild_data.staged_rows(staging_path, tables, chunk_size=1000)
+    try:
+        while True:
+            chunk = await bot.loop.run_in_executor(None, next, rows, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await bot.loop.run_in_executor(None, rows.close)
+
+@bot.command(name='importdata')
+@commands.has_permissions(administrator=True)
+async def import_data(ctx):
+    db_path = getattr(bot.storage, 'path', None)
+    if db_path is None:
+        await ctx.send('❌ Import is only available with SQLite storage.')
+        return
+    if not ctx.message.attachments:
+        await ctx.send('❌ Attach a file created with exportdata.')
+        return
+    attachment = ctx.message.attachments[0]
+    if attachment.size > IMPORT_MAX_BYTES:
+        await ctx.send(f'❌ Import files may be at most {IMPORT_MAX_BYTES // (1024 * 1024)} MB.')
+        return
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'import.jsonl.gz')
+        staging_path = os.path.join(directory, 'staging.db')
+        async with ctx.typing():
+            try:
+                await attachment.save(path)
+                target, tables, counts = await bot.loop.run_in_executor(
+                    None, guild_data.stage_import, path, staging_path, ctx.guild.id)
+            except (ValueError, OSError, sqlite3.Error, discord.HTTPException) as e:
+                await ctx.send(f'❌ Import failed, nothing was changed: {e}')
+                return
+            chunks = staged_chunks(staging_path, tables)
+            try:
+                await bot.storage.replace_guild_rows(target, tables, chunks)
+            except (OSError, sqlite3.Error) as e:
+                await ctx.send(f'❌ Import failed part way; run it again to finish: {e}')
+                return
+            finally:
+                await chunks.aclose()
+                await forget_guild_caches(ctx.guild.id)
+    
+    summary = ', '.join(f'{table}: {count}' for table, count in counts.items())
+    await ctx.send(f'✅ Imported {summary}')
+
+async def forget_guild_caches(guild_id):
+    """Drop cached per-guild settings so imported values are used"""
+    raid_settings_cache.pop(guild_id, None)
+    fun = bot.get_cog('Fun')
+    if fun:
+        fun.level_curves.pop(guild_id, None)
+        fun.templates.invalidate(guild_id)
+    roles = bot.get_cog('Roles')
+    if roles:
+        roles.indexes.pop(guild_id, None)
+    moderation = bot.get_cog('Moderation')
+    if moderation:
+        await moderation.load_link_rules(guild_id, reload=True)
+        await moderation.load_warn_rules(guild_id, reload=True)
 
 @bot.command(name='poll')
 async def create_poll(ctx, title: str, *options):
@@ -203,6 +544,26 @@ async def create_poll(ctx, title: str, *options):
     for idx in range(min(len(options), 10)):
         await poll_message.add_reaction(emoji_numbers[idx])
 
+async def main():
+    # docker/systemd stop sends SIGTERM; close the bot so the shutdown below still runs
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(bot.close()))
+    except NotImplementedError:  # Windows event loops
+        pass
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            save_snapshot.cancel()
+            await bot.dispatcher.close()
+            # Unloading the cogs flushes their buffered XP, so storage must still be open
+            await bot.close()
+            await bot.snapshot.save()
+            await bot.renderer.close()
+            await bot.storage.close()
+
 # Run the bot
 if __name__ == "__main__":
-    bot.run(TOKEN) 
\ No newline at end of file
+    discord.utils.setup_logging()
+    asyncio.run(main()) 
\ No newline at end of file
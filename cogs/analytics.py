@@ -1,8 +1,11 @@
 import discord
 from discord.ext import commands
-import sqlite3
+import time
 from datetime import datetime, timedelta
-from collections import Counter
+from typing import Optional
+from collections import Counter, defaultdict
+from utils.member_index import IndexedMember
+from utils.xp_history import DAY, day_start, week_start
 
 class Analytics(commands.Cog):
     def __init__(self, bot):
@@ -91,6 +94,15 @@ class Analytics(commands.Cog):
                     value=active_channels,
                     inline=False
                 )
+                
+                chart = await self.bot.renderer.render_file('bar_chart', {
+                    'title': 'Messages per channel (7 days)',
+                    'rows': [[f'#{channel}', count] for channel, count in message_counts.most_common(10)],
+                }, 'activity.png')
+                if chart:
+                    embed.set_image(url='attachment://activity.png')
+                    await ctx.send(embed=embed, file=chart)
+                    return
         
         await ctx.send(embed=embed)
     
@@ -104,74 +116,137 @@ class Analytics(commands.Cog):
         items_per_page = 10
         offset = (page - 1) * items_per_page
         
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            
-            # Get total number of ranked users
-            cursor.execute('''
-                SELECT COUNT(DISTINCT user_id)
-                FROM user_xp
-                WHERE guild_id = ?
-            ''', (ctx.guild.id,))
-            total_users = cursor.fetchone()[0]
-            
-            if total_users == 0:
-                await ctx.send("No users have earned XP yet!")
-                return
-            
-            # Calculate total pages
-            total_pages = (total_users + items_per_page - 1) // items_per_page
-            
-            if page > total_pages:
-                await ctx.send(f"There are only {total_pages} pages!")
-                return
-            
-            # Get leaderboard data
-            cursor.execute('''
-                SELECT user_id, xp, level
-                FROM user_xp
-                WHERE guild_id = ?
-                ORDER BY xp DESC
-                LIMIT ? OFFSET ?
-            ''', (ctx.guild.id, items_per_page, offset))
-            
-            leaderboard_data = cursor.fetchall()
-            
-            if not leaderboard_data:
-                await ctx.send("No data found for this page!")
-                return
-            
-            # Create embed
-            embed = discord.Embed(
-                title=f"🏆 XP Leaderboard - Page {page}/{total_pages}",
-                color=discord.Color.gold(),
-                timestamp=datetime.utcnow()
-            )
-            
-            # Add leaderboard entries
-            description = ""
-            for i, (user_id, xp, level) in enumerate(leaderboard_data, start=offset + 1):
-                member = ctx.guild.get_member(user_id)
-                name = member.display_name if member else f"User {user_id}"
-                
-                if i == 1:
-                    medal = "🥇"
-                elif i == 2:
-                    medal = "🥈"
-                elif i == 3:
-                    medal = "🥉"
-                else:
-                    medal = "👤"
-                
-                description += f"{medal} **#{i}** {name}\n"
-                description += f"Level: {level} | XP: {xp}\n\n"
-            
-            embed.description = description
+        storage = self.bot.storage
+        
+        # Get total number of ranked users
+        total_users = await storage.count_ranked(ctx.guild.id)
+        
+        if total_users == 0:
+            await ctx.send("No users have earned XP yet!")
+            return
+        
+        # Calculate total pages
+        total_pages = (total_users + items_per_page - 1) // items_per_page
+        
+        if page > total_pages:
+            await ctx.send(f"There are only {total_pages} pages!")
+            return
+        
+        # Get leaderboard data
+        leaderboard_data = await storage.leaderboard(ctx.guild.id, items_per_page, offset)
+        
+        if not leaderboard_data:
+            await ctx.send("No data found for this page!")
+            return
+        
+        # Create embed
+        embed = discord.Embed(
+            title=f"🏆 XP Leaderboard - Page {page}/{total_pages}",
+            color=discord.Color.gold(),
+            timestamp=datetime.utcnow()
+        )
+        
+        # Add leaderboard entries
+        description = ""
+        chart_rows = []
+        for i, (user_id, xp, level) in enumerate(leaderboard_data, start=offset + 1):
+            member = ctx.guild.get_member(user_id)
+            name = member.display_name if member else f"User {user_id}"
+            chart_rows.append([f"#{i} {name}", xp])
             
-            # Add navigation footer
-            embed.set_footer(text=f"Use {ctx.prefix}leaderboard <page> to view other pages")
+            if i == 1:
+                medal = "🥇"
+            elif i == 2:
+                medal = "🥈"
+            elif i == 3:
+                medal = "🥉"
+            else:
+                medal = "👤"
             
+            description += f"{medal} **#{i}** {name}\n"
+            description += f"Level: {level} | XP: {xp}\n\n"
+        
+        embed.description = description
+        
+        # Add navigation footer
+        embed.set_footer(text=f"Use {ctx.prefix}leaderboard <page> to view other pages")
+        
+        chart = await self.bot.renderer.render_file('bar_chart', {
+            'title': f'XP Leaderboard - Page {page}',
+            'rows': chart_rows,
+        }, 'leaderboard.png')
+        if chart:
+            embed.set_image(url='attachment://leaderboard.png')
+            await ctx.send(embed=embed, file=chart)
+        else:
             await ctx.send(embed=embed)
+    
+    @commands.command()
+    async def topgainers(self, ctx, days: int = 7):
+        """Show who gained the most XP recently"""
+        if not 1 <= days <= 180:
+            await ctx.send("Days must be between 1 and 180!")
+            return
+        
+        since = int(time.time()) - days * DAY
+        gainers = await self.bot.storage.top_xp_gains(ctx.guild.id, since, 10)
+        if not gainers:
+            await ctx.send(f"No XP has been earned in the last {days} days!")
+            return
+        
+        lines = []
+        for i, (user_id, gained) in enumerate(gainers, start=1):
+            member = ctx.guild.get_member(user_id)
+            name = member.display_name if member else f"User {user_id}"
+            lines.append(f"**#{i}** {name} — +{gained} XP")
+        
+        embed = discord.Embed(
+            title=f"📈 Top XP Gainers ({days} days)",
+            description="\n".join(lines),
+            color=discord.Color.green(),
+            timestamp=datetime.utcnow()
+        )
+        await ctx.send(embed=embed)
+    
+    @commands.command()
+    async def xpgrowth(self, ctx, days: Optional[int] = None, member: IndexedMember = None,
+                       days_after: int = None):
+        """Show a member's XP gains over time: xpgrowth [days] [member], or xpgrowth [member] [days]"""
+        # Days come first so a bare number is never looked up as a member name
+        member = member or ctx.author
+        if days is None:
+            days = 30 if days_after is None else days_after
+        if not 1 <= days <= 180:
+            await ctx.send("Days must be between 1 and 180!")
+            return
+        
+        since = int(time.time()) - days * DAY
+        history = await self.bot.storage.xp_history(ctx.guild.id, member.id, since)
+        if not history:
+            await ctx.send(f"{member.display_name} hasn't earned XP in the last {days} days!")
+            return
+        
+        # Daily rows for short ranges, weekly rows otherwise
+        align = day_start if days <= 14 else week_start
+        totals = defaultdict(int)
+        for bucket_start, xp in history:
+            totals[align(bucket_start)] += xp
+        
+        peak = max(totals.values())
+        lines = []
+        for bucket_start, xp in sorted(totals.items()):
+            label = datetime.utcfromtimestamp(bucket_start).strftime('%b %d')
+            bar = '█' * max(1, round(xp / peak * 12))
+            lines.append(f"`{label}` {bar} +{xp}")
+        
+        embed = discord.Embed(
+            title=f"📊 XP Growth for {member.display_name} ({days} days)",
+            description="\n".join(lines),
+            color=member.color
+        )
+        embed.set_footer(text=f"Total gained: {sum(totals.values())} XP"
+                              f" | {'Daily' if days <= 14 else 'Weekly'} totals")
+        await ctx.send(embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Analytics(bot)) 
\ No newline at end of file
@@ -1,22 +1,121 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+import asyncio
 import random
 import aiohttp
-import sqlite3
 import json
-import praw
 import os
+import time
+from collections import defaultdict
 from datetime import datetime
+from utils.leveling import DEFAULT_CURVE, CURVES, curve_from_config
+from utils.member_index import IndexedMember
+from utils.cooldown import XPCooldown
+from utils.dispatch import XP
+from utils.templates import TemplateCache, TemplateError, compile_template, literal_template
+from utils.voice_xp import VoiceTracker
+from utils.xp_history import XPHistoryBuffer, compaction_cutoffs
+
+TRIVIA_TIMEOUT = 30.0
 
 class Fun(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.trivia_sessions = {}
-        self.reddit = praw.Reddit(
-            client_id=os.getenv('REDDIT_CLIENT_ID'),
-            client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
-            user_agent="discord_bot:v1.0"
-        )
+        self.level_curves = {}
+        self.xp_cooldown = XPCooldown()
+        self.xp_history = XPHistoryBuffer()
+        self.templates = TemplateCache()
+        self.voice = VoiceTracker()
+        self._reddit = None
+    
+    async def cog_load(self):
+        self.bot.snapshot.register('trivia', self.dump_trivia, self.load_trivia)
+        self.bot.snapshot.register('xp_cooldown', self.xp_cooldown.dump_state, self.xp_cooldown.load_state)
+        self.bot.snapshot.register('voice_xp', self.voice.dump_state, self.voice.load_state)
+        self.flush_xp_history.start()
+        self.compact_xp_history.start()
+        self.settle_voice_xp.start()
+    
+    async def cog_unload(self):
+        self.settle_voice_xp.cancel()
+        self.compact_xp_history.cancel()
+        self.flush_xp_history.cancel()
+        await self.settle_voice_xp()
+        await self.flush_xp_history()
+    
+    def dump_trivia(self):
+        return {channel_id: dict(session) for channel_id, session in self.trivia_sessions.items()}
+    
+    def load_trivia(self, sessions):
+        # Questions asked before a restart keep their original deadline
+        for channel_id, session in sessions.items():
+            self.trivia_sessions[channel_id] = session
+            self.bot.loop.create_task(self.resume_trivia(channel_id, session))
+    
+    async def resume_trivia(self, channel_id, session):
+        await self.bot.wait_until_ready()
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            self.trivia_sessions.pop(channel_id, None)
+            return
+        await self.wait_for_answer(channel, session)
+    
+    @tasks.loop(minutes=1)
+    async def flush_xp_history(self):
+        """Write buffered XP gains to the hourly history buckets"""
+        gains = self.xp_history.drain()
+        if gains:
+            await self.bot.storage.record_xp_gains(gains)
+    
+    @tasks.loop(minutes=5)
+    async def settle_voice_xp(self):
+        """Turn banked voice time into XP with one batched write"""
+        gains = self.voice.drain()
+        if not gains:
+            return
+        # Snapshot the drained tracker before paying out: after a crash the restored state
+        # must not hold time that was already written as XP
+        try:
+            await self.bot.snapshot.save()
+        except Exception as e:
+            print(f'Failed to save snapshot before settling voice XP: {e}')
+        rows = await self.bot.storage.add_xp_many(gains)
+        for guild_id, user_id, amount in gains:
+            self.xp_history.record(guild_id, user_id, amount)
+        
+        changes = defaultdict(list)
+        for guild_id, user_id, xp, level in rows:
+            new_level = (await self.get_curve(guild_id)).level_for(xp)
+            if new_level != level:
+                changes[guild_id].append((user_id, new_level, level))
+        for guild_id, members in changes.items():
+            await self.bot.storage.set_levels(guild_id, [(user_id, new) for user_id, new, _ in members])
+            for user_id, new_level, old_level in members:
+                if new_level > old_level:
+                    await self.announce_level_up(guild_id, user_id, new_level)
+    
+    @settle_voice_xp.before_loop
+    async def before_settle_voice_xp(self):
+        # Restored banked time belongs to members who are only known once voice states arrive
+        await self.bot.wait_until_ready()
+    
+    @tasks.loop(hours=1)
+    async def compact_xp_history(self):
+        """Roll old XP history into daily and weekly buckets"""
+        await self.bot.storage.compact_xp_history(*compaction_cutoffs())
+    
+    @property
+    def reddit(self):
+        """Reddit client, created on first use so praw is not imported at startup"""
+        if self._reddit is None:
+            import praw
+            self._reddit = praw.Reddit(
+                client_id=os.getenv('REDDIT_CLIENT_ID'),
+                client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
+                user_agent="discord_bot:v1.0"
+            )
+        return self._reddit
         
     @commands.command()
     async def trivia(self, ctx):
@@ -50,45 +149,57 @@ class Fun(commands.Cog):
                 answer_text += f"{letter}. {discord.utils.escape_markdown(answer)}\n"
             embed.add_field(name="Answers", value=answer_text, inline=False)
             
-            # Store session data
-            self.trivia_sessions[ctx.channel.id] = {
+            # Store session data; it is also saved in restart snapshots
+            session = self.trivia_sessions[ctx.channel.id] = {
                 'correct_answer': correct_answer,
-                'answers': answers
+                'answers': answers,
+                'deadline': time.time() + TRIVIA_TIMEOUT
             }
             
             await ctx.send(embed=embed)
-            
-            def check(m):
-                return (m.channel == ctx.channel and 
-                       m.content.upper() in ['A', 'B', 'C', 'D'])
-            
-            try:
-                msg = await self.bot.wait_for('message', timeout=30.0, check=check)
-                
-                # Get selected answer
-                selected_idx = ord(msg.content.upper()) - 65
-                selected_answer = answers[selected_idx]
-                
-                if selected_answer == correct_answer:
-                    await ctx.send(f"🎉 Correct, {msg.author.mention}! The answer was: {correct_answer}")
-                    await self.add_xp(msg.author.id, ctx.guild.id, 10)
-                else:
-                    await ctx.send(f"❌ Sorry, that's wrong! The correct answer was: {correct_answer}")
-            except:
-                await ctx.send(f"Time's up! The correct answer was: {correct_answer}")
-            
-            del self.trivia_sessions[ctx.channel.id]
+            await self.wait_for_answer(ctx.channel, session)
+    
+    async def wait_for_answer(self, channel, session):
+        """Wait for the first A-D reply until the session's deadline and announce the result"""
+        correct_answer = session['correct_answer']
+        answers = session['answers']
+        
+        def check(m):
+            return (m.channel == channel and 
+                   m.content.upper() in ['A', 'B', 'C', 'D'])
+        
+        try:
+            msg = await self.bot.wait_for('message', timeout=max(session['deadline'] - time.time(), 0),
+                                          check=check)
+        except asyncio.TimeoutError:
+            msg = None
+        # Cancellation at shutdown skips this, so the session stays in the snapshot
+        self.trivia_sessions.pop(channel.id, None)
+        
+        if msg is None:
+            await channel.send(f"Time's up! The correct answer was: {correct_answer}")
+            return
+        
+        # Get selected answer
+        selected_idx = ord(msg.content.upper()) - 65
+        selected_answer = answers[selected_idx]
+        
+        if selected_answer == correct_answer:
+            await channel.send(f"🎉 Correct, {msg.author.mention}! The answer was: {correct_answer}")
+            await self.add_xp(msg.author.id, channel.guild.id, 10)
+        else:
+            await channel.send(f"❌ Sorry, that's wrong! The correct answer was: {correct_answer}")
+    
+    def fetch_memes(self):
+        return [submission for submission in self.reddit.subreddit('memes').hot(limit=50)
+                if not submission.stickied and submission.url.endswith(('.jpg', '.png', '.gif'))]
     
     @commands.command()
     async def meme(self, ctx):
         """Get a random meme from Reddit"""
-        subreddit = self.reddit.subreddit('memes')
-        memes = []
-        
         async with ctx.typing():
-            for submission in subreddit.hot(limit=50):
-                if not submission.stickied and submission.url.endswith(('.jpg', '.png', '.gif')):
-                    memes.append(submission)
+            # praw is synchronous; fetching in a thread keeps the event loop responsive
+            memes = await self.bot.loop.run_in_executor(None, self.fetch_memes)
             
             if memes:
                 meme = random.choice(memes)
@@ -101,117 +212,199 @@ class Fun(commands.Cog):
     
     @commands.command()
     async def addcommand(self, ctx, command_name: str, *, response: str):
-        """Add a custom command"""
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    INSERT INTO custom_commands (guild_id, command, response)
-                    VALUES (?, ?, ?)
-                ''', (ctx.guild.id, command_name.lower(), response))
-                conn.commit()
-                await ctx.send(f"✅ Custom command `{command_name}` added successfully!")
-            except sqlite3.IntegrityError:
-                await ctx.send("This command already exists!")
+        """Add a custom command. The response may use {user}, {mention}, {args}, {count} and {choice:a|b}"""
+        try:
+            template = compile_template(response, self.templates.limits)
+        except TemplateError as e:
+            await ctx.send(f"❌ {e}")
+            return
+        name = command_name.lower()
+        if await self.bot.storage.add_custom_command(ctx.guild.id, name, response):
+            self.templates.put(ctx.guild.id, name, template)
+            await ctx.send(f"✅ Custom command `{command_name}` added successfully!")
+        else:
+            await ctx.send("This command already exists!")
     
     @commands.command()
-    async def level(self, ctx, member: discord.Member = None):
+    async def level(self, ctx, member: IndexedMember = None):
         """Check your or someone else's level"""
         member = member or ctx.author
         
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT xp, level FROM user_xp
-                WHERE user_id = ? AND guild_id = ?
-            ''', (member.id, ctx.guild.id))
-            result = cursor.fetchone()
+        result = await self.bot.storage.get_xp(ctx.guild.id, member.id)
+        if result:
+            xp, level = result
+            curve = await self.get_curve(ctx.guild.id)
+            _, into_level, level_span = curve.progress(xp)
+            embed = discord.Embed(
+                title=f"Level Stats for {member.display_name}",
+                color=member.color
+            )
+            embed.add_field(name="Level", value=level, inline=True)
+            embed.add_field(name="XP", value=xp, inline=True)
+            embed.add_field(
+                name="Progress to Next Level",
+                value=f"{into_level}/{level_span} XP",
+                inline=False
+            )
             
-            if result:
-                xp, level = result
-                embed = discord.Embed(
-                    title=f"Level Stats for {member.display_name}",
-                    color=member.color
-                )
-                embed.add_field(name="Level", value=level, inline=True)
-                embed.add_field(name="XP", value=xp, inline=True)
-                embed.add_field(
-                    name="Progress to Next Level",
-                    value=f"{xp % 100}/100 XP",
-                    inline=False
-                )
+            card = await self.bot.renderer.render_file('rank_card', {
+                'name': member.display_name,
+                'level': level,
+                'xp': xp,
+                'into_level': into_level,
+                'level_span': level_span,
+            }, 'rank.png', member.display_avatar.with_format('png').with_size(128).url)
+            if card:
+                embed.set_image(url='attachment://rank.png')
+                await ctx.send(embed=embed, file=card)
+            else:
                 embed.set_thumbnail(url=member.avatar.url if member.avatar else member.default_avatar.url)
                 await ctx.send(embed=embed)
-            else:
-                await ctx.send(f"{member.display_name} hasn't earned any XP yet!")
+        else:
+            await ctx.send(f"{member.display_name} hasn't earned any XP yet!")
+    
+    async def get_curve(self, guild_id):
+        """Get the level curve configured for a guild"""
+        curve = self.level_curves.get(guild_id)
+        if curve is None:
+            result = await self.bot.storage.get_level_curve(guild_id)
+            curve = curve_from_config(*result) if result else DEFAULT_CURVE
+            self.level_curves[guild_id] = curve
+        return curve
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def levelcurve(self, ctx, kind: str = None, *params: int):
+        """Show or change the server's level curve and recompute every level"""
+        if kind is None:
+            curve = await self.get_curve(ctx.guild.id)
+            await ctx.send(f"Current level curve: {curve.describe()}\n"
+                           f"Types: {', '.join(CURVES)}")
+            return
+        
+        try:
+            curve = curve_from_config(kind.lower(), params)
+        except (ValueError, TypeError) as e:
+            await ctx.send(f"❌ Invalid curve: {e}")
+            return
+        
+        async with ctx.typing():
+            changed = await self.recompute_levels(ctx.guild.id, curve)
+        await ctx.send(f"✅ Level curve set to {curve.describe()}. Updated {changed} levels.")
+    
+    async def recompute_levels(self, guild_id, curve):
+        """Store a new curve and rewrite every level in the guild in one pass"""
+        storage = self.bot.storage
+        rows = await storage.guild_xp(guild_id)
+        
+        levels = await self.bot.loop.run_in_executor(None, curve.levels_for, [xp for _, xp, _ in rows])
+        updates = [(user_id, new_level)
+                   for (user_id, _, old_level), new_level in zip(rows, levels)
+                   if new_level != old_level]
+        
+        await storage.set_levels(guild_id, updates)
+        await storage.set_level_curve(guild_id, *curve.to_config())
+        self.level_curves[guild_id] = curve
+        return len(updates)
     
     async def add_xp(self, user_id, guild_id, xp_amount):
         """Add XP to a user"""
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            
-            # Get current XP and level
-            cursor.execute('''
-                INSERT OR IGNORE INTO user_xp (user_id, guild_id, xp, level)
-                VALUES (?, ?, 0, 0)
-            ''', (user_id, guild_id))
-            
-            cursor.execute('''
-                SELECT xp, level FROM user_xp
-                WHERE user_id = ? AND guild_id = ?
-            ''', (user_id, guild_id))
-            
-            current_xp, current_level = cursor.fetchone()
-            new_xp = current_xp + xp_amount
-            
-            # Check for level up (every 100 XP)
-            new_level = new_xp // 100
-            if new_level > current_level:
-                # Get the channel to send level up message
-                guild = self.bot.get_guild(guild_id)
-                if guild:
-                    member = guild.get_member(user_id)
-                    if member:
-                        # Try to find a suitable channel to send the message
-                        for channel in guild.text_channels:
-                            try:
-                                await channel.send(
-                                    f"🎉 Congratulations {member.mention}! "
-                                    f"You've reached level {new_level}!"
-                                )
-                                break
-                            except:
-                                continue
-            
-            # Update the database
-            cursor.execute('''
-                UPDATE user_xp
-                SET xp = ?, level = ?
-                WHERE user_id = ? AND guild_id = ?
-            ''', (new_xp, new_level, user_id, guild_id))
-            
-            conn.commit()
+        new_xp, current_level = await self.bot.storage.add_xp(guild_id, user_id, xp_amount)
+        self.xp_history.record(guild_id, user_id, xp_amount)
+        
+        # Check for level up using the guild's level curve
+        new_level = (await self.get_curve(guild_id)).level_for(new_xp)
+        if new_level == current_level:
+            return
+        await self.bot.storage.set_level(guild_id, user_id, new_level)
+        
+        if new_level > current_level:
+            await self.announce_level_up(guild_id, user_id, new_level)
+    
+    async def announce_level_up(self, guild_id, user_id, new_level):
+        # Get the channel to send level up message
+        guild = self.bot.get_guild(guild_id)
+        if guild:
+            member = guild.get_member(user_id)
+            if member:
+                # Try to find a suitable channel to send the message
+                for channel in guild.text_channels:
+                    try:
+                        await channel.send(
+                            f"🎉 Congratulations {member.mention}! "
+                            f"You've reached level {new_level}!"
+                        )
+                        break
+                    except:
+                        continue
     
     @commands.Cog.listener()
     async def on_message(self, message):
         """Add XP for messages"""
         if not message.author.bot and message.guild:
-            await self.add_xp(message.author.id, message.guild.id, random.randint(1, 5))
+            # Cooldown and diminishing returns keep spammers from farming XP
+            now = time.time()
+            multiplier = self.xp_cooldown.peek(message.guild.id, message.author.id, now)
+            if multiplier:
+                amount = max(1, round(random.randint(1, 5) * multiplier))
+                # Lowest priority: dropped first when the server's queue is overloaded.
+                # The cooldown is only charged for XP that was actually queued.
+                if self.bot.dispatcher.submit(message.guild.id, XP, self.add_xp,
+                                              message.author.id, message.guild.id, amount):
+                    self.xp_cooldown.grant(message.guild.id, message.author.id, now)
+    
+    @staticmethod
+    def voice_state(guild, state):
+        """(channel_id, active) for a voice state; channel_id is None outside earning channels"""
+        if state is None or state.channel is None or state.channel == guild.afk_channel:
+            return None, False
+        return state.channel.id, not (state.self_mute or state.mute or state.self_deaf or state.deaf)
     
     @commands.Cog.listener()
-    async def on_command(self, ctx):
-        """Process custom commands"""
-        if ctx.command is None and not ctx.author.bot:
-            with sqlite3.connect('bot.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT response FROM custom_commands
-                    WHERE guild_id = ? AND command = ?
-                ''', (ctx.guild.id, ctx.invoked_with.lower()))
-                result = cursor.fetchone()
-                
-                if result:
-                    await ctx.send(result[0])
+    async def on_voice_state_update(self, member, before, after):
+        """Open and close voice XP intervals"""
+        if not member.bot:
+            self.voice.update(member.guild.id, member.id, *self.voice_state(member.guild, after))
+    
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Rebuild voice sessions from the current voice states, including after a restart"""
+        for guild in self.bot.guilds:
+            self.voice.sync_guild(guild.id, [
+                (member.id, *self.voice_state(guild, member.voice))
+                for channel in guild.voice_channels + guild.stage_channels
+                for member in channel.members if not member.bot
+            ])
+    
+    async def run_custom_command(self, ctx):
+        """Reply with a custom command's response. Returns False if there is no such command"""
+        name = ctx.invoked_with.lower()
+        found, template = self.templates.get(ctx.guild.id, name)
+        if not found:
+            source = await self.bot.storage.get_custom_command(ctx.guild.id, name)
+            try:
+                template = source and compile_template(source, self.templates.limits)
+            except TemplateError:
+                # Stored as plain text before templates existed, or under different limits
+                template = literal_template(source)
+            # Unknown names are cached too, so mistyped commands don't cost a query each time
+            self.templates.put(ctx.guild.id, name, template)
+        if template is None:
+            return False
+
+        context = {
+            'user': ctx.author.display_name,
+            'mention': ctx.author.mention,
+            'server': ctx.guild.name,
+            'channel': ctx.channel.name,
+            'args': ctx.view.read_rest().strip(),
+        }
+        if 'count' in template.variables:
+            context['count'] = str(await self.bot.storage.count_custom_command_use(ctx.guild.id, name))
+        response = template.render(context, self.templates.limits)
+        if response:
+            await ctx.send(response, allowed_mentions=discord.AllowedMentions(everyone=False, roles=False))
+        return True
 
 async def setup(bot):
     await bot.add_cog(Fun(bot)) 
\ No newline at end of file
@@ -1,17 +1,154 @@
 import discord
 from discord.ext import commands
 import asyncio
-from better_profanity import profanity
-import sqlite3
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from utils import image_hash
+from utils.dispatch import MODERATION
+from utils.escalation import HORIZON, MAX_RULE_WARNINGS, WarningTracker
+from utils.image_hash import ImageSpamDetector
+from utils.link_filter import LinkFilter, load_blocklist, normalize_domain
+from utils.member_index import IndexedMember, IndexedRole
+
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+BULK_DELETE_MAX_AGE = timedelta(days=14, minutes=-5)  # Discord rejects bulk deletes of older messages
+PURGE_PROGRESS_INTERVAL = 5
+BLOCKLIST_PATH = os.getenv('LINK_BLOCKLIST', 'blocklist.txt')
+IMAGE_FLOOD_COPIES = 4            # near-identical images in the window that count as a flood
+IMAGE_HASH_MAX_BYTES = 8 * 1024 * 1024
+
+def parse_duration(text):
+    """Convert strings like 30s, 5m, 1h or 2d to seconds; None if invalid"""
+    try:
+        return int(text[:-1]) * TIME_UNITS[text[-1].lower()]
+    except (ValueError, KeyError, IndexError):
+        return None
+
+def format_duration(seconds):
+    """Inverse of parse_duration, using the largest unit that divides evenly"""
+    for unit, size in sorted(TIME_UNITS.items(), key=lambda item: -item[1]):
+        if seconds % size == 0:
+            return f'{seconds // size}{unit}'
+
+class PurgeFlags(commands.FlagConverter, delimiter=':', prefix=''):
+    user: IndexedMember = None
+    match: str = None
+    attachments: bool = False
+    newer: str = None
+    older: str = None
 
 class Moderation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.profanity = None
+        self.profanity_loading = None  # future shared by every message waiting for the word list
+        self.link_filter = LinkFilter()
+        self.image_spam = ImageSpamDetector()
+        # Pillow releases the GIL while decoding, so threads are enough and avoid copying images to processes
+        self.hash_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-hash')
+        self.pending_unmutes = {}  # (guild_id, member_id) -> (unmute_at, channel_id)
+        self.warn_tracker = WarningTracker()
+        self.unmute_tasks = {}
+    
+    async def cog_load(self):
+        self.bot.snapshot.register('mutes', self.dump_mutes, self.load_mutes)
+        self.bot.snapshot.register('image_spam', self.image_spam.dump_state, self.image_spam.load_state)
+        # Invites and per-server rules are enforced right away; the global blocklist joins once loaded
+        self.blocklist_task = asyncio.create_task(self.load_blocklist())
+    
+    async def cog_unload(self):
+        self.hash_pool.shutdown(wait=False)
+    
+    def dump_mutes(self):
+        return dict(self.pending_unmutes)
+    
+    def load_mutes(self, pending):
+        # Timed mutes that expired while the bot was down are lifted as soon as it is ready
+        for (guild_id, member_id), (unmute_at, channel_id) in pending.items():
+            self.schedule_unmute(guild_id, member_id, channel_id, unmute_at)
+    
+    def schedule_unmute(self, guild_id, member_id, channel_id, unmute_at):
+        key = (guild_id, member_id)
+        self.cancel_unmute(guild_id, member_id)
+        self.pending_unmutes[key] = (unmute_at, channel_id)
+        self.unmute_tasks[key] = self.bot.loop.create_task(self.unmute_later(guild_id, member_id))
+    
+    def cancel_unmute(self, guild_id, member_id):
+        self.pending_unmutes.pop((guild_id, member_id), None)
+        task = self.unmute_tasks.pop((guild_id, member_id), None)
+        if task:
+            task.cancel()
+    
+    async def unmute_later(self, guild_id, member_id):
+        unmute_at, channel_id = self.pending_unmutes[(guild_id, member_id)]
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(max(unmute_at - time.time(), 0))
+        del self.pending_unmutes[(guild_id, member_id)]
+        del self.unmute_tasks[(guild_id, member_id)]
+        
+        guild = self.bot.get_guild(guild_id)
+        member = guild.get_member(member_id) if guild else None
+        muted_role = discord.utils.get(guild.roles, name="Muted") if guild else None
+        if member is None or muted_role not in member.roles:
+            return
+        try:
+            await member.remove_roles(muted_role)
+            channel = guild.get_channel(channel_id)
+            if channel:
+                await channel.send(f'🔊 Unmuted {member.mention}')
+        except discord.HTTPException:
+            pass
+    
+    def load_profanity(self):
+        """Import better_profanity and load its word list"""
+        from better_profanity import profanity
         profanity.load_censor_words()
+        return profanity
+    
+    async def load_blocklist(self):
+        """Build the domain blocklist off the event loop"""
+        started = time.perf_counter()
+        blocklist = await self.bot.loop.run_in_executor(None, load_blocklist, BLOCKLIST_PATH)
+        self.link_filter.set_blocklist(blocklist)
+        print(f'Loaded {len(blocklist)} blocked domains in {time.perf_counter() - started:.1f}s')
+    
+    async def fingerprint(self, attachment):
+        """Perceptual hash of an image attachment, or None if it is not a hashable image"""
+        if not (attachment.content_type or '').startswith('image/') or attachment.size > IMAGE_HASH_MAX_BYTES:
+            return None
+        # Dimensions reported by Discord let oversized images be skipped without downloading them
+        if (attachment.width or 0) * (attachment.height or 0) > image_hash.MAX_PIXELS:
+            return None
+        try:
+            data = await attachment.read()
+            return await self.bot.loop.run_in_executor(self.hash_pool, image_hash.dhash, data)
+        except Exception:  # failed downloads and undecodable images are not spam evidence
+            return None
+    
+    async def is_image_flood(self, message):
+        """Record the message's images and report whether any is part of a near-duplicate flood"""
+        fingerprints = await asyncio.gather(*(self.fingerprint(a) for a in message.attachments))
+        flood = False
+        for fingerprint in fingerprints:
+            if fingerprint is None:
+                continue
+            earlier = self.image_spam.check(message.guild.id, fingerprint, message.id)
+            if len(earlier) + 1 >= IMAGE_FLOOD_COPIES:
+                flood = True
+        return flood
+    
+    async def load_link_rules(self, guild_id, reload=False):
+        """Fetch a guild's allow and deny lists from storage the first time they are needed"""
+        if reload or guild_id not in self.link_filter.guilds:
+            self.link_filter.set_rules(guild_id, await self.bot.storage.get_link_rules(guild_id))
+        return self.link_filter.guilds[guild_id]
         
     @commands.command()
     @commands.has_permissions(kick_members=True)
-    async def kick(self, ctx, member: discord.Member, *, reason=None):
+    async def kick(self, ctx, member: IndexedMember, *, reason=None):
         """Kick a member from the server"""
         await member.kick(reason=reason)
         await ctx.send(f'👢 Kicked {member.mention}' + (f' for: {reason}' if reason else ''))
@@ -21,7 +158,7 @@ class Moderation(commands.Cog):
     
     @commands.command()
     @commands.has_permissions(ban_members=True)
-    async def ban(self, ctx, member: discord.Member, *, reason=None):
+    async def ban(self, ctx, member: IndexedMember, *, reason=None):
         """Ban a member from the server"""
         await member.ban(reason=reason)
         await ctx.send(f'🔨 Banned {member.mention}' + (f' for: {reason}' if reason else ''))
@@ -29,47 +166,158 @@ class Moderation(commands.Cog):
         # Log the ban
         await self.log_action(ctx.guild, 'Ban', member, reason)
     
-    @commands.command()
-    @commands.has_permissions(manage_roles=True)
-    async def mute(self, ctx, member: discord.Member, duration: str = None):
-        """Mute a member"""
-        # Get or create muted role
-        muted_role = discord.utils.get(ctx.guild.roles, name="Muted")
+    async def get_muted_role(self, guild):
+        """Get or create the Muted role"""
+        muted_role = discord.utils.get(guild.roles, name="Muted")
         if not muted_role:
-            muted_role = await ctx.guild.create_role(name="Muted")
+            muted_role = await guild.create_role(name="Muted")
             
             # Set up permissions for the muted role
-            for channel in ctx.guild.channels:
+            for channel in guild.channels:
                 await channel.set_permissions(muted_role, speak=False, send_messages=False)
+        return muted_role
+    
+    @commands.command()
+    @commands.has_permissions(manage_roles=True)
+    async def mute(self, ctx, member: IndexedMember, duration: str = None):
+        """Mute a member"""
+        seconds = parse_duration(duration) if duration else None
+        if duration and seconds is None:
+            await ctx.send("Invalid duration format. Use: number + s/m/h/d (e.g., 30s, 5m, 1h, 1d)")
+            return
         
+        muted_role = await self.get_muted_role(ctx.guild)
         await member.add_roles(muted_role)
         
         if duration:
-            # Convert duration string to seconds
-            time_convert = {"s": 1, "m": 60, "h": 3600, "d": 86400}
-            try:
-                time = int(duration[:-1]) * time_convert[duration[-1]]
-                await ctx.send(f'🔇 Muted {member.mention} for {duration}')
-                await asyncio.sleep(time)
-                await member.remove_roles(muted_role)
-                await ctx.send(f'🔊 Unmuted {member.mention}')
-            except:
-                await ctx.send("Invalid duration format. Use: number + s/m/h/d (e.g., 30s, 5m, 1h, 1d)")
-                return
+            # Scheduled rather than slept on here, so the unmute survives a restart
+            self.schedule_unmute(ctx.guild.id, member.id, ctx.channel.id, time.time() + seconds)
+            await ctx.send(f'🔇 Muted {member.mention} for {duration}')
         else:
+            self.cancel_unmute(ctx.guild.id, member.id)
             await ctx.send(f'🔇 Muted {member.mention} indefinitely')
     
     @commands.command()
     @commands.has_permissions(manage_roles=True)
-    async def unmute(self, ctx, member: discord.Member):
+    async def unmute(self, ctx, member: IndexedMember):
         """Unmute a member"""
         muted_role = discord.utils.get(ctx.guild.roles, name="Muted")
+        self.cancel_unmute(ctx.guild.id, member.id)
         if muted_role in member.roles:
             await member.remove_roles(muted_role)
             await ctx.send(f'🔊 Unmuted {member.mention}')
         else:
             await ctx.send(f'{member.mention} is not muted')
     
+    async def load_warn_rules(self, guild_id, reload=False):
+        if reload or not self.warn_tracker.loaded(guild_id):
+            self.warn_tracker.set_rules(guild_id, await self.bot.storage.get_warn_rules(guild_id))
+        return self.warn_tracker.rules[guild_id]
+    
+    @commands.command()
+    @commands.has_permissions(kick_members=True)
+    async def warn(self, ctx, member: IndexedMember, *, reason=None):
+        """Warn a member; repeated warnings can lead to an automatic mute"""
+        now = time.time()
+        await self.load_warn_rules(ctx.guild.id)
+        if self.warn_tracker.needs_seed(ctx.guild.id, member.id):
+            # First warning since startup: load the member's recent history once
+            since = now - self.warn_tracker.longest_window(ctx.guild.id)
+            rows = await self.bot.storage.get_warnings(ctx.guild.id, [member.id], since)
+            self.warn_tracker.seed(ctx.guild.id, member.id, [row[4] for row in rows])
+        
+        await self.bot.storage.add_warning(ctx.guild.id, member.id, ctx.author.id, reason, now)
+        rule = self.warn_tracker.record(ctx.guild.id, member.id, now)
+        await ctx.send(f'⚠️ Warned {member.mention}' + (f' for: {reason}' if reason else ''))
+        await self.log_action(ctx.guild, 'Warn', member, reason)
+        if rule:
+            await self.escalate(ctx, member, rule, now)
+    
+    async def escalate(self, ctx, member, rule, now):
+        """Apply a warn rule's timed mute unless a longer mute is already in place"""
+        muted_role = await self.get_muted_role(ctx.guild)
+        pending = self.pending_unmutes.get((ctx.guild.id, member.id))
+        if muted_role in member.roles and (pending is None or pending[0] >= now + rule.mute):
+            return
+        await member.add_roles(muted_role, reason='Warning escalation')
+        self.schedule_unmute(ctx.guild.id, member.id, ctx.channel.id, now + rule.mute)
+        summary = f'{rule.warnings} warnings within {format_duration(rule.window)}'
+        await ctx.send(f'🔇 Muted {member.mention} for {format_duration(rule.mute)} ({summary})')
+        await self.log_action(ctx.guild, 'Mute', member, f'Automatic: {summary}')
+    
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(kick_members=True)
+    async def warnings(self, ctx, members: commands.Greedy[IndexedMember]):
+        """Show a member's warnings, or warning counts for several members"""
+        if not members:
+            await ctx.send('Please mention at least one member')
+            return
+        rows = await self.bot.storage.get_warnings(ctx.guild.id, [member.id for member in members])
+        if len(members) == 1:
+            member = members[0]
+            embed = discord.Embed(title=f"⚠️ Warnings for {member.display_name}",
+                                  description=f"{len(rows)} warning(s)", color=discord.Color.orange())
+            for user_id, warning_id, moderator_id, reason, created_at in rows[-10:][::-1]:
+                embed.add_field(name=f"#{warning_id} · <t:{int(created_at)}:R>",
+                                value=f"{reason or 'No reason given'} (by <@{moderator_id}>)", inline=False)
+        else:
+            counts = {member.id: 0 for member in members}
+            for row in rows:
+                counts[row[0]] += 1
+            embed = discord.Embed(title="⚠️ Warnings", color=discord.Color.orange(),
+                                  description='\n'.join(f"{member.mention}: {counts[member.id]}"
+                                                        for member in members))
+        await ctx.send(embed=embed)
+    
+    @warnings.command(name='clear')
+    @commands.has_permissions(kick_members=True)
+    async def warnings_clear(self, ctx, member: IndexedMember):
+        """Delete all of a member's warnings"""
+        removed = await self.bot.storage.clear_warnings(ctx.guild.id, member.id)
+        self.warn_tracker.forget(ctx.guild.id, member.id)
+        await ctx.send(f'✅ Cleared {removed} warning(s) for {member.mention}')
+        await self.log_action(ctx.guild, 'Clear Warnings', member, f'{removed} removed by {ctx.author}')
+    
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(manage_guild=True)
+    async def warnrule(self, ctx):
+        """Show the warning escalation rules"""
+        rules = await self.load_warn_rules(ctx.guild.id)
+        if not rules:
+            await ctx.send('No warning rules are set up. Add one with `warnrule add <warnings> <window> <mute>`')
+            return
+        lines = [f'{rule.warnings} warnings within {format_duration(rule.window)} → '
+                 f'{format_duration(rule.mute)} mute' for rule in sorted(rules, key=lambda r: r.warnings)]
+        await ctx.send('📋 Warning rules:\n' + '\n'.join(lines))
+    
+    @warnrule.command(name='add')
+    @commands.has_permissions(manage_guild=True)
+    async def warnrule_add(self, ctx, warnings: int, window: str, mute: str):
+        """Mute members who reach <warnings> warnings within <window> for <mute>"""
+        window_seconds, mute_seconds = parse_duration(window), parse_duration(mute)
+        if window_seconds is None or mute_seconds is None:
+            await ctx.send("Invalid duration format. Use: number + s/m/h/d (e.g., 30s, 5m, 1h, 1d)")
+            return
+        if not 1 <= warnings <= MAX_RULE_WARNINGS:
+            await ctx.send(f'Warnings must be between 1 and {MAX_RULE_WARNINGS}')
+            return
+        if not 0 < window_seconds <= HORIZON or mute_seconds <= 0:
+            await ctx.send(f'The window must be at most {format_duration(HORIZON)} and the mute longer than 0s')
+            return
+        await self.bot.storage.set_warn_rule(ctx.guild.id, warnings, window_seconds, mute_seconds)
+        await self.load_warn_rules(ctx.guild.id, reload=True)
+        await ctx.send(f'✅ {warnings} warnings within {window} now lead to a {mute} mute')
+    
+    @warnrule.command(name='remove')
+    @commands.has_permissions(manage_guild=True)
+    async def warnrule_remove(self, ctx, warnings: int):
+        """Remove the rule for a warning count"""
+        if await self.bot.storage.remove_warn_rule(ctx.guild.id, warnings):
+            await self.load_warn_rules(ctx.guild.id, reload=True)
+            await ctx.send(f'✅ Removed the rule for {warnings} warnings')
+        else:
+            await ctx.send(f'There is no rule for {warnings} warnings')
+    
     @commands.command()
     @commands.has_permissions(manage_channels=True)
     async def slowmode(self, ctx, seconds: int):
@@ -82,7 +330,7 @@ class Moderation(commands.Cog):
     
     @commands.command()
     @commands.has_permissions(administrator=True)
-    async def massrole(self, ctx, role: discord.Role, action: str):
+    async def massrole(self, ctx, role: IndexedRole, action: str):
         """Mass assign or remove a role from all members"""
         if action.lower() not in ['add', 'remove']:
             await ctx.send('Please specify "add" or "remove"')
@@ -100,40 +348,204 @@ class Moderation(commands.Cog):
         
         await ctx.send(f'✅ Mass role {action} completed for role: {role.name}')
     
+    @commands.command(aliases=['clear'])
+    @commands.has_permissions(manage_messages=True)
+    @commands.bot_has_permissions(manage_messages=True, read_message_history=True)
+    async def purge(self, ctx, amount: int, *, flags: PurgeFlags):
+        """Delete matching messages among the last <amount> in this channel"""
+        if not 1 <= amount <= 100000:
+            await ctx.send('Amount must be between 1 and 100000')
+            return
+        
+        try:
+            pattern = re.compile(flags.match, re.IGNORECASE) if flags.match else None
+        except re.error as e:
+            await ctx.send(f'Invalid regex: {e}')
+            return
+        
+        now = discord.utils.utcnow()
+        after = before = None
+        for name in ('newer', 'older'):
+            value = getattr(flags, name)
+            if value:
+                seconds = parse_duration(value)
+                if seconds is None:
+                    await ctx.send(f"Invalid {name} value. Use: number + s/m/h/d (e.g., 30m, 2d)")
+                    return
+                if name == 'newer':
+                    after = now - timedelta(seconds=seconds)
+                else:
+                    before = now - timedelta(seconds=seconds)
+        
+        def matches(message):
+            if flags.user and message.author.id != flags.user.id:
+                return False
+            if flags.attachments and not message.attachments:
+                return False
+            if pattern and not pattern.search(message.content):
+                return False
+            return True
+        
+        status = await ctx.send('🗑️ Purging...')
+        bulk_cutoff = now - BULK_DELETE_MAX_AGE
+        batch = []
+        scanned = deleted = 0
+        started = last_report = time.perf_counter()
+        
+        async def flush():
+            nonlocal deleted, batch
+            if batch:
+                try:
+                    await ctx.channel.delete_messages(batch)
+                    deleted += len(batch)
+                except discord.NotFound:
+                    pass
+                batch = []
+        
+        history = ctx.channel.history(limit=amount, before=before or ctx.message, after=after,
+                                      oldest_first=False)
+        async for message in history:
+            scanned += 1
+            if message.id == status.id or not matches(message):
+                continue
+            
+            if message.created_at > bulk_cutoff:
+                batch.append(message)
+                if len(batch) == 100:
+                    await flush()
+            else:
+                # Too old for bulk delete; remove one at a time
+                try:
+                    await message.delete()
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+            
+            if time.perf_counter() - last_report >= PURGE_PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                rate = deleted / (last_report - started)
+                await status.edit(content=f'🗑️ Purging... scanned {scanned}, deleted {deleted} '
+                                          f'({rate:.0f} msg/s)')
+        await flush()
+        
+        elapsed = time.perf_counter() - started
+        await status.edit(content=f'✅ Deleted {deleted} of {scanned} scanned messages in {elapsed:.1f}s '
+                                  f'({deleted / max(elapsed, 0.001):.0f} msg/s)')
+        await self.log_action(ctx.guild, 'Purge', ctx.channel, f'{deleted} messages deleted by {ctx.author}')
+    
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(manage_guild=True)
+    async def linkfilter(self, ctx):
+        """Show the link filter rules for this server"""
+        rules = (await self.load_link_rules(ctx.guild.id)).rules
+        allowed = sorted(domain for domain, action in rules.items() if action == 'allow')
+        denied = sorted(domain for domain, action in rules.items() if action == 'deny')
+        embed = discord.Embed(title="🔗 Link Filter", color=discord.Color.blue())
+        embed.add_field(name="Allowed", value=', '.join(allowed)[:1024] or 'None', inline=False)
+        embed.add_field(name="Blocked", value=', '.join(denied)[:1024] or 'None', inline=False)
+        stats = self.link_filter.stats
+        checked = stats['hits'] + stats['misses']
+        embed.set_footer(text=f"{len(self.link_filter.blocklist)} domains on the global blocklist · "
+                              f"{stats['hits'] / max(checked, 1):.0%} of {checked} lookups cached · "
+                              f"invite links are blocked unless discord.gg is allowed")
+        await ctx.send(embed=embed)
+    
+    async def set_link_rule(self, ctx, domain, action):
+        domain = normalize_domain(domain)
+        if '.' not in domain:
+            await ctx.send('Please give a domain such as example.com')
+            return
+        await self.bot.storage.set_link_rule(ctx.guild.id, domain, action)
+        await self.load_link_rules(ctx.guild.id, reload=True)
+        await ctx.send(f'✅ Links to {domain} and its subdomains are now {"allowed" if action == "allow" else "blocked"}')
+    
+    @linkfilter.command(name='allow')
+    @commands.has_permissions(manage_guild=True)
+    async def linkfilter_allow(self, ctx, domain: str):
+        """Always allow links to a domain (use discord.gg to allow invites)"""
+        await self.set_link_rule(ctx, domain, 'allow')
+    
+    @linkfilter.command(name='deny')
+    @commands.has_permissions(manage_guild=True)
+    async def linkfilter_deny(self, ctx, domain: str):
+        """Block links to a domain"""
+        await self.set_link_rule(ctx, domain, 'deny')
+    
+    @linkfilter.command(name='remove')
+    @commands.has_permissions(manage_guild=True)
+    async def linkfilter_remove(self, ctx, domain: str):
+        """Remove the rule for a domain"""
+        domain = normalize_domain(domain)
+        if await self.bot.storage.remove_link_rule(ctx.guild.id, domain):
+            await self.load_link_rules(ctx.guild.id, reload=True)
+            await ctx.send(f'✅ Removed the rule for {domain}')
+        else:
+            await ctx.send(f'There is no rule for {domain}')
+    
     async def log_action(self, guild, action_type, target, reason=None):
         """Log moderation actions to the designated logging channel"""
-        with sqlite3.connect('bot.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT log_channel_id FROM guild_settings WHERE guild_id = ?',
-                         (guild.id,))
-            result = cursor.fetchone()
-            
-            if result and result[0]:
-                log_channel = guild.get_channel(result[0])
-                if log_channel:
-                    embed = discord.Embed(
-                        title=f"📝 {action_type} Log",
-                        color=discord.Color.red(),
-                        timestamp=discord.utils.utcnow()
-                    )
-                    embed.add_field(name="Target", value=str(target), inline=True)
-                    embed.add_field(name="Action", value=action_type, inline=True)
-                    if reason:
-                        embed.add_field(name="Reason", value=reason, inline=False)
-                    
-                    await log_channel.send(embed=embed)
+        settings = await self.bot.storage.get_guild_settings(guild.id)
+        
+        if settings and settings['log_channel_id']:
+            log_channel = guild.get_channel(settings['log_channel_id'])
+            if log_channel:
+                embed = discord.Embed(
+                    title=f"📝 {action_type} Log",
+                    color=discord.Color.red(),
+                    timestamp=discord.utils.utcnow()
+                )
+                embed.add_field(name="Target", value=str(target), inline=True)
+                embed.add_field(name="Action", value=action_type, inline=True)
+                if reason:
+                    embed.add_field(name="Reason", value=reason, inline=False)
+                
+                await log_channel.send(embed=embed)
     
     @commands.Cog.listener()
     async def on_message(self, message):
-        """Message filter for profanity and spam"""
+        """Queue the message filter ahead of commands and XP for the message's server"""
         if message.author.bot:
             return
-            
+        if message.guild:
+            self.bot.dispatcher.submit(message.guild.id, MODERATION, self.filter_message, message)
+        else:
+            await self.filter_message(message)
+    
+    async def filter_message(self, message):
+        """Message filter for profanity, links and spam"""
+        # Word list is loaded off the event loop the first time it is needed, once for all workers
+        if self.profanity is None:
+            if self.profanity_loading is None:
+                self.profanity_loading = self.bot.loop.run_in_executor(None, self.load_profanity)
+            try:
+                self.profanity = await asyncio.shield(self.profanity_loading)
+            except Exception:
+                self.profanity_loading = None  # try again on the next message
+                raise
+        
         # Profanity check
-        if profanity.contains_profanity(message.content):
+        if self.profanity.contains_profanity(message.content):
             await message.delete()
             await message.channel.send(f"{message.author.mention} Watch your language!", delete_after=5)
             return
+        
+        # Link filter; members who can manage messages may post any link
+        if isinstance(message.author, discord.Member) and not message.author.guild_permissions.manage_messages:
+            await self.load_link_rules(message.guild.id)
+            blocked = self.link_filter.check(message.guild.id, message.content)
+            if blocked:
+                host, reason = blocked
+                await message.delete()
+                await message.channel.send(f"{message.author.mention} {reason}.", delete_after=5)
+                await self.log_action(message.guild, 'Link Blocked', message.author, f'{host}: {reason}')
+                return
+            
+        # Repeated images, from one account or many
+        if message.guild and message.attachments and image_hash.AVAILABLE:
+            if await self.is_image_flood(message):
+                await message.delete()
+                await message.channel.send(f"{message.author.mention} Please don't spam!", delete_after=5)
+                return
             
         # Basic spam check (placeholder - you might want to implement more sophisticated spam detection)
         # This is a very basic example checking for repeated messages
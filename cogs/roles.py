@@ -0,0 +1,198 @@
+import discord
+from discord.ext import commands
+from utils.member_index import IndexedRole, resolve
+from utils.name_index import NameIndex
+
+MENU_SELECT_ID = 'selfrole:select'
+MENU_CLEAR_ID = 'selfrole:clear'
+# Roles carrying any of these can never be self-assignable
+ELEVATED_PERMISSIONS = discord.Permissions(
+    administrator=True, manage_guild=True, manage_roles=True, manage_channels=True,
+    manage_messages=True, manage_webhooks=True, manage_nicknames=True, manage_emojis=True,
+    manage_threads=True, manage_events=True, kick_members=True, ban_members=True,
+    moderate_members=True, mention_everyone=True,
+)
+
+def elevated(role):
+    return bool(role.permissions.value & ELEVATED_PERMISSIONS.value)
+
+class SelfRoleMenu(discord.ui.View):
+    """Role picker message; clicks are handled by Roles.on_interaction so menus survive restarts"""
+    def __init__(self, roles):
+        super().__init__(timeout=None)
+        select = discord.ui.Select(
+            custom_id=MENU_SELECT_ID,
+            placeholder='Choose roles to add',
+            min_values=1,
+            max_values=len(roles),
+            options=[discord.SelectOption(label=role.name, value=str(role.id)) for role in roles]
+        )
+        self.add_item(select)
+        self.add_item(discord.ui.Button(label='Remove my roles', style=discord.ButtonStyle.danger,
+                                        custom_id=MENU_CLEAR_ID))
+
+class Roles(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.indexes = {}  # guild_id -> NameIndex of self-assignable roles
+
+    async def get_index(self, guild):
+        """Name index over the guild's self-assignable roles, built on first use"""
+        index = self.indexes.get(guild.id)
+        if index is None:
+            index = NameIndex()
+            for role_id in await self.bot.storage.get_self_roles(guild.id):
+                role = guild.get_role(role_id)
+                if role:
+                    index.add(role.id, role.name)
+            self.indexes[guild.id] = index
+        return index
+
+    async def resolve(self, ctx, names):
+        """Resolve comma-separated role names to allowed roles. Returns (roles, unknown names)
+
+        Only exact names count; close matches are suggested rather than granted.
+        """
+        index = await self.get_index(ctx.guild)
+        roles, unknown = [], []
+        for name in filter(None, (n.strip() for n in names.split(','))):
+            role, suggestions = resolve(index, name, ctx.guild.get_role)
+            if role and not elevated(role):
+                roles.append(role)
+            elif suggestions:
+                unknown.append(f"{name} (did you mean {', '.join(match.name for match in suggestions)}?)")
+            else:
+                unknown.append(name)
+        return roles, unknown
+
+    def assignable(self, guild, role):
+        return (not role.managed and not role.is_default() and not elevated(role)
+                and role < guild.me.top_role)
+
+    @commands.command()
+    async def getrole(self, ctx, *, role_names: str):
+        """Give yourself one or more self-assignable roles (comma-separated)"""
+        roles, unknown = await self.resolve(ctx, role_names)
+        roles = [role for role in roles if role not in ctx.author.roles]
+        if roles:
+            try:
+                # One API call for every role
+                await ctx.author.add_roles(*roles, reason='Self-assigned role')
+            except discord.Forbidden:
+                await ctx.send("❌ I don't have permission to assign that role.")
+                return
+            await ctx.send(f"✅ Added role: {', '.join(role.name for role in roles)}")
+        if unknown:
+            await ctx.send(f"❌ Role not found or not self-assignable: {', '.join(unknown)}")
+        elif not roles:
+            await ctx.send("You already have those roles.")
+
+    @commands.command()
+    async def removerole(self, ctx, *, role_names: str):
+        """Remove one or more self-assignable roles from yourself"""
+        roles, unknown = await self.resolve(ctx, role_names)
+        roles = [role for role in roles if role in ctx.author.roles]
+        if roles:
+            try:
+                await ctx.author.remove_roles(*roles, reason='Self-removed role')
+            except discord.Forbidden:
+                await ctx.send("❌ I don't have permission to remove that role.")
+                return
+            await ctx.send(f"✅ Removed role: {', '.join(role.name for role in roles)}")
+        if unknown:
+            await ctx.send(f"❌ Role not found or not self-assignable: {', '.join(unknown)}")
+        elif not roles:
+            await ctx.send("You don't have those roles.")
+
+    @commands.group(invoke_without_command=True)
+    async def selfrole(self, ctx):
+        """List the self-assignable roles"""
+        index = await self.get_index(ctx.guild)
+        roles = sorted(filter(None, map(ctx.guild.get_role, index)), reverse=True)
+        if roles:
+            await ctx.send("🎭 Self-assignable roles: " + ', '.join(role.name for role in roles))
+        else:
+            await ctx.send("No self-assignable roles have been set up yet!")
+
+    @selfrole.command(name='add')
+    @commands.has_permissions(manage_roles=True)
+    async def selfrole_add(self, ctx, *, role: IndexedRole):
+        """Allow members to assign themselves a role"""
+        if not self.assignable(ctx.guild, role):
+            await ctx.send("❌ I can't assign that role. It must be below my highest role, not managed by an "
+                           "integration and without moderation or administrator permissions.")
+            return
+        if role >= ctx.author.top_role and ctx.author != ctx.guild.owner:
+            await ctx.send("❌ You can only make roles below your highest role self-assignable.")
+            return
+        await self.bot.storage.add_self_role(ctx.guild.id, role.id)
+        (await self.get_index(ctx.guild)).add(role.id, role.name)
+        await ctx.send(f"✅ {role.name} is now self-assignable")
+
+    @selfrole.command(name='remove')
+    @commands.has_permissions(manage_roles=True)
+    async def selfrole_remove(self, ctx, *, role: IndexedRole):
+        """Stop members from assigning themselves a role"""
+        await self.bot.storage.remove_self_role(ctx.guild.id, role.id)
+        (await self.get_index(ctx.guild)).remove(role.id)
+        await ctx.send(f"✅ {role.name} is no longer self-assignable")
+
+    @commands.command()
+    @commands.has_permissions(manage_roles=True)
+    async def rolemenu(self, ctx, *, title: str = "Pick your roles"):
+        """Post a role menu for the self-assignable roles"""
+        index = await self.get_index(ctx.guild)
+        roles = sorted((role for role in map(ctx.guild.get_role, index) if role and not elevated(role)),
+                       reverse=True)[:25]
+        if not roles:
+            await ctx.send("No self-assignable roles have been set up yet!")
+            return
+        embed = discord.Embed(title=f"🎭 {title}",
+                              description='\n'.join(role.mention for role in roles),
+                              color=discord.Color.blurple())
+        await ctx.send(embed=embed, view=SelfRoleMenu(roles))
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction):
+        """Apply role menu selections in one batched API call"""
+        if interaction.type != discord.InteractionType.component or not interaction.guild:
+            return
+        custom_id = interaction.data.get('custom_id')
+        if custom_id not in (MENU_SELECT_ID, MENU_CLEAR_ID):
+            return
+
+        member = interaction.user
+        index = await self.get_index(interaction.guild)
+        # Roles given elevated permissions after being made self-assignable are skipped
+        allowed = [role for role in map(interaction.guild.get_role, index) if role and not elevated(role)]
+        try:
+            if custom_id == MENU_SELECT_ID:
+                selected = {int(value) for value in interaction.data.get('values', [])}
+                roles = [role for role in allowed if role.id in selected and role not in member.roles]
+                if roles:
+                    await member.add_roles(*roles, reason='Role menu')
+                message = f"✅ Added: {', '.join(role.name for role in roles)}" if roles else "You already have those roles."
+            else:
+                roles = [role for role in allowed if role in member.roles]
+                if roles:
+                    await member.remove_roles(*roles, reason='Role menu')
+                message = f"✅ Removed: {', '.join(role.name for role in roles)}" if roles else "You have no roles from this menu."
+        except discord.Forbidden:
+            message = "❌ I don't have permission to change those roles."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        index = self.indexes.get(after.guild.id)
+        if index and after.id in index and before.name != after.name:
+            index.add(after.id, after.name)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        index = self.indexes.get(role.guild.id)
+        if index and role.id in index:
+            index.remove(role.id)
+            await self.bot.storage.remove_self_role(role.guild.id, role.id)
+
+async def setup(bot):
+    await bot.add_cog(Roles(bot))
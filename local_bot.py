@@ -1,8 +1,14 @@
 import cmd
 import shlex
 import random
+import argparse
+import os
+import time
+from contextlib import redirect_stdout
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
+from utils.leveling import DEFAULT_CURVE
+from utils.ranking import RankIndex
 
 class LocalDiscordBot(cmd.Cmd):
     intro = """
@@ -36,7 +42,11 @@ class LocalDiscordBot(cmd.Cmd):
         }
         # Server stats
         self.message_count = defaultdict(int)
+        self.total_messages = 0
         self.active_users = set()
+        # Rankings kept up to date incrementally instead of sorting on every call
+        self.xp_rank = RankIndex()
+        self.activity_rank = RankIndex()
         self.join_dates = {
             'User123': datetime.now() - timedelta(days=30),
             'Mod1': datetime.now() - timedelta(days=60),
@@ -62,6 +72,8 @@ class LocalDiscordBot(cmd.Cmd):
                     
                     # Simulate message activity
                     self.message_count[self.current_user] += 1
+                    self.total_messages += 1
+                    self.activity_rank.update(self.current_user, self.message_count[self.current_user])
                     self.active_users.add(self.current_user)
                     
                     getattr(self, method_name)(args)
@@ -253,6 +265,8 @@ class LocalDiscordBot(cmd.Cmd):
     
     def bot_stats(self, args):
         """Show server statistics"""
+        top = self.activity_rank.top(1)
+        most_active = top[0][0] if top else 'None'
         print(f"""
 📊 Server Statistics for {self.server_name}:
 
@@ -263,8 +277,8 @@ class LocalDiscordBot(cmd.Cmd):
   Muted Users: {len(self.muted_users)}
 
 📈 Activity:
-  Total Messages: {sum(self.message_count.values())}
-  Most Active User: {max(self.message_count.items(), key=lambda x: x[1])[0]}
+  Total Messages: {self.total_messages}
+  Most Active User: {most_active}
   Custom Commands: {len(self.custom_commands)}
 
 ⚙️ Settings:
@@ -292,14 +306,13 @@ class LocalDiscordBot(cmd.Cmd):
     def bot_activity(self, args):
         """Show server activity"""
         print("\n📈 Server Activity:")
-        for user, count in sorted(self.message_count.items(), key=lambda x: x[1], reverse=True)[:5]:
+        for user, count in self.activity_rank.top(5):
             print(f"  {user}: {count} messages")
     
     def bot_leaderboard(self, args):
         """Show XP leaderboard"""
         print("\n🏆 XP Leaderboard:")
-        sorted_users = sorted(self.xp.items(), key=lambda x: x[1], reverse=True)[:5]
-        for i, (user, xp) in enumerate(sorted_users, 1):
+        for i, (user, xp) in enumerate(self.xp_rank.top(5), 1):
             print(f"{i}. {user}: Level {self.levels[user]} ({xp} XP)")
     
     def _log_action(self, action, target, reason=None):
@@ -346,12 +359,12 @@ class LocalDiscordBot(cmd.Cmd):
         """Check XP level"""
         user = args[0] if args else self.current_user
         xp = self.xp[user]
-        level = self.levels[user]
+        level, into_level, level_span = DEFAULT_CURVE.progress(xp)
         print(f"""
 📊 Level Stats for {user}:
 Level: {level}
 XP: {xp}
-Progress to Next Level: {xp % 100}/100 XP
+Progress to Next Level: {into_level}/{level_span} XP
         """)
     
     def bot_addxp(self, args):
@@ -359,7 +372,8 @@ Progress to Next Level: {xp % 100}/100 XP
         if args and args[0].isdigit():
             amount = int(args[0])
             self.xp[self.current_user] += amount
-            new_level = self.xp[self.current_user] // 100
+            self.xp_rank.update(self.current_user, self.xp[self.current_user])
+            new_level = DEFAULT_CURVE.level_for(self.xp[self.current_user])
             if new_level > self.levels[self.current_user]:
                 self.levels[self.current_user] = new_level
                 print(f"🎉 Level Up! You are now level {new_level}!")
@@ -398,5 +412,58 @@ Progress to Next Level: {xp % 100}/100 XP
         else:
             print("❌ Command not found")
 
+# Command mix for scale mode: (command line, weight)
+SCALE_WORKLOAD = [
+    ('!addxp {amount}', 50),
+    ('!say hello', 15),
+    ('!level', 10),
+    ('!leaderboard', 10),
+    ('!activity', 5),
+    ('!stats', 5),
+    ('!userinfo', 5),
+]
+
+def run_scale_mode(users, commands, seed=1):
+    """Drive synthetic users and commands through default() and report latency"""
+    rng = random.Random(seed)
+    bot = LocalDiscordBot()
+    names = [f'user{n}' for n in range(users)]
+    started = datetime.now()
+    for name in names:
+        bot.join_dates[name] = started
+    
+    templates = [line for line, _ in SCALE_WORKLOAD]
+    weights = [weight for _, weight in SCALE_WORKLOAD]
+    latencies = defaultdict(list)
+    
+    began = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for template in rng.choices(templates, weights, k=commands):
+            bot.current_user = rng.choice(names)
+            line = template.format(amount=rng.randint(1, 50))
+            t = time.perf_counter()
+            bot.default(line)
+            latencies[line.split()[0]].append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - began
+    
+    print(f"📈 Scale run: {users:,} users, {commands:,} commands in {elapsed:.2f}s "
+          f"({commands / elapsed:,.0f} commands/s)")
+    print(f"  {'command':<14}{'count':>9}{'p50 us':>10}{'p99 us':>10}{'max us':>10}")
+    for command, samples in sorted(latencies.items()):
+        samples.sort()
+        p50 = samples[len(samples) // 2] * 1e6
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6
+        print(f"  {command:<14}{len(samples):>9}{p50:>10.1f}{p99:>10.1f}{samples[-1] * 1e6:>10.1f}")
+
 if __name__ == "__main__":
-    LocalDiscordBot().cmdloop() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Local Discord bot simulator")
+    parser.add_argument('--scale', action='store_true', help="run a non-interactive load test")
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--commands', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    if args.scale:
+        run_scale_mode(args.users, args.commands, args.seed)
+    else:
+        LocalDiscordBot().cmdloop() 
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""Storage backends for bot data.
+
+``open_storage`` picks a backend from a URL:
+
+    memory://                      in-process dicts (tests, benchmarks)
+    sqlite:///bot.db               local SQLite file (default)
+    postgresql://user@host/db      PostgreSQL via asyncpg
+
+Backends import their driver lazily, so SQLite deployments do not need
+asyncpg installed.
+"""
+from .base import Storage
+
+DEFAULT_URL = 'sqlite:///bot.db'
+
+
+def open_storage(url=DEFAULT_URL):
+    """Create (but do not connect) the storage backend for ``url``"""
+    if url.startswith('memory:'):
+        from .memory import MemoryStorage
+        return MemoryStorage()
+    if url.startswith('sqlite:///'):
+        from .sqlite import SQLiteStorage
+        return SQLiteStorage(url[len('sqlite:///'):])
+    if url.startswith(('postgres://', 'postgresql://')):
+        from .postgres import PostgresStorage
+        return PostgresStorage(url)
+    raise ValueError(f'unsupported storage URL: {url}')
+
+
+__all__ = ['Storage', 'open_storage', 'DEFAULT_URL']
@@ -0,0 +1,194 @@
+"""Storage interface shared by every backend.
+
+Each backend stores guild settings, XP, custom commands and reminders. All
+methods are coroutines so the same calling code works against in-memory,
+SQLite and PostgreSQL storage.
+"""
+from abc import ABC, abstractmethod
+
+from utils.guild_data import GUILD_TABLES
+
+# Tables with per-member rows that are pruned when a member leaves
+MEMBER_TABLES = ('user_xp', 'xp_history', 'reminders')
+
+
+class Storage(ABC):
+    async def connect(self):
+        """Open connections and apply pending schema migrations"""
+
+    async def close(self):
+        """Release connections"""
+
+    # Maintenance
+
+    @abstractmethod
+    async def prune_guilds(self, keep_guild_ids, batch_size=500):
+        """Delete rows for guilds not in ``keep_guild_ids`` in batches. Returns rows deleted"""
+
+    @abstractmethod
+    async def prune_members(self, guild_id, keep_user_ids, batch_size=500):
+        """Delete a guild's per-member rows for users not in ``keep_user_ids``. Returns rows deleted"""
+
+    @abstractmethod
+    async def optimize(self):
+        """Refresh planner statistics and reclaim space. Returns a dict describing what was done"""
+
+    # Guild settings
+
+    @abstractmethod
+    async def get_guild_settings(self, guild_id):
+        """Return {'prefix', 'welcome_channel_id', 'log_channel_id'} or None"""
+
+    @abstractmethod
+    async def ensure_guild(self, guild_id, prefix):
+        """Create default settings for a guild if it has none"""
+
+    @abstractmethod
+    async def set_prefix(self, guild_id, prefix):
+        """Change a guild's command prefix"""
+
+    @abstractmethod
+    async def get_raid_settings(self, guild_id):
+        """Return (threshold, window, slowmode, raise_verification) or None"""
+
+    @abstractmethod
+    async def set_raid_settings(self, guild_id, threshold, window, slowmode, raise_verification):
+        """Store raid detection settings"""
+
+    @abstractmethod
+    async def get_level_curve(self, guild_id):
+        """Return (kind, JSON params) or None"""
+
+    @abstractmethod
+    async def set_level_curve(self, guild_id, kind, params):
+        """Store a guild's level curve"""
+
+    @abstractmethod
+    async def get_self_roles(self, guild_id):
+        """Return the ids of roles members may assign themselves"""
+
+    @abstractmethod
+    async def add_self_role(self, guild_id, role_id):
+        """Allow members to assign themselves a role"""
+
+    @abstractmethod
+    async def remove_self_role(self, guild_id, role_id):
+        """Remove a role from the self-assignable list"""
+
+    @abstractmethod
+    async def get_link_rules(self, guild_id):
+        """Return a guild's link rules as (domain, action) pairs, action being 'allow' or 'deny'"""
+
+    @abstractmethod
+    async def set_link_rule(self, guild_id, domain, action):
+        """Allow or deny a domain, replacing any existing rule for it"""
+
+    @abstractmethod
+    async def remove_link_rule(self, guild_id, domain):
+        """Remove a domain rule. Returns False if there was none"""
+
+    # XP
+
+    @abstractmethod
+    async def get_xp(self, guild_id, user_id):
+        """Return (xp, level) or None"""
+
+    @abstractmethod
+    async def add_xp(self, guild_id, user_id, amount):
+        """Add XP, creating the row if needed. Returns (new xp, stored level)"""
+
+    @abstractmethod
+    async def add_xp_many(self, gains):
+        """Add XP from (guild_id, user_id, amount) rows, at most one per member.
+
+        Returns (guild_id, user_id, new xp, stored level) rows.
+        """
+
+    @abstractmethod
+    async def set_level(self, guild_id, user_id, level):
+        """Store a member's level"""
+
+    @abstractmethod
+    async def set_levels(self, guild_id, updates):
+        """Store many levels at once from (user_id, level) pairs"""
+
+    @abstractmethod
+    async def guild_xp(self, guild_id):
+        """Return every (user_id, xp, level) row for a guild"""
+
+    @abstractmethod
+    async def count_ranked(self, guild_id):
+        """Number of members with an XP row"""
+
+    @abstractmethod
+    async def leaderboard(self, guild_id, limit, offset=0):
+        """Return (user_id, xp, level) rows ordered by XP, highest first"""
+
+    # XP history
+
+    @abstractmethod
+    async def record_xp_gains(self, gains):
+        """Add (guild_id, user_id, hour_start, xp) rows to the hourly buckets"""
+
+    @abstractmethod
+    async def compact_xp_history(self, hourly_cutoff, daily_cutoff, weekly_cutoff):
+        """Roll hourly buckets into daily and daily into weekly, then apply retention"""
+
+    @abstractmethod
+    async def top_xp_gains(self, guild_id, since, limit):
+        """Return (user_id, xp gained) for buckets starting at or after ``since``"""
+
+    @abstractmethod
+    async def xp_history(self, guild_id, user_id, since):
+        """Return (bucket_start, xp) rows for one member, oldest first"""
+
+    # Custom commands
+
+    @abstractmethod
+    async def add_custom_command(self, guild_id, command, response):
+        """Add a custom command. Returns False if it already exists"""
+
+    @abstractmethod
+    async def get_custom_command(self, guild_id, command):
+        """Return the response for a custom command or None"""
+
+    @abstractmethod
+    async def count_custom_command_use(self, guild_id, command):
+        """Increment a custom command's use counter and return the new count"""
+
+    # Reminders
+
+    @abstractmethod
+    async def add_reminder(self, guild_id, user_id, text, remind_at):
+        """Store a reminder due at ``remind_at`` (a datetime)"""
+
+    @abstractmethod
+    async def pop_due_reminders(self, now):
+        """Remove and return (guild_id, user_id, text, remind_at) rows due by ``now``"""
+
+    # Warnings
+
+    @abstractmethod
+    async def add_warning(self, guild_id, user_id, moderator_id, reason, created_at):
+        """Store a warning given at ``created_at`` (Unix time). Returns its id"""
+
+    @abstractmethod
+    async def get_warnings(self, guild_id, user_ids, since=0):
+        """Return (user_id, id, moderator_id, reason, created_at) rows for the given members
+        from ``since`` on, oldest first"""
+
+    @abstractmethod
+    async def clear_warnings(self, guild_id, user_id):
+        """Delete a member's warnings. Returns how many were removed"""
+
+    @abstractmethod
+    async def get_warn_rules(self, guild_id):
+        """Return (warnings, window_seconds, mute_seconds) escalation rules"""
+
+    @abstractmethod
+    async def set_warn_rule(self, guild_id, warnings, window_seconds, mute_seconds):
+        """Mute for ``mute_seconds`` once a member has ``warnings`` warnings within the window"""
+
+    @abstractmethod
+    async def remove_warn_rule(self, guild_id, warnings):
+        """Remove the rule for a warning count. Returns False if there was none"""
@@ -0,0 +1,208 @@
+"""In-memory storage for tests, benchmarks and the local simulator."""
+from collections import defaultdict
+
+from utils.xp_history import day_start, week_start
+from .base import Storage
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.guild_settings = {}
+        self.raid_settings = {}
+        self.level_curves = {}
+        self.self_roles = defaultdict(set)
+        self.link_rules = defaultdict(dict)  # guild_id -> {domain: action}
+        self.xp = defaultdict(dict)          # guild_id -> {user_id: [xp, level]}
+        self.xp_buckets = defaultdict(int)   # (guild_id, user_id, period, bucket_start) -> xp
+        self.custom_commands = {}
+        self.custom_command_uses = defaultdict(int)
+        self.reminders = []
+        self.warnings = []                   # (guild_id, user_id, id, moderator_id, reason, created_at)
+        self.warning_ids = 0
+        self.warn_rules = defaultdict(dict)  # guild_id -> {warnings: (window_seconds, mute_seconds)}
+
+    async def prune_guilds(self, keep_guild_ids, batch_size=500):
+        deleted = 0
+        for table in (self.guild_settings, self.raid_settings, self.level_curves):
+            for guild_id in [g for g in table if g not in keep_guild_ids]:
+                del table[guild_id]
+                deleted += 1
+        for table in (self.xp, self.self_roles, self.link_rules, self.warn_rules):
+            for guild_id in [g for g in table if g not in keep_guild_ids]:
+                deleted += len(table.pop(guild_id))
+        for mapping in (self.xp_buckets, self.custom_commands, self.custom_command_uses):
+            for key in [k for k in mapping if k[0] not in keep_guild_ids]:
+                del mapping[key]
+                deleted += 1
+        for name in ('reminders', 'warnings'):
+            rows = getattr(self, name)
+            kept = [r for r in rows if r[0] in keep_guild_ids]
+            deleted += len(rows) - len(kept)
+            setattr(self, name, kept)
+        return deleted
+
+    async def prune_members(self, guild_id, keep_user_ids, batch_size=500):
+        rows = self.xp[guild_id]
+        departed = [user_id for user_id in rows if user_id not in keep_user_ids]
+        for user_id in departed:
+            del rows[user_id]
+        buckets = [k for k in self.xp_buckets if k[0] == guild_id and k[1] not in keep_user_ids]
+        for key in buckets:
+            del self.xp_buckets[key]
+        kept = [r for r in self.reminders if r[0] != guild_id or r[1] in keep_user_ids]
+        deleted = len(departed) + len(buckets) + len(self.reminders) - len(kept)
+        self.reminders = kept
+        return deleted
+
+    async def optimize(self):
+        return {}
+
+    async def get_guild_settings(self, guild_id):
+        settings = self.guild_settings.get(guild_id)
+        return dict(settings) if settings else None
+
+    async def ensure_guild(self, guild_id, prefix):
+        self.guild_settings.setdefault(guild_id, {
+            'prefix': prefix, 'welcome_channel_id': None, 'log_channel_id': None})
+
+    async def set_prefix(self, guild_id, prefix):
+        if guild_id in self.guild_settings:
+            self.guild_settings[guild_id]['prefix'] = prefix
+
+    async def get_raid_settings(self, guild_id):
+        return self.raid_settings.get(guild_id)
+
+    async def set_raid_settings(self, guild_id, threshold, window, slowmode, raise_verification):
+        self.raid_settings[guild_id] = (threshold, window, slowmode, bool(raise_verification))
+
+    async def get_level_curve(self, guild_id):
+        return self.level_curves.get(guild_id)
+
+    async def set_level_curve(self, guild_id, kind, params):
+        self.level_curves[guild_id] = (kind, params)
+
+    async def get_self_roles(self, guild_id):
+        return list(self.self_roles[guild_id])
+
+    async def add_self_role(self, guild_id, role_id):
+        self.self_roles[guild_id].add(role_id)
+
+    async def remove_self_role(self, guild_id, role_id):
+        self.self_roles[guild_id].discard(role_id)
+
+    async def get_link_rules(self, guild_id):
+        return list(self.link_rules[guild_id].items())
+
+    async def set_link_rule(self, guild_id, domain, action):
+        self.link_rules[guild_id][domain] = action
+
+    async def remove_link_rule(self, guild_id, domain):
+        return self.link_rules[guild_id].pop(domain, None) is not None
+
+    async def get_xp(self, guild_id, user_id):
+        row = self.xp[guild_id].get(user_id)
+        return tuple(row) if row else None
+
+    async def add_xp(self, guild_id, user_id, amount):
+        row = self.xp[guild_id].setdefault(user_id, [0, 0])
+        row[0] += amount
+        return row[0], row[1]
+
+    async def add_xp_many(self, gains):
+        return [(guild_id, user_id, *await self.add_xp(guild_id, user_id, amount))
+                for guild_id, user_id, amount in gains]
+
+    async def set_level(self, guild_id, user_id, level):
+        row = self.xp[guild_id].get(user_id)
+        if row:
+            row[1] = level
+
+    async def set_levels(self, guild_id, updates):
+        rows = self.xp[guild_id]
+        for user_id, level in updates:
+            if user_id in rows:
+                rows[user_id][1] = level
+
+    async def guild_xp(self, guild_id):
+        return [(user_id, xp, level) for user_id, (xp, level) in self.xp[guild_id].items()]
+
+    async def count_ranked(self, guild_id):
+        return len(self.xp[guild_id])
+
+    async def leaderboard(self, guild_id, limit, offset=0):
+        rows = sorted(self.xp[guild_id].items(), key=lambda item: item[1][0], reverse=True)
+        return [(user_id, xp, level) for user_id, (xp, level) in rows[offset:offset + limit]]
+
+    async def record_xp_gains(self, gains):
+        for guild_id, user_id, bucket, xp in gains:
+            self.xp_buckets[(guild_id, user_id, 'h', bucket)] += xp
+
+    def _roll_up(self, source, target, cutoff, align):
+        for key in [k for k in self.xp_buckets if k[2] == source and k[3] < cutoff]:
+            guild_id, user_id, _, bucket = key
+            self.xp_buckets[(guild_id, user_id, target, align(bucket))] += self.xp_buckets.pop(key)
+
+    async def compact_xp_history(self, hourly_cutoff, daily_cutoff, weekly_cutoff):
+        self._roll_up('h', 'd', hourly_cutoff, day_start)
+        self._roll_up('d', 'w', daily_cutoff, week_start)
+        for key in [k for k in self.xp_buckets if k[2] == 'w' and k[3] < weekly_cutoff]:
+            del self.xp_buckets[key]
+
+    async def top_xp_gains(self, guild_id, since, limit):
+        totals = defaultdict(int)
+        for (g, user_id, _, bucket), xp in self.xp_buckets.items():
+            if g == guild_id and bucket >= since:
+                totals[user_id] += xp
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    async def xp_history(self, guild_id, user_id, since):
+        return sorted((bucket, xp) for (g, u, _, bucket), xp in self.xp_buckets.items()
+                      if g == guild_id and u == user_id and bucket >= since)
+
+    async def add_custom_command(self, guild_id, command, response):
+        if (guild_id, command) in self.custom_commands:
+            return False
+        self.custom_commands[(guild_id, command)] = response
+        return True
+
+    async def get_custom_command(self, guild_id, command):
+        return self.custom_commands.get((guild_id, command))
+
+    async def count_custom_command_use(self, guild_id, command):
+        if (guild_id, command) not in self.custom_commands:
+            return 0
+        self.custom_command_uses[(guild_id, command)] += 1
+        return self.custom_command_uses[(guild_id, command)]
+
+    async def add_reminder(self, guild_id, user_id, text, remind_at):
+        self.reminders.append((guild_id, user_id, text, remind_at))
+
+    async def pop_due_reminders(self, now):
+        due = [r for r in self.reminders if r[3] <= now]
+        self.reminders = [r for r in self.reminders if r[3] > now]
+        return due
+
+    async def add_warning(self, guild_id, user_id, moderator_id, reason, created_at):
+        self.warning_ids += 1
+        self.warnings.append((guild_id, user_id, self.warning_ids, moderator_id, reason, created_at))
+        return self.warning_ids
+
+    async def get_warnings(self, guild_id, user_ids, since=0):
+        user_ids = set(user_ids)
+        return [row[1:] for row in self.warnings
+                if row[0] == guild_id and row[1] in user_ids and row[5] >= since]
+
+    async def clear_warnings(self, guild_id, user_id):
+        kept = [row for row in self.warnings if row[0] != guild_id or row[1] != user_id]
+        removed = len(self.warnings) - len(kept)
+        self.warnings = kept
+        return removed
+
+    async def get_warn_rules(self, guild_id):
+        return [(warnings, window, mute) for warnings, (window, mute) in self.warn_rules[guild_id].items()]
+
+    async def set_warn_rule(self, guild_id, warnings, window_seconds, mute_seconds):
+        self.warn_rules[guild_id][warnings] = (window_seconds, mute_seconds)
+
+    async def remove_warn_rule(self, guild_id, warnings):
+        return self.warn_rules[guild_id].pop(warnings, None) is not None
@@ -0,0 +1,405 @@
+"""PostgreSQL storage using an asyncpg connection pool."""
+import asyncio
+
+import asyncpg
+
+from .base import Storage, GUILD_TABLES, MEMBER_TABLES
+
+INITIAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id BIGINT PRIMARY KEY,
+    prefix TEXT DEFAULT '!',
+    welcome_channel_id BIGINT,
+    log_channel_id BIGINT
+);
+CREATE TABLE IF NOT EXISTS user_xp (
+    user_id BIGINT,
+    guild_id BIGINT,
+    xp BIGINT DEFAULT 0,
+    level INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, guild_id)
+);
+CREATE TABLE IF NOT EXISTS custom_commands (
+    guild_id BIGINT,
+    command TEXT,
+    response TEXT,
+    PRIMARY KEY (guild_id, command)
+);
+CREATE TABLE IF NOT EXISTS reminders (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT,
+    guild_id BIGINT,
+    reminder_text TEXT,
+    reminder_time TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS level_curves (
+    guild_id BIGINT PRIMARY KEY,
+    kind TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS raid_settings (
+    guild_id BIGINT PRIMARY KEY,
+    join_threshold INTEGER DEFAULT 10,
+    window_seconds INTEGER DEFAULT 10,
+    slowmode_seconds INTEGER DEFAULT 0,
+    raise_verification BOOLEAN DEFAULT FALSE
+);
+CREATE TABLE IF NOT EXISTS self_roles (
+    guild_id BIGINT,
+    role_id BIGINT,
+    PRIMARY KEY (guild_id, role_id)
+);
+CREATE TABLE IF NOT EXISTS xp_history (
+    guild_id BIGINT,
+    user_id BIGINT,
+    period CHAR(1),
+    bucket_start BIGINT,
+    xp BIGINT,
+    PRIMARY KEY (guild_id, user_id, period, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_xp_history_range ON xp_history (guild_id, bucket_start);
+'''
+
+# (version, description, sql); applied versions are recorded in schema_version
+MIGRATIONS = [
+    (1, 'Initial schema', INITIAL_SCHEMA),
+    (2, 'Indexes for leaderboards and due reminders', '''
+        CREATE INDEX IF NOT EXISTS idx_user_xp_guild_xp ON user_xp (guild_id, xp DESC);
+        CREATE INDEX IF NOT EXISTS idx_reminders_time ON reminders (reminder_time);
+    '''),
+    (3, 'Per-guild link rules', '''
+        CREATE TABLE IF NOT EXISTS link_rules (
+            guild_id BIGINT,
+            domain TEXT,
+            action TEXT,
+            PRIMARY KEY (guild_id, domain)
+        );
+    '''),
+    (4, 'Warnings and escalation rules', '''
+        CREATE TABLE IF NOT EXISTS warnings (
+            id BIGSERIAL PRIMARY KEY,
+            guild_id BIGINT,
+            user_id BIGINT,
+            moderator_id BIGINT,
+            reason TEXT,
+            created_at DOUBLE PRECISION
+        );
+        CREATE INDEX IF NOT EXISTS idx_warnings_member ON warnings (guild_id, user_id, created_at);
+        CREATE TABLE IF NOT EXISTS warn_rules (
+            guild_id BIGINT,
+            warnings INTEGER,
+            window_seconds INTEGER,
+            mute_seconds INTEGER,
+            PRIMARY KEY (guild_id, warnings)
+        );
+    '''),
+    (5, 'Custom command use counter', '''
+        ALTER TABLE custom_commands ADD COLUMN IF NOT EXISTS uses INTEGER DEFAULT 0;
+    '''),
+]
+MIGRATION_LOCK = 0x6d6967726174   # advisory lock id so concurrent starts migrate once
+
+ROLL_UP = '''
+    INSERT INTO xp_history (guild_id, user_id, period, bucket_start, xp)
+    SELECT guild_id, user_id, $1, {align}, SUM(xp)
+    FROM xp_history
+    WHERE period = $2 AND bucket_start < $3
+    GROUP BY guild_id, user_id, {align}
+    ON CONFLICT (guild_id, user_id, period, bucket_start) DO UPDATE SET xp = xp_history.xp + EXCLUDED.xp
+'''
+DAY_ALIGN = 'bucket_start - bucket_start % 86400'
+WEEK_ALIGN = 'bucket_start - (bucket_start - 345600) % 604800'
+
+
+class PostgresStorage(Storage):
+    def __init__(self, dsn, min_size=1, max_size=10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        await self.migrate()
+
+    async def migrate(self):
+        """Apply migrations newer than the highest recorded schema_version"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK)
+                await conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY)')
+                current = await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                for version, description, sql in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    print(f'Applying database migration {version}: {description}')
+                    await conn.execute(sql)
+                    await conn.execute('INSERT INTO schema_version (version) VALUES ($1)', version)
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    async def _delete_batched(self, query, params, batch_size):
+        deleted = 0
+        while True:
+            status = await self.pool.execute(query, *params, batch_size)
+            count = int(status.split()[-1])
+            deleted += count
+            if count < batch_size:
+                return deleted
+            await asyncio.sleep(0)
+
+    async def prune_guilds(self, keep_guild_ids, batch_size=500):
+        keep = list(keep_guild_ids)
+        deleted = 0
+        for table in GUILD_TABLES:
+            deleted += await self._delete_batched(
+                f'DELETE FROM {table} WHERE ctid IN '
+                f'(SELECT ctid FROM {table} WHERE guild_id <> ALL($1::BIGINT[]) LIMIT $2)',
+                (keep,), batch_size)
+        return deleted
+
+    async def prune_members(self, guild_id, keep_user_ids, batch_size=500):
+        keep = list(keep_user_ids)
+        deleted = 0
+        for table in MEMBER_TABLES:
+            deleted += await self._delete_batched(
+                f'DELETE FROM {table} WHERE ctid IN '
+                f'(SELECT ctid FROM {table} WHERE guild_id = $1 AND user_id <> ALL($2::BIGINT[]) LIMIT $3)',
+                (guild_id, keep), batch_size)
+        return deleted
+
+    async def optimize(self):
+        # Autovacuum and the checkpointer reclaim space and flush WAL on the server
+        await self.pool.execute('ANALYZE')
+        return {'analyzed': True}
+
+    async def get_guild_settings(self, guild_id):
+        row = await self.pool.fetchrow('''
+            SELECT prefix, welcome_channel_id, log_channel_id
+            FROM guild_settings WHERE guild_id = $1
+        ''', guild_id)
+        return dict(row) if row else None
+
+    async def ensure_guild(self, guild_id, prefix):
+        await self.pool.execute('''
+            INSERT INTO guild_settings (guild_id, prefix) VALUES ($1, $2)
+            ON CONFLICT (guild_id) DO NOTHING
+        ''', guild_id, prefix)
+
+    async def set_prefix(self, guild_id, prefix):
+        await self.pool.execute('UPDATE guild_settings SET prefix = $1 WHERE guild_id = $2',
+                                prefix, guild_id)
+
+    async def get_raid_settings(self, guild_id):
+        row = await self.pool.fetchrow('''
+            SELECT join_threshold, window_seconds, slowmode_seconds, raise_verification
+            FROM raid_settings WHERE guild_id = $1
+        ''', guild_id)
+        return tuple(row) if row else None
+
+    async def set_raid_settings(self, guild_id, threshold, window, slowmode, raise_verification):
+        await self.pool.execute('''
+            INSERT INTO raid_settings
+            (guild_id, join_threshold, window_seconds, slowmode_seconds, raise_verification)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (guild_id) DO UPDATE SET
+                join_threshold = EXCLUDED.join_threshold,
+                window_seconds = EXCLUDED.window_seconds,
+                slowmode_seconds = EXCLUDED.slowmode_seconds,
+                raise_verification = EXCLUDED.raise_verification
+        ''', guild_id, threshold, window, slowmode, bool(raise_verification))
+
+    async def get_level_curve(self, guild_id):
+        row = await self.pool.fetchrow('SELECT kind, params FROM level_curves WHERE guild_id = $1',
+                                       guild_id)
+        return tuple(row) if row else None
+
+    async def set_level_curve(self, guild_id, kind, params):
+        await self.pool.execute('''
+            INSERT INTO level_curves (guild_id, kind, params) VALUES ($1, $2, $3)
+            ON CONFLICT (guild_id) DO UPDATE SET kind = EXCLUDED.kind, params = EXCLUDED.params
+        ''', guild_id, kind, params)
+
+    async def get_self_roles(self, guild_id):
+        rows = await self.pool.fetch('SELECT role_id FROM self_roles WHERE guild_id = $1', guild_id)
+        return [row[0] for row in rows]
+
+    async def add_self_role(self, guild_id, role_id):
+        await self.pool.execute('''
+            INSERT INTO self_roles (guild_id, role_id) VALUES ($1, $2)
+            ON CONFLICT (guild_id, role_id) DO NOTHING
+        ''', guild_id, role_id)
+
+    async def remove_self_role(self, guild_id, role_id):
+        await self.pool.execute('DELETE FROM self_roles WHERE guild_id = $1 AND role_id = $2',
+                                guild_id, role_id)
+
+    async def get_link_rules(self, guild_id):
+        rows = await self.pool.fetch('SELECT domain, action FROM link_rules WHERE guild_id = $1', guild_id)
+        return [tuple(row) for row in rows]
+
+    async def set_link_rule(self, guild_id, domain, action):
+        await self.pool.execute('''
+            INSERT INTO link_rules (guild_id, domain, action) VALUES ($1, $2, $3)
+            ON CONFLICT (guild_id, domain) DO UPDATE SET action = EXCLUDED.action
+        ''', guild_id, domain, action)
+
+    async def remove_link_rule(self, guild_id, domain):
+        status = await self.pool.execute('DELETE FROM link_rules WHERE guild_id = $1 AND domain = $2',
+                                         guild_id, domain)
+        return status != 'DELETE 0'
+
+    async def get_xp(self, guild_id, user_id):
+        row = await self.pool.fetchrow('SELECT xp, level FROM user_xp WHERE user_id = $1 AND guild_id = $2',
+                                       user_id, guild_id)
+        return tuple(row) if row else None
+
+    async def add_xp(self, guild_id, user_id, amount):
+        row = await self.pool.fetchrow('''
+            INSERT INTO user_xp (user_id, guild_id, xp, level) VALUES ($1, $2, $3, 0)
+            ON CONFLICT (user_id, guild_id) DO UPDATE SET xp = user_xp.xp + EXCLUDED.xp
+            RETURNING xp, level
+        ''', user_id, guild_id, amount)
+        return tuple(row)
+
+    async def add_xp_many(self, gains):
+        guild_ids, user_ids, amounts = zip(*gains) if gains else ((), (), ())
+        rows = await self.pool.fetch('''
+            INSERT INTO user_xp (guild_id, user_id, xp, level)
+            SELECT guild_id, user_id, xp, 0 FROM unnest($1::BIGINT[], $2::BIGINT[], $3::BIGINT[])
+                AS gains (guild_id, user_id, xp)
+            ON CONFLICT (user_id, guild_id) DO UPDATE SET xp = user_xp.xp + EXCLUDED.xp
+            RETURNING guild_id, user_id, xp, level
+        ''', list(guild_ids), list(user_ids), list(amounts))
+        return [tuple(row) for row in rows]
+
+    async def set_level(self, guild_id, user_id, level):
+        await self.pool.execute('UPDATE user_xp SET level = $1 WHERE user_id = $2 AND guild_id = $3',
+                                level, user_id, guild_id)
+
+    async def set_levels(self, guild_id, updates):
+        await self.pool.executemany('UPDATE user_xp SET level = $1 WHERE user_id = $2 AND guild_id = $3',
+                                    [(level, user_id, guild_id) for user_id, level in updates])
+
+    async def guild_xp(self, guild_id):
+        rows = await self.pool.fetch('SELECT user_id, xp, level FROM user_xp WHERE guild_id = $1', guild_id)
+        return [tuple(row) for row in rows]
+
+    async def count_ranked(self, guild_id):
+        return await self.pool.fetchval('SELECT COUNT(*) FROM user_xp WHERE guild_id = $1', guild_id)
+
+    async def leaderboard(self, guild_id, limit, offset=0):
+        rows = await self.pool.fetch('''
+            SELECT user_id, xp, level FROM user_xp
+            WHERE guild_id = $1
+            ORDER BY xp DESC
+            LIMIT $2 OFFSET $3
+        ''', guild_id, limit, offset)
+        return [tuple(row) for row in rows]
+
+    async def record_xp_gains(self, gains):
+        await self.pool.executemany('''
+            INSERT INTO xp_history (guild_id, user_id, period, bucket_start, xp)
+            VALUES ($1, $2, 'h', $3, $4)
+            ON CONFLICT (guild_id, user_id, period, bucket_start) DO UPDATE SET xp = xp_history.xp + EXCLUDED.xp
+        ''', gains)
+
+    async def compact_xp_history(self, hourly_cutoff, daily_cutoff, weekly_cutoff):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for target, source, cutoff, align in (('d', 'h', hourly_cutoff, DAY_ALIGN),
+                                                      ('w', 'd', daily_cutoff, WEEK_ALIGN)):
+                    await conn.execute(ROLL_UP.format(align=align), target, source, cutoff)
+                    await conn.execute('DELETE FROM xp_history WHERE period = $1 AND bucket_start < $2',
+                                       source, cutoff)
+                await conn.execute("DELETE FROM xp_history WHERE period = 'w' AND bucket_start < $1",
+                                   weekly_cutoff)
+
+    async def top_xp_gains(self, guild_id, since, limit):
+        rows = await self.pool.fetch('''
+            SELECT user_id, SUM(xp) AS gained FROM xp_history
+            WHERE guild_id = $1 AND bucket_start >= $2
+            GROUP BY user_id
+            ORDER BY gained DESC
+            LIMIT $3
+        ''', guild_id, since, limit)
+        return [tuple(row) for row in rows]
+
+    async def xp_history(self, guild_id, user_id, since):
+        rows = await self.pool.fetch('''
+            SELECT bucket_start, xp FROM xp_history
+            WHERE guild_id = $1 AND user_id = $2 AND bucket_start >= $3
+            ORDER BY bucket_start
+        ''', guild_id, user_id, since)
+        return [tuple(row) for row in rows]
+
+    async def add_custom_command(self, guild_id, command, response):
+        status = await self.pool.execute('''
+            INSERT INTO custom_commands (guild_id, command, response) VALUES ($1, $2, $3)
+            ON CONFLICT (guild_id, command) DO NOTHING
+        ''', guild_id, command, response)
+        return status.endswith(' 1')
+
+    async def get_custom_command(self, guild_id, command):
+        return await self.pool.fetchval('SELECT response FROM custom_commands WHERE guild_id = $1 AND command = $2',
+                                        guild_id, command)
+
+    async def count_custom_command_use(self, guild_id, command):
+        uses = await self.pool.fetchval('''
+            UPDATE custom_commands SET uses = uses + 1 WHERE guild_id = $1 AND command = $2 RETURNING uses
+        ''', guild_id, command)
+        return uses or 0
+
+    async def add_reminder(self, guild_id, user_id, text, remind_at):
+        await self.pool.execute('''
+            INSERT INTO reminders (user_id, guild_id, reminder_text, reminder_time)
+            VALUES ($1, $2, $3, $4)
+        ''', user_id, guild_id, text, remind_at)
+
+    async def pop_due_reminders(self, now):
+        rows = await self.pool.fetch('''
+            DELETE FROM reminders WHERE reminder_time <= $1
+            RETURNING guild_id, user_id, reminder_text, reminder_time
+        ''', now)
+        return [tuple(row) for row in rows]
+
+    async def add_warning(self, guild_id, user_id, moderator_id, reason, created_at):
+        return await self.pool.fetchval('''
+            INSERT INTO warnings (guild_id, user_id, moderator_id, reason, created_at)
+            VALUES ($1, $2, $3, $4, $5) RETURNING id
+        ''', guild_id, user_id, moderator_id, reason, created_at)
+
+    async def get_warnings(self, guild_id, user_ids, since=0):
+        rows = await self.pool.fetch('''
+            SELECT user_id, id, moderator_id, reason, created_at FROM warnings
+            WHERE guild_id = $1 AND user_id = ANY($2::BIGINT[]) AND created_at >= $3
+            ORDER BY created_at
+        ''', guild_id, list(user_ids), since)
+        return [tuple(row) for row in rows]
+
+    async def clear_warnings(self, guild_id, user_id):
+        status = await self.pool.execute('DELETE FROM warnings WHERE guild_id = $1 AND user_id = $2',
+                                         guild_id, user_id)
+        return int(status.split()[-1])
+
+    async def get_warn_rules(self, guild_id):
+        rows = await self.pool.fetch(
+            'SELECT warnings, window_seconds, mute_seconds FROM warn_rules WHERE guild_id = $1', guild_id)
+        return [tuple(row) for row in rows]
+
+    async def set_warn_rule(self, guild_id, warnings, window_seconds, mute_seconds):
+        await self.pool.execute('''
+            INSERT INTO warn_rules (guild_id, warnings, window_seconds, mute_seconds)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (guild_id, warnings) DO UPDATE SET
+                window_seconds = EXCLUDED.window_seconds,
+                mute_seconds = EXCLUDED.mute_seconds
+        ''', guild_id, warnings, window_seconds, mute_seconds)
+
+    async def remove_warn_rule(self, guild_id, warnings):
+        status = await self.pool.execute('DELETE FROM warn_rules WHERE guild_id = $1 AND warnings = $2',
+                                         guild_id, warnings)
+        return status != 'DELETE 0'
@@ -0,0 +1,532 @@
+"""SQLite storage using a single aiosqlite connection in WAL mode.
+
+New databases use incremental auto-vacuum from the start. Existing databases
+only switch after a full VACUUM, which is too slow to run at startup; run it
+with the bot stopped:
+
+    python -m storage.sqlite vacuum [--db bot.db]
+"""
+import argparse
+import asyncio
+import sqlite3
+from collections import defaultdict
+from contextlib import closing
+
+import aiosqlite
+
+from .base import Storage, GUILD_TABLES, MEMBER_TABLES
+
+INITIAL_SCHEMA = [
+    # Guild settings table
+    '''
+    CREATE TABLE IF NOT EXISTS guild_settings (
+        guild_id INTEGER PRIMARY KEY,
+        prefix TEXT DEFAULT '!',
+        welcome_channel_id INTEGER,
+        log_channel_id INTEGER
+    )
+    ''',
+    # User XP table
+    '''
+    CREATE TABLE IF NOT EXISTS user_xp (
+        user_id INTEGER,
+        guild_id INTEGER,
+        xp INTEGER DEFAULT 0,
+        level INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, guild_id)
+    )
+    ''',
+    # Custom commands table
+    '''
+    CREATE TABLE IF NOT EXISTS custom_commands (
+        guild_id INTEGER,
+        command TEXT,
+        response TEXT,
+        PRIMARY KEY (guild_id, command)
+    )
+    ''',
+    # Reminders table
+    '''
+    CREATE TABLE IF NOT EXISTS reminders (
+        user_id INTEGER,
+        guild_id INTEGER,
+        reminder_text TEXT,
+        reminder_time TIMESTAMP
+    )
+    ''',
+    # Level curve table
+    '''
+    CREATE TABLE IF NOT EXISTS level_curves (
+        guild_id INTEGER PRIMARY KEY,
+        kind TEXT,
+        params TEXT
+    )
+    ''',
+    # Raid detection settings table
+    '''
+    CREATE TABLE IF NOT EXISTS raid_settings (
+        guild_id INTEGER PRIMARY KEY,
+        join_threshold INTEGER DEFAULT 10,
+        window_seconds INTEGER DEFAULT 10,
+        slowmode_seconds INTEGER DEFAULT 0,
+        raise_verification INTEGER DEFAULT 0
+    )
+    ''',
+    # Self-assignable roles
+    '''
+    CREATE TABLE IF NOT EXISTS self_roles (
+        guild_id INTEGER,
+        role_id INTEGER,
+        PRIMARY KEY (guild_id, role_id)
+    )
+    ''',
+    # XP history buckets: period is 'h' (hour), 'd' (day) or 'w' (week)
+    '''
+    CREATE TABLE IF NOT EXISTS xp_history (
+        guild_id INTEGER,
+        user_id INTEGER,
+        period TEXT,
+        bucket_start INTEGER,
+        xp INTEGER,
+        PRIMARY KEY (guild_id, user_id, period, bucket_start)
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_xp_history_range
+    ON xp_history (guild_id, bucket_start)
+    ''',
+]
+
+# (version, description, statements); the applied version is kept in PRAGMA user_version
+MIGRATIONS = [
+    (1, 'Initial schema', INITIAL_SCHEMA),
+    (2, 'Indexes for leaderboards and due reminders', [
+        'CREATE INDEX IF NOT EXISTS idx_user_xp_guild_xp ON user_xp (guild_id, xp DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_time ON reminders (reminder_time)',
+    ]),
+    # Takes effect at once on new databases; existing ones need the offline vacuum command
+    (3, 'Incremental auto-vacuum', [
+        'PRAGMA auto_vacuum = INCREMENTAL',
+    ]),
+    (4, 'Per-guild link rules', [
+        '''
+        CREATE TABLE IF NOT EXISTS link_rules (
+            guild_id INTEGER,
+            domain TEXT,
+            action TEXT,
+            PRIMARY KEY (guild_id, domain)
+        )
+        ''',
+    ]),
+    (5, 'Warnings and escalation rules', [
+        '''
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            user_id INTEGER,
+            moderator_id INTEGER,
+            reason TEXT,
+            created_at REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_warnings_member ON warnings (guild_id, user_id, created_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS warn_rules (
+            guild_id INTEGER,
+            warnings INTEGER,
+            window_seconds INTEGER,
+            mute_seconds INTEGER,
+            PRIMARY KEY (guild_id, warnings)
+        )
+        ''',
+    ]),
+    (6, 'Custom command use counter', [
+        'ALTER TABLE custom_commands ADD COLUMN uses INTEGER DEFAULT 0',
+    ]),
+]
+
+ROLL_UP = '''
+    INSERT INTO xp_history (guild_id, user_id, period, bucket_start, xp)
+    SELECT guild_id, user_id, ?, {align}, SUM(xp)
+    FROM xp_history
+    WHERE period = ? AND bucket_start < ?
+    GROUP BY guild_id, user_id, {align}
+    ON CONFLICT (guild_id, user_id, period, bucket_start) DO UPDATE SET xp = xp + excluded.xp
+'''
+DAY_ALIGN = 'bucket_start - bucket_start % 86400'
+WEEK_ALIGN = 'bucket_start - (bucket_start - 345600) % 604800'
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path='bot.db'):
+        self.path = path
+        self.db = None
+
+    async def connect(self):
+        self.db = await aiosqlite.connect(self.path)
+        # Must come first: a new file's vacuum mode is fixed once anything is written to it
+        await self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        await self.db.execute('PRAGMA journal_mode=WAL')
+        await self.db.execute('PRAGMA synchronous=NORMAL')
+        await self.migrate()
+
+    async def migrate(self):
+        """Apply migrations newer than the database's user_version"""
+        current = (await self._fetchone('PRAGMA user_version', ()))[0]
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f'Applying database migration {version}: {description}')
+            await self.db.commit()  # PRAGMAs in a migration must run outside a transaction
+            for statement in statements:
+                await self.db.execute(statement)
+            await self.db.execute(f'PRAGMA user_version = {version}')
+            await self.db.commit()
+        if (await self._fetchone('PRAGMA auto_vacuum', ()))[0] != 2:
+            print('Incremental auto-vacuum is not active; run "python -m storage.sqlite vacuum" with the bot stopped')
+
+    async def close(self):
+        if self.db:
+            await self.db.close()
+            self.db = None
+
+    async def _fetchone(self, query, params):
+        async with self.db.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+    async def _fetchall(self, query, params):
+        async with self.db.execute(query, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _write(self, query, params):
+        await self.db.execute(query, params)
+        await self.db.commit()
+
+    async def _delete_batched(self, query, params, batch_size):
+        # Small batches with a yield in between keep commands from queueing behind one big delete
+        deleted = 0
+        while True:
+            cursor = await self.db.execute(query, (*params, batch_size))
+            await self.db.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+            await asyncio.sleep(0)
+
+    async def prune_guilds(self, keep_guild_ids, batch_size=500):
+        deleted = 0
+        for table in GUILD_TABLES:
+            for (guild_id,) in await self._fetchall(f'SELECT DISTINCT guild_id FROM {table}', ()):
+                if guild_id not in keep_guild_ids:
+                    deleted += await self._delete_batched(
+                        f'DELETE FROM {table} WHERE rowid IN '
+                        f'(SELECT rowid FROM {table} WHERE guild_id = ? LIMIT ?)',
+                        (guild_id,), batch_size)
+        return deleted
+
+    async def replace_guild_rows(self, guild_id, tables, chunks, batch_size=500):
+        """Replace a guild's rows in ``tables`` ({table: columns}) with (table, rows) from an async iterator.
+
+        Each chunk is its own transaction on this connection, so other writes run
+        between chunks instead of waiting on a second connection's lock.
+        """
+        for table in tables:
+            await self._delete_batched(
+                f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE guild_id = ? LIMIT ?)',
+                (guild_id,), batch_size)
+        async for table, rows in chunks:
+            columns = tables[table]
+            await self.db.executemany(f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) '
+                                      f'VALUES ({", ".join("?" * len(columns))})', rows)
+            await self.db.commit()
+            await asyncio.sleep(0)
+
+    async def prune_members(self, guild_id, keep_user_ids, batch_size=500):
+        deleted = 0
+        for table in MEMBER_TABLES:
+            rows = await self._fetchall(f'SELECT DISTINCT user_id FROM {table} WHERE guild_id = ?',
+                                        (guild_id,))
+            departed = [user_id for (user_id,) in rows if user_id not in keep_user_ids]
+            for start in range(0, len(departed), batch_size):
+                chunk = departed[start:start + batch_size]
+                cursor = await self.db.execute(
+                    f'DELETE FROM {table} WHERE guild_id = ? AND user_id IN ({", ".join("?" * len(chunk))})',
+                    (guild_id, *chunk))
+                await self.db.commit()
+                deleted += cursor.rowcount
+                await asyncio.sleep(0)
+        return deleted
+
+    async def optimize(self, vacuum_pages=2000):
+        await self.db.execute('PRAGMA analysis_limit = 1000')
+        await self.db.execute('ANALYZE')
+        await self.db.commit()
+        busy, wal_pages, checkpointed = await self._fetchone('PRAGMA wal_checkpoint(PASSIVE)', ())
+        free_before = (await self._fetchone('PRAGMA freelist_count', ()))[0]
+        await self._fetchall(f'PRAGMA incremental_vacuum({int(vacuum_pages)})', ())
+        free_after = (await self._fetchone('PRAGMA freelist_count', ()))[0]
+        return {
+            'analyzed': True,
+            'wal_pages_checkpointed': checkpointed,
+            'pages_vacuumed': free_before - free_after,
+        }
+
+    async def get_guild_settings(self, guild_id):
+        row = await self._fetchone('''
+            SELECT prefix, welcome_channel_id, log_channel_id
+            FROM guild_settings WHERE guild_id = ?
+        ''', (guild_id,))
+        if row is None:
+            return None
+        return {'prefix': row[0], 'welcome_channel_id': row[1], 'log_channel_id': row[2]}
+
+    async def ensure_guild(self, guild_id, prefix):
+        await self._write('INSERT OR IGNORE INTO guild_settings (guild_id, prefix) VALUES (?, ?)',
+                          (guild_id, prefix))
+
+    async def set_prefix(self, guild_id, prefix):
+        await self._write('UPDATE guild_settings SET prefix = ? WHERE guild_id = ?',
+                          (prefix, guild_id))
+
+    async def get_raid_settings(self, guild_id):
+        row = await self._fetchone('''
+            SELECT join_threshold, window_seconds, slowmode_seconds, raise_verification
+            FROM raid_settings WHERE guild_id = ?
+        ''', (guild_id,))
+        return (row[0], row[1], row[2], bool(row[3])) if row else None
+
+    async def set_raid_settings(self, guild_id, threshold, window, slowmode, raise_verification):
+        await self._write('''
+            INSERT OR REPLACE INTO raid_settings
+            (guild_id, join_threshold, window_seconds, slowmode_seconds, raise_verification)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (guild_id, threshold, window, slowmode, int(raise_verification)))
+
+    async def get_level_curve(self, guild_id):
+        return await self._fetchone('SELECT kind, params FROM level_curves WHERE guild_id = ?',
+                                    (guild_id,))
+
+    async def set_level_curve(self, guild_id, kind, params):
+        await self._write('INSERT OR REPLACE INTO level_curves (guild_id, kind, params) VALUES (?, ?, ?)',
+                          (guild_id, kind, params))
+
+    async def get_self_roles(self, guild_id):
+        rows = await self._fetchall('SELECT role_id FROM self_roles WHERE guild_id = ?', (guild_id,))
+        return [row[0] for row in rows]
+
+    async def add_self_role(self, guild_id, role_id):
+        await self._write('INSERT OR IGNORE INTO self_roles (guild_id, role_id) VALUES (?, ?)',
+                          (guild_id, role_id))
+
+    async def remove_self_role(self, guild_id, role_id):
+        await self._write('DELETE FROM self_roles WHERE guild_id = ? AND role_id = ?',
+                          (guild_id, role_id))
+
+    async def get_link_rules(self, guild_id):
+        return await self._fetchall('SELECT domain, action FROM link_rules WHERE guild_id = ?', (guild_id,))
+
+    async def set_link_rule(self, guild_id, domain, action):
+        await self._write('INSERT OR REPLACE INTO link_rules (guild_id, domain, action) VALUES (?, ?, ?)',
+                          (guild_id, domain, action))
+
+    async def remove_link_rule(self, guild_id, domain):
+        cursor = await self.db.execute('DELETE FROM link_rules WHERE guild_id = ? AND domain = ?',
+                                       (guild_id, domain))
+        await self.db.commit()
+        return cursor.rowcount > 0
+
+    async def get_xp(self, guild_id, user_id):
+        return await self._fetchone('SELECT xp, level FROM user_xp WHERE user_id = ? AND guild_id = ?',
+                                    (user_id, guild_id))
+
+    async def add_xp(self, guild_id, user_id, amount):
+        await self.db.execute('''
+            INSERT INTO user_xp (user_id, guild_id, xp, level) VALUES (?, ?, ?, 0)
+            ON CONFLICT (user_id, guild_id) DO UPDATE SET xp = xp + excluded.xp
+        ''', (user_id, guild_id, amount))
+        row = await self._fetchone('SELECT xp, level FROM user_xp WHERE user_id = ? AND guild_id = ?',
+                                   (user_id, guild_id))
+        await self.db.commit()
+        return row
+
+    async def add_xp_many(self, gains):
+        await self.db.executemany('''
+            INSERT INTO user_xp (user_id, guild_id, xp, level) VALUES (?, ?, ?, 0)
+            ON CONFLICT (user_id, guild_id) DO UPDATE SET xp = xp + excluded.xp
+        ''', [(user_id, guild_id, amount) for guild_id, user_id, amount in gains])
+        by_guild = defaultdict(list)
+        for guild_id, user_id, _ in gains:
+            by_guild[guild_id].append(user_id)
+        rows = []
+        for guild_id, user_ids in by_guild.items():
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows += [(guild_id, *row) for row in await self._fetchall(f'''
+                    SELECT user_id, xp, level FROM user_xp
+                    WHERE guild_id = ? AND user_id IN ({", ".join("?" * len(chunk))})
+                ''', (guild_id, *chunk))]
+        await self.db.commit()
+        return rows
+
+    async def set_level(self, guild_id, user_id, level):
+        await self._write('UPDATE user_xp SET level = ? WHERE user_id = ? AND guild_id = ?',
+                          (level, user_id, guild_id))
+
+    async def set_levels(self, guild_id, updates):
+        await self.db.executemany('UPDATE user_xp SET level = ? WHERE user_id = ? AND guild_id = ?',
+                                  [(level, user_id, guild_id) for user_id, level in updates])
+        await self.db.commit()
+
+    async def guild_xp(self, guild_id):
+        return await self._fetchall('SELECT user_id, xp, level FROM user_xp WHERE guild_id = ?',
+                                    (guild_id,))
+
+    async def count_ranked(self, guild_id):
+        row = await self._fetchone('SELECT COUNT(*) FROM user_xp WHERE guild_id = ?', (guild_id,))
+        return row[0]
+
+    async def leaderboard(self, guild_id, limit, offset=0):
+        return await self._fetchall('''
+            SELECT user_id, xp, level FROM user_xp
+            WHERE guild_id = ?
+            ORDER BY xp DESC
+            LIMIT ? OFFSET ?
+        ''', (guild_id, limit, offset))
+
+    async def record_xp_gains(self, gains):
+        await self.db.executemany('''
+            INSERT INTO xp_history (guild_id, user_id, period, bucket_start, xp)
+            VALUES (?, ?, 'h', ?, ?)
+            ON CONFLICT (guild_id, user_id, period, bucket_start) DO UPDATE SET xp = xp + excluded.xp
+        ''', gains)
+        await self.db.commit()
+
+    async def compact_xp_history(self, hourly_cutoff, daily_cutoff, weekly_cutoff):
+        for target, source, cutoff, align in (('d', 'h', hourly_cutoff, DAY_ALIGN),
+                                              ('w', 'd', daily_cutoff, WEEK_ALIGN)):
+            await self.db.execute(ROLL_UP.format(align=align), (target, source, cutoff))
+            await self.db.execute('DELETE FROM xp_history WHERE period = ? AND bucket_start < ?',
+                                  (source, cutoff))
+        await self.db.execute("DELETE FROM xp_history WHERE period = 'w' AND bucket_start < ?",
+                              (weekly_cutoff,))
+        await self.db.commit()
+
+    async def top_xp_gains(self, guild_id, since, limit):
+        return await self._fetchall('''
+            SELECT user_id, SUM(xp) AS gained FROM xp_history
+            WHERE guild_id = ? AND bucket_start >= ?
+            GROUP BY user_id
+            ORDER BY gained DESC
+            LIMIT ?
+        ''', (guild_id, since, limit))
+
+    async def xp_history(self, guild_id, user_id, since):
+        return await self._fetchall('''
+            SELECT bucket_start, xp FROM xp_history
+            WHERE guild_id = ? AND user_id = ? AND bucket_start >= ?
+            ORDER BY bucket_start
+        ''', (guild_id, user_id, since))
+
+    async def add_custom_command(self, guild_id, command, response):
+        cursor = await self.db.execute('''
+            INSERT OR IGNORE INTO custom_commands (guild_id, command, response)
+            VALUES (?, ?, ?)
+        ''', (guild_id, command, response))
+        await self.db.commit()
+        return cursor.rowcount > 0
+
+    async def get_custom_command(self, guild_id, command):
+        row = await self._fetchone('SELECT response FROM custom_commands WHERE guild_id = ? AND command = ?',
+                                   (guild_id, command))
+        return row[0] if row else None
+
+    async def count_custom_command_use(self, guild_id, command):
+        await self.db.execute('UPDATE custom_commands SET uses = uses + 1 WHERE guild_id = ? AND command = ?',
+                              (guild_id, command))
+        row = await self._fetchone('SELECT uses FROM custom_commands WHERE guild_id = ? AND command = ?',
+                                   (guild_id, command))
+        await self.db.commit()
+        return row[0] if row else 0
+
+    async def add_reminder(self, guild_id, user_id, text, remind_at):
+        await self._write('''
+            INSERT INTO reminders (user_id, guild_id, reminder_text, reminder_time)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, guild_id, text, remind_at))
+
+    async def pop_due_reminders(self, now):
+        rows = await self._fetchall('''
+            SELECT rowid, guild_id, user_id, reminder_text, reminder_time
+            FROM reminders WHERE reminder_time <= ?
+        ''', (now,))
+        await self.db.executemany('DELETE FROM reminders WHERE rowid = ?', [(row[0],) for row in rows])
+        await self.db.commit()
+        return [tuple(row[1:]) for row in rows]
+
+    async def add_warning(self, guild_id, user_id, moderator_id, reason, created_at):
+        cursor = await self.db.execute('''
+            INSERT INTO warnings (guild_id, user_id, moderator_id, reason, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (guild_id, user_id, moderator_id, reason, created_at))
+        await self.db.commit()
+        return cursor.lastrowid
+
+    async def get_warnings(self, guild_id, user_ids, since=0):
+        user_ids = list(user_ids)
+        rows = []
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows += await self._fetchall(f'''
+                SELECT user_id, id, moderator_id, reason, created_at FROM warnings
+                WHERE guild_id = ? AND user_id IN ({", ".join("?" * len(chunk))}) AND created_at >= ?
+                ORDER BY created_at
+            ''', (guild_id, *chunk, since))
+        if len(user_ids) > 500:
+            rows.sort(key=lambda row: row[4])
+        return [tuple(row) for row in rows]
+
+    async def clear_warnings(self, guild_id, user_id):
+        cursor = await self.db.execute('DELETE FROM warnings WHERE guild_id = ? AND user_id = ?',
+                                       (guild_id, user_id))
+        await self.db.commit()
+        return cursor.rowcount
+
+    async def get_warn_rules(self, guild_id):
+        return await self._fetchall(
+            'SELECT warnings, window_seconds, mute_seconds FROM warn_rules WHERE guild_id = ?', (guild_id,))
+
+    async def set_warn_rule(self, guild_id, warnings, window_seconds, mute_seconds):
+        await self._write('''
+            INSERT OR REPLACE INTO warn_rules (guild_id, warnings, window_seconds, mute_seconds)
+            VALUES (?, ?, ?, ?)
+        ''', (guild_id, warnings, window_seconds, mute_seconds))
+
+    async def remove_warn_rule(self, guild_id, warnings):
+        cursor = await self.db.execute('DELETE FROM warn_rules WHERE guild_id = ? AND warnings = ?',
+                                       (guild_id, warnings))
+        await self.db.commit()
+        return cursor.rowcount > 0
+
+
+def vacuum(path):
+    """Rebuild the database so incremental auto-vacuum takes effect. Returns the new mode"""
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline maintenance for the SQLite database')
+    parser.add_argument('action', choices=['vacuum'])
+    parser.add_argument('--db', default='bot.db', help='SQLite database path')
+    args = parser.parse_args()
+    print(f'Vacuuming {args.db}; the bot must not be running')
+    mode = vacuum(args.db)
+    print('Incremental auto-vacuum enabled' if mode == 2 else f'auto_vacuum is {mode}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Per-guild fairness in the event dispatcher"""
+import asyncio
+
+from utils.dispatch import COMMAND, GuildDispatcher
+
+
+def test_busy_guild_cannot_hold_every_worker():
+    async def run():
+        dispatcher = GuildDispatcher(workers=4, max_in_flight=2, detach_after=60)
+        dispatcher.start()
+        release = asyncio.Event()
+        finished = []
+
+        async def slow():
+            await release.wait()
+
+        async def fast(i):
+            finished.append(i)
+
+        for _ in range(10):
+            dispatcher.submit(1, COMMAND, slow)
+        for i in range(5):
+            dispatcher.submit(2, COMMAND, fast, i)
+        await asyncio.sleep(0.05)
+        running = dispatcher.stats(1)['running']
+        release.set()
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+        return running, finished, dispatcher.stats(1)['processed']
+
+    running, finished, processed = asyncio.run(run())
+    assert running == 2
+    assert finished == [0, 1, 2, 3, 4]
+    assert processed == 10
+
+
+def test_long_jobs_are_detached_from_their_worker():
+    async def run():
+        dispatcher = GuildDispatcher(workers=1, max_in_flight=1, detach_after=0.01, max_detached=2)
+        dispatcher.start()
+        release = asyncio.Event()
+        finished = []
+
+        async def slow():
+            await release.wait()
+
+        async def fast():
+            finished.append(True)
+
+        for _ in range(3):
+            dispatcher.submit(1, COMMAND, slow)
+        dispatcher.submit(1, COMMAND, fast)
+        await asyncio.sleep(0.1)
+        # Two slow jobs detached; the third holds the only worker until released
+        stats = dispatcher.stats(1)
+        release.set()
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+        return stats, finished
+
+    stats, finished = asyncio.run(run())
+    assert stats['detached'] == 2 and stats['running'] == 1
+    assert finished == [True]
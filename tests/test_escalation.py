@@ -0,0 +1,162 @@
+"""Warning rule matching, member history bounds and mute escalation"""
+import asyncio
+
+from cogs.moderation import Moderation
+from utils.escalation import WarningTracker, WarnRule
+
+GUILD = 1
+RULES = [(3, 60, 600), (5, 3600, 86400)]   # (warnings, window, mute)
+
+
+def tracker_with_rules(rules=RULES, **kwargs):
+    tracker = WarningTracker(**kwargs)
+    tracker.set_rules(GUILD, rules)
+    return tracker
+
+
+def test_rule_matches_only_inside_its_window():
+    tracker = tracker_with_rules()
+    assert tracker.record(GUILD, 10, now=0) is None
+    assert tracker.record(GUILD, 10, now=30) is None
+    assert tracker.record(GUILD, 10, now=60).mute == 600
+
+    tracker = tracker_with_rules()
+    for now in (0, 30, 61):
+        rule = tracker.record(GUILD, 10, now=now)
+    assert rule is None   # the first warning is 61 seconds older than the third
+
+
+def test_harshest_matching_rule_wins():
+    tracker = tracker_with_rules()
+    rules = [tracker.record(GUILD, 10, now=now) for now in range(0, 50, 10)]
+    assert [rule and rule.mute for rule in rules] == [None, None, 600, 600, 86400]
+
+
+def test_members_and_guilds_are_tracked_separately():
+    tracker = tracker_with_rules()
+    tracker.set_rules(2, RULES)
+    for now in (0, 1):
+        tracker.record(GUILD, 10, now=now)
+        tracker.record(GUILD, 11, now=now)
+        tracker.record(2, 10, now=now)
+    assert tracker.record(GUILD, 10, now=2).mute == 600
+    assert tracker.record(2, 12, now=2) is None
+
+
+def test_guild_without_rules_tracks_nothing():
+    tracker = WarningTracker()
+    tracker.set_rules(GUILD, [])
+    assert tracker.record(GUILD, 10, now=0) is None
+    assert not tracker.needs_seed(GUILD, 10)
+    assert len(tracker) == 0
+
+
+def test_history_is_bounded_by_the_largest_rule():
+    tracker = tracker_with_rules()
+    for now in range(100):
+        tracker.record(GUILD, 10, now=now)
+    assert len(tracker.members[tracker.key(GUILD, 10)]) == 5
+
+
+def test_seeding_counts_stored_warnings():
+    tracker = tracker_with_rules()
+    assert tracker.needs_seed(GUILD, 10)
+    assert tracker.longest_window(GUILD) == 3600
+    tracker.seed(GUILD, 10, [100, 200, 300, 400, 500, 600, 700])
+    assert not tracker.needs_seed(GUILD, 10)
+    assert list(tracker.members[tracker.key(GUILD, 10)]) == [300, 400, 500, 600, 700]
+    assert tracker.record(GUILD, 10, now=710).mute == 86400
+
+
+def test_changing_rules_reseeds_the_guild_only():
+    tracker = tracker_with_rules()
+    tracker.set_rules(2, RULES)
+    tracker.record(GUILD, 10, now=0)
+    tracker.record(2, 10, now=0)
+    tracker.set_rules(GUILD, [(2, 60, 60)])
+    assert tracker.needs_seed(GUILD, 10)
+    assert not tracker.needs_seed(2, 10)
+
+
+def test_idle_and_excess_members_are_forgotten():
+    tracker = tracker_with_rules(horizon=100, max_entries=2)
+    tracker.record(GUILD, 10, now=0)
+    tracker.record(GUILD, 11, now=150)
+    assert tracker.needs_seed(GUILD, 10)   # idle past the horizon
+    tracker.record(GUILD, 12, now=151)
+    tracker.record(GUILD, 13, now=152)
+    assert len(tracker) == 2
+    assert tracker.needs_seed(GUILD, 11)   # least recently warned goes first
+
+
+class FakeRole:
+    pass
+
+
+class FakeMember:
+    def __init__(self, muted_role, muted):
+        self.id = 10
+        self.mention = '@member'
+        self.roles = [muted_role] if muted else []
+
+    async def add_roles(self, role, reason=None):
+        self.roles.append(role)
+
+
+class FakeGuild:
+    id = GUILD
+
+
+class FakeChannel:
+    id = 99
+
+
+class FakeContext:
+    guild = FakeGuild()
+    channel = FakeChannel()
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def escalate(muted, pending_unmute_at, rule, now=1000):
+    """Run Moderation.escalate and return the scheduled unmute times"""
+    moderation = Moderation(None)
+    muted_role = FakeRole()
+    scheduled = []
+
+    async def get_muted_role(guild):
+        return muted_role
+
+    async def log_action(*args):
+        pass
+
+    moderation.get_muted_role = get_muted_role
+    moderation.log_action = log_action
+    moderation.schedule_unmute = lambda guild_id, member_id, channel_id, unmute_at: scheduled.append(unmute_at)
+    if pending_unmute_at is not None:
+        moderation.pending_unmutes[(GUILD, 10)] = (pending_unmute_at, FakeChannel.id)
+    try:
+        asyncio.run(moderation.escalate(FakeContext(), FakeMember(muted_role, muted), rule, now))
+    finally:
+        moderation.hash_pool.shutdown(wait=False)
+    return scheduled
+
+
+def test_escalation_mutes_an_unmuted_member():
+    assert escalate(False, None, WarnRule(3, 60, 600)) == [1600]
+
+
+def test_escalation_extends_a_shorter_mute():
+    assert escalate(True, 1100, WarnRule(3, 60, 600)) == [1600]
+
+
+def test_escalation_never_shortens_a_longer_mute():
+    assert escalate(True, 5000, WarnRule(3, 60, 600)) == []
+
+
+def test_escalation_never_shortens_an_indefinite_mute():
+    assert escalate(True, None, WarnRule(3, 60, 600)) == []
@@ -0,0 +1,150 @@
+"""Guild export and import round trips"""
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from storage.sqlite import SQLiteStorage
+from utils import guild_data
+
+
+def make_database(path):
+    async def run():
+        storage = SQLiteStorage(path)
+        await storage.connect()
+        try:
+            for guild_id in (1, 2):
+                await storage.ensure_guild(guild_id, '!')
+                await storage.add_xp(guild_id, 10, 100 * guild_id)
+                await storage.add_custom_command(guild_id, 'hi', f'hello from {guild_id}')
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
+
+
+def guild_rows(path, guild_id):
+    async def run():
+        storage = SQLiteStorage(path)
+        await storage.connect()
+        try:
+            xp = await storage.get_xp(guild_id, 10)
+            return (tuple(xp) if xp else None), await storage.get_custom_command(guild_id, 'hi')
+        finally:
+            await storage.close()
+
+    return asyncio.run(run())
+
+
+def write_export(path, header, records):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        f.writelines(json.dumps(record) + '\n' for record in records)
+
+
+def test_export_import_round_trip(tmp_path):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'guild.jsonl.gz')
+    make_database(db)
+
+    exported = guild_data.export_guild(db, 1, export)
+    assert exported['user_xp'] == 1 and exported['custom_commands'] == 1
+    assert guild_data.read_header(export)['guild_id'] == 1
+
+    imported = guild_data.import_guild(db, export, guild_id=3)
+    assert imported == exported
+    assert guild_rows(db, 3) == ((100, 0), 'hello from 1')
+    assert guild_rows(db, 1) == ((100, 0), 'hello from 1')
+    assert guild_rows(db, 2) == ((200, 0), 'hello from 2')
+
+
+def test_import_writes_every_row_to_the_target_guild(tmp_path):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'crafted.jsonl.gz')
+    make_database(db)
+    # Header claims guild 1, but the rows name guild 2
+    write_export(export, guild_data.make_header(1), [
+        {'t': 'user_xp', 'r': [10, 2, 5, 0]},
+        {'t': 'custom_commands', 'r': [2, 'hi', 'overwritten', 0]},
+    ])
+
+    guild_data.import_guild(db, export)
+    assert guild_rows(db, 1) == ((5, 0), 'overwritten')
+    assert guild_rows(db, 2) == ((200, 0), 'hello from 2')
+
+
+def test_staged_import_through_the_storage_connection(tmp_path):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'guild.jsonl.gz')
+    make_database(db)
+    guild_data.export_guild(db, 1, export)
+
+    async def run():
+        target, tables, counts = guild_data.stage_import(export, str(tmp_path / 'staging.db'), guild_id=2)
+
+        async def chunks():
+            for chunk in guild_data.staged_rows(str(tmp_path / 'staging.db'), tables, chunk_size=1):
+                yield chunk
+
+        storage = SQLiteStorage(db)
+        await storage.connect()
+        try:
+            await storage.replace_guild_rows(target, tables, chunks(), batch_size=1)
+        finally:
+            await storage.close()
+        return target, counts
+
+    target, counts = asyncio.run(run())
+    assert target == 2 and counts['user_xp'] == 1
+    assert guild_rows(db, 2) == ((100, 0), 'hello from 1')
+    assert guild_rows(db, 1) == ((100, 0), 'hello from 1')
+
+
+def test_command_use_counts_survive_a_round_trip(tmp_path):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'guild.jsonl.gz')
+    make_database(db)
+
+    async def count_use(guild_id):
+        storage = SQLiteStorage(db)
+        await storage.connect()
+        try:
+            return await storage.count_custom_command_use(guild_id, 'hi')
+        finally:
+            await storage.close()
+
+    for _ in range(3):
+        asyncio.run(count_use(1))
+    guild_data.export_guild(db, 1, export)
+    guild_data.import_guild(db, export, guild_id=3)
+    assert asyncio.run(count_use(3)) == 4
+
+
+def test_version_1_exports_still_import(tmp_path):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'old.jsonl.gz')
+    make_database(db)
+    write_export(export, {'format': 'guild-export', 'version': 1, 'guild_id': 1}, [
+        {'t': 'custom_commands', 'r': [1, 'hi', 'from an old export']},
+    ])
+
+    assert guild_data.import_guild(db, export)['custom_commands'] == 1
+    assert guild_rows(db, 1) == (None, 'from an old export')
+
+
+@pytest.mark.parametrize('header, records', [
+    ({'format': 'something-else'}, []),
+    (guild_data.make_header(1), [{'t': 'user_xp', 'r': [10, 1]}]),
+    (guild_data.make_header(1), [{'t': 'no_such_table', 'r': [1]}]),
+    (guild_data.make_header(1), [{'rows': []}]),
+])
+def test_malformed_import_raises_and_changes_nothing(tmp_path, header, records):
+    db = str(tmp_path / 'bot.db')
+    export = str(tmp_path / 'bad.jsonl.gz')
+    make_database(db)
+    write_export(export, header, records)
+
+    with pytest.raises(ValueError):
+        guild_data.import_guild(db, export)
+    assert guild_rows(db, 1) == ((100, 0), 'hello from 1')
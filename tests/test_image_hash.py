@@ -0,0 +1,57 @@
+"""Near-duplicate image tracking"""
+import time
+
+from utils.image_hash import ImageSpamDetector
+
+
+def check_consistent(detector):
+    live = [bucket for bucket in detector.buckets if bucket.tree is not None]
+    assert detector.size == sum(len(bucket.tree) for bucket in live)
+    assert detector.size == sum(detector.counts.values())
+    for guild_id, buckets in detector.guilds.items():
+        assert detector.counts[guild_id] == sum(len(bucket.tree) for bucket in buckets)
+
+
+def test_near_duplicates_inside_the_window_match():
+    detector = ImageSpamDetector(window=600, radius=2)
+    assert detector.check(1, 0b1111, 'a', now=0) == []
+    assert detector.check(1, 0b1110, 'b', now=10) == ['a']
+    assert detector.check(2, 0b1111, 'c', now=20) == []
+    assert sorted(detector.check(1, 0b1111, 'd', now=599)) == ['a', 'b']
+    assert detector.check(1, 0b1111, 'e', now=1300) == []
+
+
+def test_flood_in_one_guild_keeps_other_guilds_windows():
+    detector = ImageSpamDetector(window=600, bucket_seconds=60, max_fingerprints=1000, max_per_guild=100)
+    detector.check(2, 12345, 'quiet', now=0)
+    for i in range(2000):
+        detector.check(1, i * 7919, i, now=i * 0.25)
+    assert detector.counts[1] <= 100
+    assert detector.check(2, 12345, 'again', now=500) == ['quiet']
+    check_consistent(detector)
+
+
+def test_full_bucket_stops_recording_until_the_next_one():
+    detector = ImageSpamDetector(bucket_seconds=60, max_per_guild=3)
+    for i in range(5):
+        detector.check(1, i << 20, i, now=1)
+    assert detector.counts[1] == 3
+    detector.check(1, 99 << 20, 'next', now=61)
+    assert detector.counts[1] == 1
+    check_consistent(detector)
+
+
+def test_global_cap_and_snapshot_round_trip():
+    base = time.time() - 300
+    detector = ImageSpamDetector(max_fingerprints=50, max_per_guild=20)
+    for guild_id in range(10):
+        for i in range(10):
+            detector.check(guild_id, (guild_id << 32) | i, i, now=base + guild_id * 20 + i)
+    assert len(detector) <= 50
+    check_consistent(detector)
+
+    restored = ImageSpamDetector(max_fingerprints=50, max_per_guild=20)
+    restored.load_state(detector.dump_state())
+    assert len(restored) == len(detector)
+    assert restored.counts == detector.counts
+    check_consistent(restored)
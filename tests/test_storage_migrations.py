@@ -0,0 +1,74 @@
+"""SQLite schema migrations, from scratch and from an older database"""
+import asyncio
+import sqlite3
+
+from storage.sqlite import MIGRATIONS, SQLiteStorage
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def user_version(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def columns(path, table):
+    with sqlite3.connect(path) as conn:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def test_new_database_is_fully_migrated(tmp_path):
+    path = str(tmp_path / 'bot.db')
+
+    async def run():
+        storage = SQLiteStorage(path)
+        await storage.connect()
+        await storage.close()
+
+    asyncio.run(run())
+    assert user_version(path) == LATEST
+    assert 'uses' in columns(path, 'custom_commands')
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def test_old_database_is_upgraded_and_keeps_its_rows(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    with sqlite3.connect(path) as conn:
+        for version, _, statements in MIGRATIONS[:2]:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+        conn.execute('INSERT INTO user_xp (user_id, guild_id, xp, level) VALUES (10, 1, 250, 2)')
+        conn.execute("INSERT INTO custom_commands (guild_id, command, response) VALUES (1, 'hi', 'hello')")
+
+    async def run():
+        storage = SQLiteStorage(path)
+        await storage.connect()
+        try:
+            return (await storage.get_xp(1, 10),
+                    await storage.get_custom_command(1, 'hi'),
+                    await storage.count_custom_command_use(1, 'hi'),
+                    await storage.get_link_rules(1))
+        finally:
+            await storage.close()
+
+    xp, response, uses, link_rules = asyncio.run(run())
+    assert user_version(path) == LATEST
+    assert tuple(xp) == (250, 2)
+    assert response == 'hello'
+    assert uses == 1
+    assert not link_rules
+
+
+def test_migrating_twice_is_a_no_op(tmp_path):
+    path = str(tmp_path / 'bot.db')
+
+    async def run():
+        for _ in range(2):
+            storage = SQLiteStorage(path)
+            await storage.connect()
+            await storage.close()
+
+    asyncio.run(run())
+    assert user_version(path) == LATEST
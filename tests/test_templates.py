@@ -0,0 +1,35 @@
+"""Custom command templates"""
+import pytest
+
+from utils.templates import TemplateError, TemplateLimits, compile_template, literal_template
+
+CONTEXT = {'user': 'Ann', 'mention': '<@1>', 'server': 'Guild', 'channel': 'general', 'args': 'x', 'count': '3'}
+
+
+def test_variables_and_escapes_render():
+    template = compile_template('Hi {user}, used {count} times {{literally}}')
+    assert template.render(CONTEXT) == 'Hi Ann, used 3 times {literally}'
+    assert template.variables == {'user', 'count'}
+
+
+def test_choice_picks_one_option():
+    template = compile_template('{choice:a {user}|b}')
+    assert {template.render(CONTEXT) for _ in range(50)} == {'a Ann', 'b'}
+
+
+@pytest.mark.parametrize('source', ['{nope}', 'open {user', 'close }', '{choice:a|b', 'x' * 1501])
+def test_invalid_templates_are_rejected(source):
+    with pytest.raises(TemplateError):
+        compile_template(source)
+
+
+def test_output_is_truncated():
+    template = compile_template('{args}' * 10)
+    limits = TemplateLimits(max_output=25)
+    assert template.render(dict(CONTEXT, args='abcdef'), limits) == ('abcdef' * 5)[:25]
+
+
+def test_literal_template_renders_plain_text():
+    source = 'Legacy response with {braces} and }'
+    assert literal_template(source).render(CONTEXT) == source
+    assert literal_template('').render(CONTEXT) == ''
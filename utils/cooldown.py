@@ -0,0 +1,94 @@
+"""Per-(guild, user) XP cooldown with diminishing returns.
+
+Entries are ``__slots__`` records in an OrderedDict ordered by last grant, so
+both the per-message check and expiry of idle users are O(1) amortized and
+memory stays bounded by ``max_entries``.
+"""
+import time
+from collections import OrderedDict
+
+
+class XPWindow:
+    """Grant history for one member"""
+    __slots__ = ('last_grant', 'window_start', 'grants')
+
+    def __init__(self, now):
+        self.last_grant = now
+        self.window_start = now
+        self.grants = 0
+
+
+class XPCooldown:
+    def __init__(self, cooldown=30, window=600, full_grants=10, max_entries=1_000_000):
+        self.cooldown = cooldown          # minimum seconds between grants
+        self.window = window              # diminishing-returns window in seconds
+        self.full_grants = full_grants    # grants per window at the full rate
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def key(guild_id, user_id):
+        # Discord snowflakes fit in 64 bits; one int is smaller than a tuple of two
+        return (guild_id << 64) | user_id
+
+    def peek(self, guild_id, user_id, now=None):
+        """Return the multiplier ``grant`` would give, without recording a grant"""
+        now = time.time() if now is None else now
+        entry = self.entries.get(self.key(guild_id, user_id))
+        if entry is None:
+            return 1.0
+        if now - entry.last_grant < self.cooldown:
+            return 0.0
+        grants = 1 if now - entry.window_start >= self.window else entry.grants + 1
+        if grants <= self.full_grants:
+            return 1.0
+        return self.full_grants / grants
+
+    def grant(self, guild_id, user_id, now=None):
+        """Return the XP multiplier for a message, 0 if the member is on cooldown"""
+        now = time.time() if now is None else now
+        key = self.key(guild_id, user_id)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            entry = self.entries[key] = XPWindow(now)
+        elif now - entry.last_grant < self.cooldown:
+            return 0.0
+        else:
+            self.entries.move_to_end(key)
+            if now - entry.window_start >= self.window:
+                entry.window_start = now
+                entry.grants = 0
+
+        entry.last_grant = now
+        entry.grants += 1
+        self._expire(now)
+
+        if entry.grants <= self.full_grants:
+            return 1.0
+        return self.full_grants / entry.grants
+
+    def _expire(self, now):
+        # Oldest grant is always first, so stop at the first live entry
+        entries = self.entries
+        horizon = now - max(self.cooldown, self.window)
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.last_grant > horizon and len(entries) <= self.max_entries:
+                break
+            del entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def dump_state(self):
+        """Entries as (key, last_grant, window_start, grants) tuples, oldest grant first"""
+        return [(key, e.last_grant, e.window_start, e.grants) for key, e in self.entries.items()]
+
+    def load_state(self, rows):
+        for key, last_grant, window_start, grants in rows:
+            entry = XPWindow(last_grant)
+            entry.window_start = window_start
+            entry.grants = grants
+            self.entries[key] = entry
+        self._expire(time.time())
@@ -0,0 +1,199 @@
+"""Per-guild fair scheduling for event handler work.
+
+Handlers submit jobs tagged with a guild and a priority instead of running
+them straight away. Each guild has a bounded queue; a pool of workers takes
+jobs from the guilds in weighted round-robin order, so a guild in the middle
+of a raid gets its turn like everyone else instead of filling the loop.
+Within a guild, higher-priority jobs run first. When a guild's queue is full
+the oldest job of its lowest priority is shed, and once the total backlog
+passes a limit, low-priority work is refused outright.
+
+A guild may only have ``max_in_flight`` jobs running at once; it leaves the
+round-robin while it is at that limit, so the workers left over serve other
+guilds. A job still running after ``detach_after`` seconds (a trivia game, a
+purge) carries on as its own task and frees both the worker and the guild's
+slot, up to ``max_detached`` such jobs per guild.
+"""
+import asyncio
+import traceback
+from collections import deque
+
+MODERATION = 0
+COMMAND = 1
+XP = 2
+PRIORITY_NAMES = ('moderation', 'commands', 'xp')
+
+
+class GuildQueue:
+    """Pending jobs and counters for one guild"""
+    __slots__ = ('jobs', 'depth', 'weight', 'credit', 'running', 'detached', 'processed', 'shed', 'peak')
+
+    def __init__(self, weight):
+        self.jobs = tuple(deque() for _ in PRIORITY_NAMES)
+        self.depth = 0
+        self.weight = weight     # jobs this guild may run per round
+        self.credit = 0          # jobs left in its current turn
+        self.running = 0         # jobs holding a worker
+        self.detached = 0        # long jobs running on their own
+        self.processed = 0
+        self.shed = [0] * len(PRIORITY_NAMES)
+        self.peak = 0
+
+
+class GuildDispatcher:
+    def __init__(self, workers=8, max_depth=200, max_backlog=5000, shed_priority=XP,
+                 max_in_flight=2, detach_after=5, max_detached=20):
+        self.workers = workers
+        self.max_depth = max_depth          # queued jobs per guild
+        self.max_backlog = max_backlog      # queued jobs overall before low-priority work is refused
+        self.shed_priority = shed_priority  # priorities at or below this are refused under overload
+        self.max_in_flight = max_in_flight  # workers one guild may hold at once
+        self.detach_after = detach_after    # seconds before a job stops holding its worker
+        self.max_detached = max_detached    # detached jobs per guild; beyond this they keep the worker
+        self.guilds = {}
+        self.ready = deque()                # guilds with queued jobs and a free slot, in round-robin order
+        self.backlog = 0
+        self.idle = deque()                 # futures of workers waiting for a ready guild
+        self.detached = set()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        tasks = self.tasks + list(self.detached)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        self.detached.clear()
+
+    def _queue(self, guild_id):
+        queue = self.guilds.get(guild_id)
+        if queue is None:
+            queue = self.guilds[guild_id] = GuildQueue(1)
+        return queue
+
+    def set_weight(self, guild_id, weight):
+        self._queue(guild_id).weight = max(1, int(weight))
+
+    def submit(self, guild_id, priority, func, *args):
+        """Queue ``func(*args)``. Returns False if the job was shed instead"""
+        queue = self._queue(guild_id)
+        if not self.tasks:
+            queue.shed[priority] += 1
+            return False
+        if self.backlog >= self.max_backlog and priority >= self.shed_priority:
+            queue.shed[priority] += 1
+            return False
+
+        if queue.depth >= self.max_depth:
+            # Make room by dropping the oldest job of the lowest priority below this one
+            for lower in range(len(queue.jobs) - 1, priority, -1):
+                if queue.jobs[lower]:
+                    queue.jobs[lower].popleft()
+                    queue.shed[lower] += 1
+                    break
+            else:
+                queue.shed[priority] += 1
+                return False
+        else:
+            queue.depth += 1
+            self.backlog += 1
+            if queue.depth == 1 and queue.running < self.max_in_flight:
+                self.ready.append(guild_id)
+            self._wake()
+
+        queue.jobs[priority].append((func, args))
+        queue.peak = max(queue.peak, queue.depth)
+        return True
+
+    def _next(self):
+        guild_id = self.ready[0]
+        queue = self.guilds[guild_id]
+        if queue.credit <= 0:
+            queue.credit = queue.weight
+        job = next(jobs for jobs in queue.jobs if jobs).popleft()
+        queue.depth -= 1
+        queue.credit -= 1
+        queue.running += 1
+        self.backlog -= 1
+        if not queue.depth or queue.running >= self.max_in_flight:
+            # Out of work or out of slots; it rejoins the round-robin when one of its jobs ends
+            self.ready.popleft()
+            queue.credit = 0
+        elif queue.credit <= 0:
+            self.ready.rotate(-1)
+        return guild_id, queue, job
+
+    def _release(self, guild_id, queue):
+        queue.running -= 1
+        if queue.running == self.max_in_flight - 1 and queue.depth:
+            self.ready.append(guild_id)
+            self._wake()
+
+    def _wake(self):
+        while self.idle:
+            waiter = self.idle.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _run(self, guild_id, queue, func, args):
+        try:
+            await func(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            print(f'Error in {getattr(func, "__qualname__", func)} for guild {guild_id}:')
+            traceback.print_exc()
+        queue.processed += 1
+
+    def _detach(self, queue, task):
+        queue.detached += 1
+        self.detached.add(task)
+
+        def done(task):
+            queue.detached -= 1
+            self.detached.discard(task)
+
+        task.add_done_callback(done)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.ready:
+                waiter = loop.create_future()
+                self.idle.append(waiter)
+                await waiter   # woken by _wake; may find the work already taken and wait again
+                continue
+            guild_id, queue, (func, args) = self._next()
+            task = loop.create_task(self._run(guild_id, queue, func, args))
+            try:
+                await asyncio.wait((task,), timeout=self.detach_after)
+                if not task.done() and queue.detached < self.max_detached:
+                    self._detach(queue, task)
+                else:
+                    await task
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._release(guild_id, queue)
+
+    def stats(self, guild_id):
+        """Queue depth per priority and lifetime counters for a guild"""
+        queue = self.guilds.get(guild_id) or GuildQueue(1)
+        return {
+            'queued': {name: len(jobs) for name, jobs in zip(PRIORITY_NAMES, queue.jobs)},
+            'shed': dict(zip(PRIORITY_NAMES, queue.shed)),
+            'processed': queue.processed,
+            'running': queue.running,
+            'detached': queue.detached,
+            'peak': queue.peak,
+            'weight': queue.weight,
+        }
+
+    def busiest(self, limit=5):
+        """Guild ids with the most queued jobs, then the most shed jobs"""
+        return sorted(self.guilds, key=lambda g: (-self.guilds[g].depth, -sum(self.guilds[g].shed)))[:limit]
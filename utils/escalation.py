@@ -0,0 +1,91 @@
+"""Warning escalation rules evaluated from in-memory counters.
+
+Each member's recent warning times are kept in a deque bounded by the
+largest warning count among the guild's rules. A rule "n warnings within w
+seconds" matches when the n-th most recent warning is at most w seconds old,
+so checking a rule is one index into the deque rather than a history query.
+Members idle for longer than ``horizon`` are forgotten; their deques are
+seeded from storage again on their next warning.
+"""
+import time
+from collections import OrderedDict, deque
+
+MAX_RULE_WARNINGS = 50
+HORIZON = 30 * 86400   # longest rule window allowed
+
+
+class WarnRule:
+    __slots__ = ('warnings', 'window', 'mute')
+
+    def __init__(self, warnings, window, mute):
+        self.warnings = warnings   # warnings needed inside the window
+        self.window = window       # seconds
+        self.mute = mute           # mute length in seconds
+
+
+class WarningTracker:
+    def __init__(self, horizon=HORIZON, max_entries=100_000):
+        self.horizon = horizon
+        self.max_entries = max_entries
+        self.rules = {}              # guild_id -> [WarnRule], longest mute first
+        self.members = OrderedDict()  # member key -> deque of warning times, least recently warned first
+
+    @staticmethod
+    def key(guild_id, user_id):
+        return (guild_id << 64) | user_id
+
+    def loaded(self, guild_id):
+        return guild_id in self.rules
+
+    def set_rules(self, guild_id, rules):
+        """Replace a guild's rules from (warnings, window, mute) rows"""
+        self.rules[guild_id] = sorted((WarnRule(*rule) for rule in rules), key=lambda r: -r.mute)
+        # Deque bounds may have changed; members are reseeded from storage on their next warning
+        for key in [k for k in self.members if k >> 64 == guild_id]:
+            del self.members[key]
+
+    def longest_window(self, guild_id):
+        return max((rule.window for rule in self.rules.get(guild_id, ())), default=0)
+
+    def needs_seed(self, guild_id, user_id):
+        return bool(self.rules.get(guild_id)) and self.key(guild_id, user_id) not in self.members
+
+    def seed(self, guild_id, user_id, timestamps):
+        """Start tracking a member from their stored warning times, oldest first"""
+        depth = max(rule.warnings for rule in self.rules[guild_id])
+        self.members[self.key(guild_id, user_id)] = deque(timestamps, maxlen=depth)
+
+    def forget(self, guild_id, user_id):
+        self.members.pop(self.key(guild_id, user_id), None)
+
+    def record(self, guild_id, user_id, now=None):
+        """Count a warning and return the harshest rule it triggers, or None"""
+        rules = self.rules.get(guild_id)
+        if not rules:
+            return None
+        now = time.time() if now is None else now
+        key = self.key(guild_id, user_id)
+        times = self.members.get(key)
+        if times is None:
+            times = self.members[key] = deque(maxlen=max(rule.warnings for rule in rules))
+        else:
+            self.members.move_to_end(key)
+        times.append(now)
+        self._expire(now)
+
+        for rule in rules:
+            if len(times) >= rule.warnings and now - times[-rule.warnings] <= rule.window:
+                return rule
+        return None
+
+    def _expire(self, now):
+        horizon = now - self.horizon
+        members = self.members
+        while members:
+            key, times = next(iter(members.items()))
+            if times and times[-1] > horizon and len(members) <= self.max_entries:
+                break
+            del members[key]
+
+    def __len__(self):
+        return len(self.members)
@@ -0,0 +1,264 @@
+"""Streaming export and import of a single guild's rows.
+
+Exports are either gzip-compressed JSON Lines (one header line, then one line
+per row) or a directory with a manifest and one Parquet file per table. Rows
+are read with ``fetchmany`` and written chunk by chunk, so a guild with
+millions of XP rows never has to fit in memory.
+
+An import is read and checked into a temporary staging database first, away
+from the live one. Only then are the guild's rows replaced: in one
+transaction by the command line tool, and by the running bot one chunk per
+transaction on its own storage connection, so its other writes queue between
+chunks instead of behind the whole import.
+
+Usage:
+    python -m utils.guild_data export <guild_id> <path> [--db bot.db]
+    python -m utils.guild_data import <path> [--guild <guild_id>] [--db bot.db]
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+
+FORMAT_VERSION = 2
+CHUNK_SIZE = 5000
+
+# Tables holding per-guild data and the columns that are exported
+GUILD_TABLES = {
+    'guild_settings': ['guild_id', 'prefix', 'welcome_channel_id', 'log_channel_id'],
+    'user_xp': ['user_id', 'guild_id', 'xp', 'level'],
+    'custom_commands': ['guild_id', 'command', 'response', 'uses'],
+    'reminders': ['user_id', 'guild_id', 'reminder_text', 'reminder_time'],
+    'level_curves': ['guild_id', 'kind', 'params'],
+    'raid_settings': ['guild_id', 'join_threshold', 'window_seconds', 'slowmode_seconds',
+                      'raise_verification'],
+    'self_roles': ['guild_id', 'role_id'],
+    'xp_history': ['guild_id', 'user_id', 'period', 'bucket_start', 'xp'],
+    'link_rules': ['guild_id', 'domain', 'action'],
+    'warnings': ['guild_id', 'user_id', 'moderator_id', 'reason', 'created_at'],
+    'warn_rules': ['guild_id', 'warnings', 'window_seconds', 'mute_seconds'],
+}
+
+# Tables whose columns differ in older export versions; missing columns take their defaults on import
+LEGACY_TABLES = {
+    1: {'custom_commands': ['guild_id', 'command', 'response']},
+}
+
+
+def table_columns(version):
+    return {**GUILD_TABLES, **LEGACY_TABLES.get(version, {})}
+
+
+def detect_format(path):
+    return 'parquet' if path.endswith('.parquet') or os.path.isdir(path) else 'jsonl'
+
+
+def make_header(guild_id):
+    return {'format': 'guild-export', 'version': FORMAT_VERSION, 'guild_id': guild_id}
+
+
+def check_header(header):
+    if (not isinstance(header, dict) or header.get('format') != 'guild-export'
+            or header.get('version') not in (*LEGACY_TABLES, FORMAT_VERSION)
+            or not isinstance(header.get('guild_id'), int)):
+        raise ValueError('not a supported guild export')
+    return header
+
+
+def iter_rows(conn, table, guild_id, chunk_size=CHUNK_SIZE):
+    """Yield lists of rows for one guild, ``chunk_size`` rows at a time"""
+    columns = ', '.join(GUILD_TABLES[table])
+    cursor = conn.execute(f'SELECT {columns} FROM {table} WHERE guild_id = ?', (guild_id,))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def export_guild(db_path, guild_id, path, fmt=None, chunk_size=CHUNK_SIZE):
+    """Export a guild's rows to ``path``. Returns {table: row count}"""
+    fmt = fmt or detect_format(path)
+    with sqlite3.connect(db_path) as conn:
+        if fmt == 'parquet':
+            return _export_parquet(conn, guild_id, path, chunk_size)
+        return _export_jsonl(conn, guild_id, path, chunk_size)
+
+
+def _export_jsonl(conn, guild_id, path, chunk_size):
+    counts = {}
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(make_header(guild_id)) + '\n')
+        for table in GUILD_TABLES:
+            counts[table] = 0
+            for rows in iter_rows(conn, table, guild_id, chunk_size):
+                f.writelines(json.dumps({'t': table, 'r': row}) + '\n' for row in rows)
+                counts[table] += len(rows)
+    return counts
+
+
+def _export_parquet(conn, guild_id, path, chunk_size):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(make_header(guild_id), f)
+    counts = {}
+    for table, columns in GUILD_TABLES.items():
+        counts[table] = 0
+        writer = None
+        for rows in iter_rows(conn, table, guild_id, chunk_size):
+            batch = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+            if writer is None:
+                writer = pq.ParquetWriter(os.path.join(path, f'{table}.parquet'), batch.schema)
+            writer.write_table(batch)
+            counts[table] += len(rows)
+        if writer:
+            writer.close()
+    return counts
+
+
+def read_header(path, fmt=None):
+    if (fmt or detect_format(path)) == 'parquet':
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return check_header(json.load(f))
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return check_header(json.loads(f.readline()))
+
+
+def _read_jsonl(path, chunk_size, tables):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        f.readline()  # header
+        chunk, table = [], None
+        for line in f:
+            record = json.loads(line)
+            if record['t'] != table or len(chunk) >= chunk_size:
+                if chunk:
+                    yield table, chunk
+                chunk, table = [], record['t']
+            chunk.append(record['r'])
+        if chunk:
+            yield table, chunk
+
+
+def _read_parquet(path, chunk_size, tables):
+    import pyarrow.parquet as pq
+
+    for table, columns in tables.items():
+        file_path = os.path.join(path, f'{table}.parquet')
+        if not os.path.exists(file_path):
+            continue
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield table, list(zip(*(batch.column(c).to_pylist() for c in columns)))
+
+
+def stage_import(path, staging_path, guild_id=None, fmt=None, chunk_size=CHUNK_SIZE):
+    """Check an export and write its rows to a new staging database at ``staging_path``.
+
+    ``guild_id`` loads the data into a different guild than it was exported
+    from. Every row is moved to the target guild whatever guild id it
+    carries, so a crafted file cannot touch another guild's data. Malformed
+    files raise ValueError. Returns (target guild id, {table: columns},
+    {table: row count}).
+    """
+    fmt = fmt or detect_format(path)
+    reader = _read_parquet if fmt == 'parquet' else _read_jsonl
+    try:
+        header = read_header(path, fmt)
+    except (KeyError, TypeError, EOFError, ValueError, gzip.BadGzipFile) as e:
+        raise ValueError(f'invalid export: {e}') from e
+    tables = table_columns(header['version'])
+    target = header['guild_id'] if guild_id is None else guild_id
+
+    counts = {table: 0 for table in GUILD_TABLES}
+    conn = sqlite3.connect(staging_path)
+    try:
+        for table, columns in tables.items():
+            conn.execute(f'CREATE TABLE {table} ({", ".join(columns)})')
+        for table, rows in reader(path, chunk_size, tables):
+            if table not in tables:
+                raise ValueError(f'unknown table in export: {table}')
+            columns = tables[table]
+            index = columns.index('guild_id')
+            if any(not isinstance(row, (list, tuple)) or len(row) != len(columns) for row in rows):
+                raise ValueError(f'invalid export: {table} rows must have {len(columns)} values')
+            rows = [tuple(row[:index]) + (target,) + tuple(row[index + 1:]) for row in rows]
+            conn.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(columns))})', rows)
+            counts[table] += len(rows)
+        conn.commit()
+    except (KeyError, TypeError, EOFError, json.JSONDecodeError,
+            sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+        raise ValueError(f'invalid export: {e}') from e
+    finally:
+        conn.close()
+    return target, tables, counts
+
+
+def staged_rows(staging_path, tables, chunk_size=CHUNK_SIZE):
+    """Yield (table, rows) from a staging database, ``chunk_size`` rows at a time"""
+    # The bot advances this generator from executor threads, one call at a time
+    conn = sqlite3.connect(staging_path, check_same_thread=False)
+    try:
+        for table, columns in tables.items():
+            cursor = conn.execute(f'SELECT {", ".join(columns)} FROM {table}')
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield table, rows
+    finally:
+        conn.close()
+
+
+def import_guild(db_path, path, guild_id=None, fmt=None, chunk_size=CHUNK_SIZE):
+    """Replace a guild's rows with the contents of an export, with the bot stopped.
+
+    Runs as one transaction, so on error nothing changes; malformed files raise
+    ValueError. The running bot imports through its own storage connection
+    instead (see SQLiteStorage.replace_guild_rows). Returns {table: row count}.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        staging_path = os.path.join(directory, 'staging.db')
+        target, tables, counts = stage_import(path, staging_path, guild_id, fmt, chunk_size)
+        conn = sqlite3.connect(db_path)
+        try:
+            for table in tables:
+                conn.execute(f'DELETE FROM {table} WHERE guild_id = ?', (target,))
+            for table, rows in staged_rows(staging_path, tables, chunk_size):
+                columns = tables[table]
+                conn.executemany(f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) '
+                                 f'VALUES ({", ".join("?" * len(columns))})', rows)
+            conn.commit()
+        finally:
+            conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import one guild\'s bot data')
+    parser.add_argument('--db', default='bot.db', help='SQLite database path')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help='defaults to the path extension')
+    sub = parser.add_subparsers(dest='action', required=True)
+
+    export_parser = sub.add_parser('export')
+    export_parser.add_argument('guild_id', type=int)
+    export_parser.add_argument('path')
+
+    import_parser = sub.add_parser('import')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--guild', type=int, help='load into this guild instead')
+
+    args = parser.parse_args()
+    if args.action == 'export':
+        counts = export_guild(args.db, args.guild_id, args.path, args.format)
+    else:
+        counts = import_guild(args.db, args.path, args.guild, args.format)
+    for table, count in counts.items():
+        print(f'{table}: {count} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Near-duplicate image detection for spam filtering.
+
+Attachments are fingerprinted with a 64-bit difference hash (dHash), which
+survives re-encoding, resizing and small edits. Fingerprints are kept per
+guild in BK-trees, one per time bucket: a lookup searches the live buckets
+for hashes within a Hamming distance, and expiry drops a whole bucket at a
+time because BK-trees do not support deletion. Each guild may hold only
+``max_per_guild`` fingerprints and a flooding guild makes room from its own
+oldest buckets, so a flood in one guild never evicts another's window; the
+total across guilds is capped as well by evicting the oldest buckets.
+"""
+import io
+import time
+from collections import deque
+from importlib.util import find_spec
+
+# Pillow is imported by the first dhash call, not at startup; without it image spam detection is disabled
+AVAILABLE = find_spec('PIL') is not None
+
+MAX_PIXELS = 40_000_000   # larger images are skipped rather than decoded
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def dhash(data, size=8):
+    """Return a ``size * size``-bit difference hash of the image in ``data``"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        # Image.open only reads the header, so decompression bombs are refused before decoding
+        if image.width * image.height > MAX_PIXELS:
+            raise ImageTooLarge(f'{image.width}x{image.height} image exceeds {MAX_PIXELS} pixels')
+        image.draft('L', (size * 8, size * 8))  # JPEGs decode straight to a small greyscale image
+        pixels = image.convert('L').resize((size + 1, size), Image.BILINEAR).tobytes()
+    bits = 0
+    for row in range(0, size * (size + 1), size + 1):
+        for i in range(row, row + size):
+            bits = (bits << 1) | (pixels[i] > pixels[i + 1])
+    return bits
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Metric tree over integer hashes using Hamming distance"""
+    __slots__ = ('root', 'size')
+
+    def __init__(self):
+        self.root = None   # node: [hash, payloads, {distance: child}]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, fingerprint, payload):
+        self.size += 1
+        if self.root is None:
+            self.root = [fingerprint, [payload], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(fingerprint, node[0])
+            if distance == 0:
+                node[1].append(payload)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [fingerprint, [payload], {}]
+                return
+            node = child
+
+    def __iter__(self):
+        """Yield (hash, payload) pairs"""
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            for payload in node[1]:
+                yield node[0], payload
+            stack.extend(node[2].values())
+
+    def search(self, fingerprint, radius):
+        """Yield payloads stored under hashes within ``radius`` of ``fingerprint``"""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(fingerprint, node[0])
+            if distance <= radius:
+                yield from node[1]
+            # Triangle inequality: only children at distance - radius .. distance + radius can match
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+
+
+class _Bucket:
+    __slots__ = ('guild_id', 'start', 'tree')
+
+    def __init__(self, guild_id, start):
+        self.guild_id = guild_id
+        self.start = start
+        self.tree = BKTree()
+
+
+class ImageSpamDetector:
+    """Recent image fingerprints per guild, searchable for near-duplicates"""
+
+    def __init__(self, window=600, bucket_seconds=60, radius=6, max_fingerprints=50000, max_per_guild=2000):
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.radius = radius
+        self.max_fingerprints = max_fingerprints
+        self.max_per_guild = max_per_guild   # a flooding guild makes room from its own buckets
+        self.guilds = {}        # guild_id -> deque of buckets, oldest first
+        self.counts = {}        # guild_id -> fingerprints held
+        self.buckets = deque()  # every bucket, oldest first; ones dropped early stay until they reach the front
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _drop(self, bucket):
+        # Only ever called for the oldest live bucket of its guild
+        guild_buckets = self.guilds[bucket.guild_id]
+        guild_buckets.popleft()
+        if guild_buckets:
+            self.counts[bucket.guild_id] -= len(bucket.tree)
+        else:
+            del self.guilds[bucket.guild_id]
+            del self.counts[bucket.guild_id]
+        self.size -= len(bucket.tree)
+        bucket.tree = None
+
+    def _evict(self, now):
+        cutoff = now - self.window
+        buckets = self.buckets
+        while buckets and (buckets[0].tree is None or buckets[0].start + self.bucket_seconds <= cutoff
+                           or self.size > self.max_fingerprints):
+            bucket = buckets.popleft()
+            # Buckets are created in time order, so the oldest live one overall leads its guild's deque
+            if bucket.tree is not None:
+                self._drop(bucket)
+
+    def dump_state(self):
+        """Live buckets as (guild_id, start, [(hash, (seen, payload))]), oldest first"""
+        return [(bucket.guild_id, bucket.start, list(bucket.tree)) for bucket in self.buckets
+                if bucket.tree is not None]
+
+    def load_state(self, buckets):
+        for guild_id, start, entries in buckets:
+            bucket = _Bucket(guild_id, start)
+            for fingerprint, entry in entries:
+                bucket.tree.add(fingerprint, entry)
+            self.guilds.setdefault(guild_id, deque()).append(bucket)
+            self.counts[guild_id] = self.counts.get(guild_id, 0) + len(bucket.tree)
+            self.buckets.append(bucket)
+            self.size += len(bucket.tree)
+        self._evict(time.time())
+
+    def check(self, guild_id, fingerprint, payload, now=None):
+        """Record a fingerprint and return the payloads of earlier near-duplicates in the window"""
+        now = time.time() if now is None else now
+        self._evict(now)
+        cutoff = now - self.window
+        matches = []
+        for bucket in self.guilds.get(guild_id, ()):
+            if bucket.start + self.bucket_seconds > cutoff:
+                for seen, earlier in bucket.tree.search(fingerprint, self.radius):
+                    if seen > cutoff:
+                        matches.append(earlier)
+
+        start = now - now % self.bucket_seconds
+        guild_buckets = self.guilds.get(guild_id)
+        if guild_buckets is None:
+            guild_buckets = self.guilds[guild_id] = deque()
+            self.counts[guild_id] = 0
+        if not guild_buckets or guild_buckets[-1].start != start:
+            bucket = _Bucket(guild_id, start)
+            guild_buckets.append(bucket)
+            self.buckets.append(bucket)
+        while self.counts[guild_id] >= self.max_per_guild and len(guild_buckets) > 1:
+            self._drop(guild_buckets[0])
+        if self.counts[guild_id] >= self.max_per_guild:
+            # The current bucket alone is full; it already holds plenty of evidence of the flood
+            return matches
+        guild_buckets[-1].tree.add(fingerprint, (now, payload))
+        self.counts[guild_id] += 1
+        self.size += 1
+        if self.size > self.max_fingerprints:
+            self._evict(now)
+        return matches
@@ -0,0 +1,181 @@
+"""Level curves shared by the Fun cog and the local simulator.
+
+Each curve precomputes the cumulative XP threshold for the first levels and
+looks levels up with a binary search over that table. The table grows on
+demand up to MAX_CACHED_LEVELS entries; past it every curve computes the
+level in closed form, so huge XP totals cost nothing extra. Levels are capped
+at MAX_LEVEL and curve parameters at MAX_PARAM so thresholds stay in int64.
+"""
+import json
+from bisect import bisect_right
+from math import isqrt
+
+MAX_TABLE_LEVELS = 1000
+MAX_CACHED_LEVELS = 4096
+MAX_LEVEL = 1_000_000        # stored levels are 32-bit
+MAX_PARAM = 1_000_000_000    # largest step, coefficient or table threshold
+
+
+class LevelCurve:
+    """Base class for XP -> level curves"""
+    kind = None
+
+    def __init__(self):
+        self.thresholds = [0]
+        self._grow(64)
+
+    def xp_for_level(self, level):
+        """Total XP needed to reach ``level``"""
+        raise NotImplementedError
+
+    def params(self):
+        raise NotImplementedError
+
+    def level_beyond(self, xp):
+        """Level for ``xp`` without the table, used past its last threshold"""
+        raise NotImplementedError
+
+    def _grow(self, count):
+        start = len(self.thresholds)
+        self.thresholds.extend(self.xp_for_level(level) for level in range(start, start + count))
+
+    def _ensure(self, xp):
+        while self.thresholds[-1] <= xp and len(self.thresholds) < MAX_CACHED_LEVELS:
+            self._grow(min(len(self.thresholds), MAX_CACHED_LEVELS - len(self.thresholds)))
+
+    def level_for(self, xp):
+        """Level reached with ``xp`` total XP"""
+        if xp < 0:
+            return 0
+        self._ensure(xp)
+        if xp >= self.thresholds[-1]:
+            return min(self.level_beyond(xp), MAX_LEVEL)
+        return bisect_right(self.thresholds, xp) - 1
+
+    def progress(self, xp):
+        """Return (level, xp into the level, xp the level spans)"""
+        level = self.level_for(xp)
+        start, end = self.xp_for_level(level), self.xp_for_level(level + 1)
+        return level, min(xp - start, end - start), end - start
+
+    def levels_for(self, xps):
+        """Levels for a sequence of XP totals in one vectorized pass"""
+        if not len(xps):
+            return []
+        self._ensure(max(xps))
+        try:
+            import numpy as np   # imported on first bulk recompute rather than at startup
+        except ImportError:
+            return [self.level_for(xp) for xp in xps]
+        values = np.asarray(xps, dtype=np.int64)
+        levels = np.searchsorted(np.asarray(self.thresholds, dtype=np.int64), values, side='right') - 1
+        levels = np.maximum(levels, 0).tolist()
+        for i in np.flatnonzero(values >= self.thresholds[-1]).tolist():
+            levels[i] = self.level_for(xps[i])
+        return levels
+
+    def to_config(self):
+        return self.kind, json.dumps(self.params())
+
+    def describe(self):
+        return f"{self.kind} ({', '.join(str(p) for p in self.params())})"
+
+
+class LinearCurve(LevelCurve):
+    """Every level costs the same amount of XP"""
+    kind = 'linear'
+
+    def __init__(self, step=100):
+        if not 0 < step <= MAX_PARAM:
+            raise ValueError(f'step must be between 1 and {MAX_PARAM}')
+        self.step = step
+        super().__init__()
+
+    def xp_for_level(self, level):
+        return self.step * level
+
+    def level_beyond(self, xp):
+        return xp // self.step
+
+    def params(self):
+        return [self.step]
+
+
+class QuadraticCurve(LevelCurve):
+    """Total XP grows as a * level^2 + b * level"""
+    kind = 'quadratic'
+
+    def __init__(self, a=50, b=50):
+        if a < 0 or b < 0 or a + b <= 0:
+            raise ValueError('coefficients must be non-negative and not both zero')
+        if a > MAX_PARAM or b > MAX_PARAM:
+            raise ValueError(f'coefficients must be at most {MAX_PARAM}')
+        self.a = a
+        self.b = b
+        super().__init__()
+
+    def xp_for_level(self, level):
+        return self.a * level * level + self.b * level
+
+    def level_beyond(self, xp):
+        if not self.a:
+            return xp // self.b
+        # Positive root of a * L^2 + b * L = xp, corrected for integer rounding
+        level = (isqrt(self.b * self.b + 4 * self.a * xp) - self.b) // (2 * self.a)
+        while self.xp_for_level(level + 1) <= xp:
+            level += 1
+        while self.xp_for_level(level) > xp:
+            level -= 1
+        return level
+
+    def params(self):
+        return [self.a, self.b]
+
+
+class TableCurve(LevelCurve):
+    """Explicit thresholds; levels past the table repeat the last increment"""
+    kind = 'table'
+
+    def __init__(self, *table):
+        table = [int(t) for t in table]
+        if not table or len(table) > MAX_TABLE_LEVELS:
+            raise ValueError(f'table needs 1 to {MAX_TABLE_LEVELS} thresholds')
+        if table[0] != 0:
+            table.insert(0, 0)
+        if any(b <= a for a, b in zip(table, table[1:])):
+            raise ValueError('thresholds must be strictly increasing')
+        if table[-1] > MAX_PARAM:
+            raise ValueError(f'thresholds must be at most {MAX_PARAM}')
+        self.table = table
+        super().__init__()
+
+    def xp_for_level(self, level):
+        table = self.table
+        if level < len(table):
+            return table[level]
+        step = table[-1] - table[-2] if len(table) > 1 else 100
+        return table[-1] + step * (level - len(table) + 1)
+
+    def level_beyond(self, xp):
+        table = self.table
+        if xp < table[-1]:
+            return bisect_right(table, xp) - 1
+        step = table[-1] - table[-2] if len(table) > 1 else 100
+        return len(table) - 1 + (xp - table[-1]) // step
+
+    def params(self):
+        return self.table[1:]
+
+
+CURVES = {cls.kind: cls for cls in (LinearCurve, QuadraticCurve, TableCurve)}
+DEFAULT_CURVE = LinearCurve()
+
+
+def curve_from_config(kind, params):
+    """Build a curve from its stored (kind, JSON params) form"""
+    if isinstance(params, str):
+        params = json.loads(params)
+    try:
+        return CURVES[kind](*params)
+    except KeyError:
+        raise ValueError(f'unknown curve type: {kind}')
@@ -0,0 +1,198 @@
+"""Link and invite filtering.
+
+URLs are pulled out of a message with one regex pass and their hosts are
+matched against tries keyed on reversed domain labels, so a blocked
+``example.com`` also covers ``cdn.example.com`` and each lookup costs one
+step per label no matter how many domains are listed. Discord invites are
+reported under the pseudo-host ``discord.gg``. Verdicts for recently seen
+hosts are kept in an LRU cache.
+"""
+import mmap
+import re
+import sys
+from collections import OrderedDict
+
+INVITE_HOST = 'discord.gg'
+
+URL_PATTERN = re.compile(
+    r'(?:https?://)?'
+    r'((?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z][a-z0-9-]{0,62}[a-z0-9])'
+    r'(?::\d+)?(/[^\s<>]*)?',
+    re.IGNORECASE)
+INVITE_PATH = re.compile(r'/invite/[\w-]+', re.IGNORECASE)
+INVITE_DOMAINS = {'discord.com', 'discordapp.com', 'www.discord.com', 'ptb.discord.com',
+                  'canary.discord.com'}
+
+_LEAF = True   # child marker for a listed domain with no listed subdomains
+
+
+def extract_hosts(text):
+    """Return the distinct lowercase hosts linked in ``text``, in order of appearance"""
+    hosts = {}
+    for match in URL_PATTERN.finditer(text):
+        host = match.group(1).lower()
+        if host == INVITE_HOST or (host in INVITE_DOMAINS and match.group(2)
+                                   and INVITE_PATH.match(match.group(2))):
+            host = INVITE_HOST
+        elif host.startswith('www.'):
+            host = host[4:]
+        hosts[host] = None
+    return list(hosts)
+
+
+def normalize_domain(domain):
+    """Lowercase a domain and strip any scheme, www. prefix, port or path"""
+    domain = domain.strip().lower()
+    domain = domain.split('://', 1)[-1].split('/', 1)[0].split(':', 1)[0].strip('.')
+    return domain[4:] if domain.startswith('www.') else domain
+
+
+class DomainTrie:
+    """Set of domains matched by suffix, stored as nested dicts of reversed labels.
+
+    Listed domains without listed subdomains are stored as a shared marker
+    instead of an empty dict, which keeps large blocklists compact.
+    """
+
+    def __init__(self, domains=()):
+        self.root = {}
+        self.size = 0
+        for domain in domains:
+            self.add(domain)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, domain):
+        labels = domain.split('.')
+        node = self.root
+        for label in reversed(labels[1:]):
+            child = node.get(label)
+            if child is _LEAF:
+                return  # a parent domain is already listed
+            if child is None:
+                child = node[sys.intern(label)] = {}
+            node = child
+        last = labels[0]
+        if node.get(last) is not _LEAF:
+            # Listing a domain supersedes its listed subdomains
+            self.size += 1 - self._count(node.get(last))
+            node[last] = _LEAF
+
+    def _count(self, node):
+        if node is None:
+            return 0
+        if node is _LEAF:
+            return 1
+        return sum(self._count(child) for child in node.values())
+
+    def match(self, host):
+        """Return the listed domain covering ``host``, or None"""
+        node = self.root
+        labels = host.split('.')
+        for depth in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                return None
+            if node is _LEAF:
+                return '.'.join(labels[depth:])
+        return None
+
+
+def load_blocklist(path):
+    """Build a DomainTrie from a file with one domain per line.
+
+    Hosts-file lines (``0.0.0.0 example.com``) and ``#`` comments are accepted.
+    The file is memory-mapped and scanned line by line rather than read into
+    memory whole. A missing or empty file gives an empty trie.
+    """
+    trie = DomainTrie()
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line in iter(data.readline, b''):
+                line = line.split(b'#', 1)[0].strip()
+                if not line:
+                    continue
+                domain = normalize_domain(line.rsplit(None, 1)[-1].decode('ascii', 'ignore'))
+                if '.' in domain:
+                    trie.add(domain)
+    except (FileNotFoundError, ValueError):  # mmap raises ValueError for empty files
+        pass
+    return trie
+
+
+class GuildLinkRules:
+    """A guild's allow and deny lists"""
+
+    def __init__(self, rules=()):
+        self.rules = dict(rules)   # domain -> 'allow' | 'deny'
+        self.allow = DomainTrie(d for d, action in self.rules.items() if action == 'allow')
+        self.deny = DomainTrie(d for d, action in self.rules.items() if action == 'deny')
+
+
+class LinkFilter:
+    """Decides whether the links in a message are allowed in a guild.
+
+    Precedence is the guild allow list, then the guild deny list, then invite
+    blocking, then the global blocklist.
+    """
+
+    def __init__(self, blocklist=None, cache_size=50000):
+        self.blocklist = blocklist if blocklist is not None else DomainTrie()
+        self.guilds = {}           # guild_id -> GuildLinkRules
+        self.generations = {}      # guild_id -> counter bumped when its rules change
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def set_blocklist(self, blocklist):
+        self.blocklist = blocklist
+        self.cache.clear()
+
+    def set_rules(self, guild_id, rules):
+        self.guilds[guild_id] = GuildLinkRules(rules)
+        # Entries cached under the old generation are never read again and age out
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+
+    def verdict(self, guild_id, host):
+        """Return a reason string if ``host`` is blocked in the guild, otherwise None"""
+        key = (guild_id, self.generations.get(guild_id, 0), host)
+        try:
+            result = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            self.cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return result
+
+        self.stats['misses'] += 1
+        result = self._decide(self.guilds.get(guild_id), host)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def _decide(self, rules, host):
+        if rules and rules.allow.match(host):
+            return None
+        if rules:
+            denied = rules.deny.match(host)
+            if denied:
+                return f'{denied} is blocked on this server'
+        if host == INVITE_HOST:
+            return 'Invite links are not allowed'
+        blocked = self.blocklist.match(host)
+        if blocked:
+            return f'{blocked} is a blocked domain'
+        return None
+
+    def check(self, guild_id, text):
+        """Return (host, reason) for the first blocked link in ``text``, or None"""
+        if '.' not in text:
+            return None
+        for host in extract_hosts(text):
+            reason = self.verdict(guild_id, host)
+            if reason:
+                return host, reason
+        return None
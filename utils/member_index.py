@@ -0,0 +1,175 @@
+"""Member and role lookup for command arguments.
+
+discord.py's converters resolve a name by scanning every cached member (or
+asking the gateway when the cache is incomplete). These converters resolve
+IDs and mentions from the cache and names from a per-guild NameIndex over
+username, display name and nickname. Each index is built on first use, a
+chunk at a time so a large guild does not stall the event loop, and then
+kept current from member and role events.
+
+Only an exact, unambiguous name is accepted; prefix and fuzzy matches are
+offered as suggestions instead, so a moderation command never acts on a
+guess.
+"""
+import asyncio
+import re
+
+from discord.ext import commands
+
+from utils.name_index import NameIndex, normalize
+
+ID_PATTERN = re.compile(r'<@[!&]?([0-9]{15,20})>$|([0-9]{15,20})$')
+
+
+def member_names(member):
+    return member.name, member.global_name, member.nick
+
+
+class GuildLookup:
+    """Name indexes over each guild's members and roles, built on first use"""
+
+    def __init__(self, max_posting=2000, chunk_size=1000):
+        self.max_posting = max_posting
+        self.chunk_size = chunk_size   # members indexed between yields to the event loop
+        self.members = {}   # guild_id -> NameIndex of member ids
+        self.roles = {}     # guild_id -> NameIndex of role ids
+        self.building = {}  # guild_id -> task filling a member index
+
+    async def member_index(self, guild):
+        index = self.members.get(guild.id)
+        if index is None:
+            # Registered before it is filled so member events during the build are applied to it
+            index = self.members[guild.id] = NameIndex(self.max_posting)
+            self.building[guild.id] = asyncio.ensure_future(self._build(guild, index))
+        building = self.building.get(guild.id)
+        if building is not None:
+            await asyncio.shield(building)
+        return index
+
+    async def _build(self, guild, index):
+        try:
+            members = list(guild.members)
+            for start in range(0, len(members), self.chunk_size):
+                # Cached members are updated in place, so names read here are current;
+                # members who left since the list was taken are skipped
+                chunk = members[start:start + self.chunk_size]
+                index.add_many((member.id, member_names(member)) for member in chunk
+                               if guild.get_member(member.id) is not None)
+                await asyncio.sleep(0)
+        except BaseException:
+            # A partial index would hide members; start over on the next lookup
+            if self.members.get(guild.id) is index:
+                del self.members[guild.id]
+            raise
+        finally:
+            self.building.pop(guild.id, None)
+
+    def role_index(self, guild):
+        index = self.roles.get(guild.id)
+        if index is None:
+            index = self.roles[guild.id] = NameIndex()
+            index.add_many((role.id, (role.name,)) for role in guild.roles if not role.is_default())
+        return index
+
+    def update_member(self, member):
+        index = self.members.get(member.guild.id)
+        if index is not None:
+            index.add(member.id, *member_names(member))
+
+    def remove_member(self, guild_id, user_id):
+        index = self.members.get(guild_id)
+        if index is not None:
+            index.remove(user_id)
+
+    def update_user(self, bot, user):
+        """Reindex a user whose username or display name changed, in every indexed guild"""
+        for guild_id, index in self.members.items():
+            guild = bot.get_guild(guild_id)
+            if guild and user.id in index:
+                member = guild.get_member(user.id)
+                if member:
+                    index.add(member.id, *member_names(member))
+
+    def update_role(self, role):
+        index = self.roles.get(role.guild.id)
+        if index is not None:
+            index.add(role.id, role.name)
+
+    def remove_role(self, role):
+        index = self.roles.get(role.guild.id)
+        if index is not None:
+            index.remove(role.id)
+
+    def forget_guild(self, guild_id):
+        self.members.pop(guild_id, None)
+        self.building.pop(guild_id, None)
+        self.roles.pop(guild_id, None)
+
+
+def resolve(index, argument, get):
+    """Return (item, suggestions) for a name, using ``get`` to turn ids into objects.
+
+    ``item`` is None unless exactly one name matches exactly; suggestions are
+    the clashing exact matches, or else the closest prefix or fuzzy matches.
+    """
+    exact = [item for item in map(get, index.exact(argument)) if item is not None]
+    if len(exact) == 1:
+        return exact[0], []
+    if exact:
+        return None, exact[:5]
+    return None, [item for item in map(get, index.prefix(argument, 3) or index.fuzzy(argument, 3))
+                  if item is not None]
+
+
+def not_found(kind, argument, suggestions):
+    message = f'{kind} "{argument}" not found.'
+    if suggestions:
+        message += ' Did you mean ' + ', '.join(f'"{item}"' for item in suggestions) + '?'
+    return message
+
+
+class IndexedMember(commands.MemberConverter):
+    """Member converter backed by the guild's name index"""
+
+    async def convert(self, ctx, argument):
+        if ctx.guild is None:
+            return await super().convert(ctx, argument)
+        match = ID_PATTERN.match(argument)
+        if match:
+            member = ctx.guild.get_member(int(match.group(1) or match.group(2)))
+            # Not cached: let discord.py fetch it
+            return member or await super().convert(ctx, argument)
+
+        member, suggestions = resolve(await ctx.bot.lookup.member_index(ctx.guild), argument, ctx.guild.get_member)
+        if member:
+            return member
+        if not ctx.guild.chunked or '#' in argument or not normalize(argument):
+            # Members missing from the cache, or names the index cannot hold (name#discriminator, only symbols)
+            try:
+                return await super().convert(ctx, argument)
+            except commands.MemberNotFound:
+                pass
+        error = commands.MemberNotFound(argument)
+        error.args = (not_found('Member', argument, suggestions),)
+        raise error
+
+
+class IndexedRole(commands.RoleConverter):
+    """Role converter backed by the guild's name index"""
+
+    async def convert(self, ctx, argument):
+        if ctx.guild is None:
+            return await super().convert(ctx, argument)
+        match = ID_PATTERN.match(argument)
+        if match:
+            role = ctx.guild.get_role(int(match.group(1) or match.group(2)))
+            if role:
+                return role
+            raise commands.RoleNotFound(argument)
+
+        role, suggestions = resolve(ctx.bot.lookup.role_index(ctx.guild), argument, ctx.guild.get_role)
+        if role:
+            return role
+        error = commands.RoleNotFound(argument)
+        error.args = (not_found('Role', argument, suggestions),)
+        raise error
@@ -0,0 +1,143 @@
+"""Normalized name index with exact, prefix and fuzzy lookup.
+
+Names are case-folded, stripped of accents and punctuation and mapped to the
+ids (roles, members, ...) that carry them. Prefix lookup is a binary search
+over the sorted names; fuzzy lookup gathers candidates that share character
+trigrams with the query and ranks them with difflib.
+"""
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+
+_ASCII_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(name):
+    """Case-fold, strip accents and keep only letters, digits and single spaces"""
+    if name.isascii():
+        # Same result as below for the common case, without the per-character Python loop
+        return _ASCII_SEPARATORS.sub(' ', name.lower()).strip()
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    kept = ''.join(c if c.isalnum() else ' ' for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(kept.split())
+
+
+def trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Maps normalized names to ids"""
+
+    def __init__(self, max_posting=5000):
+        self.max_posting = max_posting   # trigrams shared by more names than this are too common to rank by
+        self._ids = defaultdict(set)     # normalized name -> ids
+        self._names = {}                 # id -> normalized names
+        self._sorted = []                # normalized names, sorted
+        self._grams = defaultdict(set)   # trigram -> normalized names
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, item_id):
+        return item_id in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def add(self, item_id, *names):
+        """Index ``item_id`` under ``names``, replacing any names it had"""
+        self.remove(item_id)
+        keys = {normalize(name) for name in names if name} - {''}
+        self._names[item_id] = keys
+        for key in keys:
+            ids = self._ids[key]
+            if not ids:
+                insort(self._sorted, key)
+                for gram in trigrams(key):
+                    self._grams[gram].add(key)
+            ids.add(item_id)
+
+    def add_many(self, items):
+        """Index (item_id, names) pairs, sorting once at the end; used to build large indexes"""
+        new_keys = []
+        for item_id, names in dict(items).items():
+            self.remove(item_id)
+            keys = {normalize(name) for name in names if name} - {''}
+            self._names[item_id] = keys
+            for key in keys:
+                ids = self._ids[key]
+                if not ids:
+                    new_keys.append(key)
+                    for gram in trigrams(key):
+                        self._grams[gram].add(key)
+                ids.add(item_id)
+        self._sorted = sorted(self._sorted + new_keys)
+
+    def remove(self, item_id):
+        for key in self._names.pop(item_id, ()):
+            ids = self._ids[key]
+            ids.discard(item_id)
+            if not ids:
+                del self._ids[key]
+                del self._sorted[bisect_left(self._sorted, key)]
+                for gram in trigrams(key):
+                    names = self._grams[gram]
+                    names.discard(key)
+                    if not names:
+                        del self._grams[gram]
+
+    def exact(self, query):
+        return set(self._ids.get(normalize(query), ()))
+
+    def prefix(self, query, limit=10):
+        """Ids whose name starts with ``query``, shortest names first"""
+        key = normalize(query)
+        if not key:
+            return []
+        names = []
+        for i in range(bisect_left(self._sorted, key), len(self._sorted)):
+            name = self._sorted[i]
+            if not name.startswith(key) or len(names) >= limit * 4:
+                break
+            names.append(name)
+        return self._collect(sorted(names, key=len), limit)
+
+    def fuzzy(self, query, limit=5, cutoff=0.6):
+        """Ids whose name is similar to ``query``, best match first"""
+        key = normalize(query)
+        if not key:
+            return []
+        shared = Counter()
+        for gram in trigrams(key):
+            names = self._grams.get(gram)
+            if names and len(names) <= self.max_posting:
+                shared.update(names)
+        scored = []
+        for name, _ in shared.most_common(limit * 10):
+            score = SequenceMatcher(None, key, name).ratio()
+            if score >= cutoff:
+                scored.append((score, name))
+        scored.sort(key=lambda item: -item[0])
+        return self._collect([name for _, name in scored], limit)
+
+    def lookup(self, query, limit=5):
+        """Exact matches if any, otherwise prefix matches, otherwise fuzzy matches"""
+        exact = self.exact(query)
+        if exact:
+            return list(exact)[:limit]
+        return self.prefix(query, limit) or self.fuzzy(query, limit)
+
+    def _collect(self, names, limit):
+        result = []
+        for name in names:
+            for item_id in self._ids[name]:
+                if item_id not in result:
+                    result.append(item_id)
+            if len(result) >= limit:
+                break
+        return result[:limit]
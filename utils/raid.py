@@ -0,0 +1,133 @@
+"""Sliding-window join-rate tracking used by on_member_join to detect raids."""
+import time
+from collections import deque
+
+
+class RaidSettings:
+    """Per-guild raid detection settings"""
+    __slots__ = ('threshold', 'window', 'slowmode', 'raise_verification')
+
+    def __init__(self, threshold=10, window=10, slowmode=0, raise_verification=False):
+        self.threshold = threshold            # joins inside the window that trigger raid mode
+        self.window = window                  # sliding window length in seconds
+        self.slowmode = slowmode              # slowmode applied to the welcome channel (0 = off)
+        self.raise_verification = raise_verification
+
+
+class GuildJoins:
+    """Join counters and raid state for a single guild"""
+    __slots__ = ('buckets', 'total', 'raid_since', 'raid_joins', 'pending', 'restore')
+
+    def __init__(self):
+        self.buckets = deque()   # [second, count] pairs, oldest first
+        self.total = 0           # joins currently inside the window
+        self.raid_since = None
+        self.raid_joins = 0
+        self.pending = []        # mentions waiting for the next summary message
+        self.restore = {}        # settings to put back when raid mode ends
+
+
+class JoinRateTracker:
+    """Counts joins per guild in one-second buckets over a sliding window.
+
+    Memory per guild is bounded by the window length rather than the number
+    of joins, so a raid of thousands of joins per minute costs the same as a
+    quiet day.
+    """
+
+    def __init__(self, calm_after=60):
+        self.calm_after = calm_after
+        self.guilds = {}
+
+    def _state(self, guild_id):
+        state = self.guilds.get(guild_id)
+        if state is None:
+            state = self.guilds[guild_id] = GuildJoins()
+        return state
+
+    def _expire(self, state, window, now):
+        cutoff = int(now) - window
+        buckets = state.buckets
+        while buckets and buckets[0][0] <= cutoff:
+            state.total -= buckets.popleft()[1]
+
+    def record(self, guild_id, settings, now=None):
+        """Record a join. Returns True if this join switched the guild into raid mode."""
+        now = time.time() if now is None else now
+        state = self._state(guild_id)
+        self._expire(state, settings.window, now)
+
+        second = int(now)
+        if state.buckets and state.buckets[-1][0] == second:
+            state.buckets[-1][1] += 1
+        else:
+            state.buckets.append([second, 1])
+        state.total += 1
+
+        if state.raid_since is not None:
+            state.raid_joins += 1
+            return False
+        if state.total >= settings.threshold:
+            state.raid_since = now
+            state.raid_joins = state.total
+            return True
+        return False
+
+    def rate(self, guild_id, settings, now=None):
+        """Current join rate in joins per minute"""
+        state = self.guilds.get(guild_id)
+        if state is None:
+            return 0.0
+        self._expire(state, settings.window, time.time() if now is None else now)
+        return state.total * 60 / settings.window
+
+    def in_raid(self, guild_id):
+        state = self.guilds.get(guild_id)
+        return state is not None and state.raid_since is not None
+
+    def queue_welcome(self, guild_id, mention):
+        self._state(guild_id).pending.append(mention)
+
+    def take_pending(self, guild_id):
+        """Return and clear the mentions queued for the next summary"""
+        state = self._state(guild_id)
+        pending, state.pending = state.pending, []
+        return pending
+
+    def should_end(self, guild_id, settings, now=None):
+        """Raid mode ends once joins fall under the threshold and the raid is old enough"""
+        state = self.guilds.get(guild_id)
+        if state is None or state.raid_since is None:
+            return False
+        now = time.time() if now is None else now
+        self._expire(state, settings.window, now)
+        return state.total < settings.threshold and now - state.raid_since >= self.calm_after
+
+    def dump_state(self):
+        """Join counters and raid state per guild as plain tuples"""
+        return {guild_id: ([list(b) for b in state.buckets], state.total, state.raid_since,
+                           state.raid_joins, list(state.pending), dict(state.restore))
+                for guild_id, state in self.guilds.items()}
+
+    def load_state(self, guilds):
+        for guild_id, (buckets, total, raid_since, raid_joins, pending, restore) in guilds.items():
+            state = self._state(guild_id)
+            state.buckets = deque(buckets)
+            state.total = total
+            state.raid_since = raid_since
+            state.raid_joins = raid_joins
+            state.pending = pending
+            state.restore = restore
+
+    def raiding_guilds(self):
+        return [guild_id for guild_id, state in self.guilds.items() if state.raid_since is not None]
+
+    def end_raid(self, guild_id):
+        """Leave raid mode. Returns (duration in seconds, joins during the raid, restore dict)"""
+        state = self._state(guild_id)
+        duration = time.time() - state.raid_since if state.raid_since else 0
+        result = (duration, state.raid_joins, state.restore)
+        state.raid_since = None
+        state.raid_joins = 0
+        state.restore = {}
+        return result
@@ -0,0 +1,93 @@
+"""Incremental ranking for leaderboards.
+
+``RankIndex`` keeps entries in a bucketed sorted list (sorted sublists of
+bounded size), so updating a score, reading the top k and looking up a rank
+never re-sort the whole population.
+"""
+from bisect import bisect_left, insort
+
+
+class RankIndex:
+    """Scores per key with O(log n) updates, top-k and rank queries"""
+    LOAD = 512
+
+    def __init__(self):
+        self.scores = {}
+        self._buckets = []   # sorted lists of (-score, key)
+        self._maxes = []     # last item of each bucket
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __contains__(self, key):
+        return key in self.scores
+
+    def _insert(self, item):
+        if not self._buckets:
+            self._buckets.append([item])
+            self._maxes.append(item)
+            return
+        i = bisect_left(self._maxes, item)
+        if i == len(self._maxes):
+            i -= 1
+            self._buckets[i].append(item)
+        else:
+            insort(self._buckets[i], item)
+        bucket = self._buckets[i]
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.LOAD:
+            half = bucket[self.LOAD:]
+            del bucket[self.LOAD:]
+            self._buckets.insert(i + 1, half)
+            self._maxes[i] = bucket[-1]
+            self._maxes.insert(i + 1, half[-1])
+
+    def _delete(self, item):
+        i = bisect_left(self._maxes, item)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, item)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def update(self, key, score):
+        """Set the score for ``key``"""
+        old = self.scores.get(key)
+        if old == score:
+            return
+        if old is not None:
+            self._delete((-old, key))
+        self.scores[key] = score
+        self._insert((-score, key))
+
+    def increment(self, key, amount=1):
+        """Add to the score for ``key`` and return the new score"""
+        score = self.scores.get(key, 0) + amount
+        self.update(key, score)
+        return score
+
+    def remove(self, key):
+        score = self.scores.pop(key, None)
+        if score is not None:
+            self._delete((-score, key))
+
+    def top(self, k):
+        """Return up to ``k`` (key, score) pairs, highest score first"""
+        result = []
+        for bucket in self._buckets:
+            for neg_score, key in bucket:
+                if len(result) >= k:
+                    return result
+                result.append((key, -neg_score))
+        return result
+
+    def rank(self, key):
+        """1-based position of ``key``, or None if it has no score"""
+        score = self.scores.get(key)
+        if score is None:
+            return None
+        item = (-score, key)
+        i = bisect_left(self._maxes, item)
+        return sum(len(b) for b in self._buckets[:i]) + bisect_left(self._buckets[i], item) + 1
@@ -0,0 +1,272 @@
+"""Rank card and chart rendering off the event loop.
+
+Images are drawn with Pillow in a process pool. Results are cached in memory
+under a SHA-256 of the render kind, its input data and the avatar bytes, so
+repeated ``level`` or ``leaderboard`` calls with unchanged data skip rendering
+entirely. Avatars are downloaded once and kept in an LRU cache on disk.
+
+Workers are started with forkserver (spawn where that is unavailable) rather
+than forked from the bot, whose process already runs threads.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+
+# Pillow is only imported inside the render workers; without it commands fall back to text embeds
+AVAILABLE = find_spec('PIL') is not None
+
+BACKGROUND = (35, 39, 42)
+PANEL = (47, 49, 54)
+ACCENT = (88, 101, 242)
+TEXT = (255, 255, 255)
+MUTED = (185, 187, 190)
+AVATAR_TIMEOUT = 10   # seconds for an avatar download
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap font
+        return ImageFont.load_default()
+
+
+def _png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def draw_rank_card(data, avatar):
+    """Draw a rank card. ``data`` has name, level, xp, into_level, level_span and optional rank"""
+    from PIL import Image, ImageDraw
+
+    card = Image.new('RGB', (640, 180), BACKGROUND)
+    draw = ImageDraw.Draw(card)
+    draw.rounded_rectangle((10, 10, 630, 170), radius=16, fill=PANEL)
+
+    if avatar:
+        picture = Image.open(io.BytesIO(avatar)).convert('RGB').resize((128, 128))
+        mask = Image.new('L', (128, 128), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, 127, 127), fill=255)
+        card.paste(picture, (26, 26), mask)
+    else:
+        draw.ellipse((26, 26, 154, 154), fill=ACCENT)
+
+    draw.text((176, 30), data['name'][:28], font=_font(30), fill=TEXT)
+    rank = f"Rank #{data['rank']}  " if data.get('rank') else ''
+    draw.text((176, 72), f"{rank}Level {data['level']}  ·  {data['xp']} XP", font=_font(20), fill=MUTED)
+
+    span = max(data['level_span'], 1)
+    filled = 176 + int(430 * min(data['into_level'] / span, 1))
+    draw.rounded_rectangle((176, 115, 606, 145), radius=15, fill=BACKGROUND)
+    if filled > 186:
+        draw.rounded_rectangle((176, 115, filled, 145), radius=15, fill=ACCENT)
+    draw.text((186, 120), f"{data['into_level']}/{data['level_span']} XP", font=_font(18), fill=TEXT)
+    return _png(card)
+
+
+def draw_bar_chart(data, avatar=None):
+    """Draw a horizontal bar chart. ``data`` has title and rows of [label, value]"""
+    from PIL import Image, ImageDraw
+
+    rows = data['rows'][:15]
+    height = 70 + 36 * max(len(rows), 1)
+    chart = Image.new('RGB', (640, height), BACKGROUND)
+    draw = ImageDraw.Draw(chart)
+    draw.text((20, 18), data['title'][:48], font=_font(26), fill=TEXT)
+
+    peak = max((value for _, value in rows), default=0) or 1
+    label_font, value_font = _font(18), _font(16)
+    for i, (label, value) in enumerate(rows):
+        top = 64 + 36 * i
+        draw.text((20, top + 4), str(label)[:18], font=label_font, fill=MUTED)
+        right = 210 + int(330 * value / peak)
+        draw.rounded_rectangle((210, top, max(right, 218), top + 26), radius=8, fill=ACCENT)
+        draw.text((max(right, 218) + 8, top + 5), str(value), font=value_font, fill=TEXT)
+    return _png(chart)
+
+
+RENDERERS = {
+    'rank_card': draw_rank_card,
+    'bar_chart': draw_bar_chart,
+}
+
+
+def render(kind, data, avatar=None):
+    """Render synchronously in the current process"""
+    return RENDERERS[kind](data, avatar)
+
+
+class AvatarCache:
+    """Downloaded avatars on disk, evicted least recently used first.
+
+    File sizes are tracked in memory, so the directory is scanned once rather
+    than on every store. Methods do blocking file I/O and are called from
+    worker threads.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None   # path -> size, least recently used first; read from disk on first use
+        self.total = 0
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def _index(self):
+        if self.entries is None:
+            found = []
+            try:
+                for entry in os.scandir(self.directory):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.path, stat.st_size))
+            except FileNotFoundError:
+                pass
+            self.entries = OrderedDict((path, size) for _, path, size in sorted(found))
+            self.total = sum(self.entries.values())
+        return self.entries
+
+    def load(self, url):
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # keeps the order across restarts
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            entries = self._index()
+            if path in entries:
+                entries.move_to_end(path)
+        return data
+
+    def store(self, url, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            entries = self._index()
+            self.total += len(data) - entries.pop(path, 0)
+            entries[path] = len(data)
+            while self.total > self.max_bytes and len(entries) > 1:
+                old, size = entries.popitem(last=False)
+                self.total -= size
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+
+class RenderService:
+    """Renders images in a process pool with a content-addressed result cache"""
+
+    def __init__(self, workers=None, cache_bytes=32 * 1024 * 1024, avatar_dir='.cache/avatars'):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.avatars = AvatarCache(avatar_dir)
+        self.pool = None
+        self.session = None
+        self.stats = {'hits': 0, 'misses': 0, 'render_time': 0.0}
+
+    @property
+    def available(self):
+        return AVAILABLE
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+    async def fetch_avatar(self, url):
+        if not url:
+            return None
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.avatars.load, url)
+        if data is None:
+            import aiohttp
+            if self.session is None:
+                self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=AVATAR_TIMEOUT))
+            try:
+                async with self.session.get(url) as response:
+                    if response.status != 200:
+                        return None
+                    data = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+            await loop.run_in_executor(None, self.avatars.store, url, data)
+        return data
+
+    @staticmethod
+    def cache_key(kind, data, avatar):
+        digest = hashlib.sha256(kind.encode())
+        digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+        if avatar:
+            digest.update(hashlib.sha256(avatar).digest())
+        return digest.hexdigest()
+
+    def dump_cache(self):
+        """Cached images as (key, PNG bytes) pairs, least recently used first"""
+        return list(self.cache.items())
+
+    def load_cache(self, items):
+        # Keys are content hashes, so images cached by an earlier process are still valid
+        for key, image in items:
+            self._remember(key, image)
+
+    def _remember(self, key, image):
+        self.cache[key] = image
+        self.cached_bytes += len(image)
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cached_bytes -= len(old)
+
+    async def render(self, kind, data, avatar_url=None):
+        """Return PNG bytes for ``kind``, rendering in the pool only on a cache miss"""
+        avatar = await self.fetch_avatar(avatar_url)
+        key = self.cache_key(kind, data, avatar)
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return image
+
+        if self.pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        started = time.perf_counter()
+        image = await asyncio.get_running_loop().run_in_executor(self.pool, render, kind, data, avatar)
+        self.stats['render_time'] += time.perf_counter() - started
+        self.stats['misses'] += 1
+        self._remember(key, image)
+        return image
+
+    async def render_file(self, kind, data, filename, avatar_url=None):
+        """Render straight to a discord.File, or None if rendering is unavailable or fails"""
+        if not self.available:
+            return None
+        try:
+            image = await self.render(kind, data, avatar_url)
+        except Exception as e:
+            print(f'Failed to render {kind}: {e}')
+            return None
+        import discord
+        # BytesIO over an immutable bytes object shares its buffer instead of copying it
+        return discord.File(io.BytesIO(image), filename=filename)
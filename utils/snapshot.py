@@ -0,0 +1,171 @@
+"""Warm-restart snapshots of in-memory runtime state.
+
+Components register a named section with a ``dump`` callable that returns a
+picklable copy of their state and a ``load`` callable that takes it back.
+``save`` writes every section to one versioned binary file:
+
+    header   magic, format version, section count, creation time
+    table    per section: name, section version, offset, length, CRC32
+    data     one pickle per section
+
+The file is written next to its final path and renamed into place, so a
+crash mid-write leaves the previous snapshot intact. On startup the file is
+memory-mapped and only the section table is parsed; a section is unpickled
+when its component registers, so sections nobody asks for cost nothing.
+"""
+import asyncio
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+
+MAGIC = b'BOTSNAP\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHd')     # magic, format version, section count, created
+NAME_LENGTH = struct.Struct('<H')
+ENTRY = struct.Struct('<HQQI')       # section version, offset, length, crc32
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path, sections, created=None):
+    """Write ``{name: (version, payload bytes)}`` to ``path`` atomically"""
+    table = bytearray()
+    offset = HEADER.size + sum(NAME_LENGTH.size + len(name.encode()) + ENTRY.size for name in sections)
+    for name, (version, payload) in sections.items():
+        encoded = name.encode()
+        table += NAME_LENGTH.pack(len(encoded)) + encoded
+        table += ENTRY.pack(version, offset, len(payload), zlib.crc32(payload))
+        offset += len(payload)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        created = time.time() if created is None else created
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), created))
+        f.write(table)
+        for _, payload in sections.values():
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return offset
+
+
+class SnapshotReader:
+    """Memory-mapped snapshot file whose sections are unpickled on request"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, self.created = HEADER.unpack_from(self.data, 0)
+            if magic != MAGIC:
+                raise SnapshotError('not a snapshot file')
+            if version != FORMAT_VERSION:
+                raise SnapshotError(f'unsupported snapshot format {version}')
+            self.sections = {}   # name -> (section version, offset, length, crc32)
+            position = HEADER.size
+            for _ in range(count):
+                (length,) = NAME_LENGTH.unpack_from(self.data, position)
+                position += NAME_LENGTH.size
+                name = bytes(self.data[position:position + length]).decode()
+                position += length
+                self.sections[name] = ENTRY.unpack_from(self.data, position)
+                position += ENTRY.size
+        except (struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise SnapshotError(f'corrupt snapshot table: {e}')
+        except SnapshotError:
+            self.close()
+            raise
+
+    @property
+    def age(self):
+        return time.time() - self.created
+
+    def load(self, name):
+        """Unpickle a section"""
+        _, offset, length, crc = self.sections[name]
+        with memoryview(self.data)[offset:offset + length] as view:
+            if zlib.crc32(view) != crc:
+                raise SnapshotError(f'section {name} is corrupt')
+            return pickle.loads(view)
+
+    def close(self):
+        self.data.close()
+
+
+class SnapshotStore:
+    """Registry of snapshot sections, saved together and restored as components register"""
+
+    def __init__(self, path):
+        self.path = path
+        self.components = {}   # name -> (version, dump, load)
+        self.reader = None
+        self.restored = []
+        self.active = False    # saving starts once restoring is done, so a failed start keeps the old file
+        self.last_save = None  # (seconds, bytes) of the most recent save
+        self.lock = None       # created on first save, inside the running event loop
+
+    def open(self):
+        """Map the last snapshot, if any, so registering components can restore from it"""
+        try:
+            self.reader = SnapshotReader(self.path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, SnapshotError) as e:  # mmap raises ValueError for empty files
+            print(f'Ignoring snapshot {self.path}: {e}')
+            return
+        print(f'Restoring from snapshot taken {self.reader.age:.0f}s ago')
+
+    def register(self, name, dump, load, version=1):
+        """Include a section in future snapshots and restore it now if the open snapshot has it"""
+        self.components[name] = (version, dump, load)
+        if self.reader is None or name not in self.reader.sections:
+            return
+        if self.reader.sections[name][0] != version:
+            print(f'Skipping {name} in snapshot: saved by an incompatible version')
+            return
+        try:
+            load(self.reader.load(name))
+            self.restored.append(name)
+        except Exception as e:
+            print(f'Could not restore {name} from snapshot: {e}')
+
+    def finish_restore(self):
+        """Unmap the snapshot once every component has registered"""
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+        self.active = True
+        return self.restored
+
+    async def save(self):
+        """Dump every section on the event loop, then pickle and write in a worker thread"""
+        if not self.active:
+            return None
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            started = time.perf_counter()
+            states = {}
+            for name, (version, dump, _) in self.components.items():
+                try:
+                    states[name] = (version, dump())
+                except Exception as e:
+                    print(f'Could not snapshot {name}: {e}')
+            size = await asyncio.get_running_loop().run_in_executor(None, self._write, states)
+            self.last_save = (time.perf_counter() - started, size)
+            return self.last_save
+
+    def _write(self, states):
+        sections = {name: (version, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+                    for name, (version, state) in states.items()}
+        return write_snapshot(self.path, sections)
@@ -0,0 +1,207 @@
+"""Response templates for custom commands.
+
+A template is plain text with placeholders:
+
+    {user} {mention} {server} {channel}   who and where the command ran
+    {args}                                everything typed after the command
+    {count}                               how many times the command has been used
+    {choice:a|b|c}                        one option at random; options may hold placeholders
+
+``{{`` and ``}}`` produce literal braces. Templates are parsed once into a
+plan, a tuple of literal strings, variable names and choice nodes, so a
+response is rendered by walking the plan without any parsing. Limits on
+template length, node count, nesting and output length keep a hostile
+template from costing more than a plain message.
+"""
+import random
+from collections import OrderedDict
+
+VARIABLES = frozenset({'user', 'mention', 'server', 'channel', 'args', 'count'})
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class TemplateLimits:
+    __slots__ = ('max_length', 'max_nodes', 'max_depth', 'max_choices', 'max_output')
+
+    def __init__(self, max_length=1500, max_nodes=100, max_depth=3, max_choices=20, max_output=2000):
+        self.max_length = max_length     # characters of template source
+        self.max_nodes = max_nodes       # placeholders and literals, which bounds render cost
+        self.max_depth = max_depth       # nested {choice:...}
+        self.max_choices = max_choices   # options per choice
+        self.max_output = max_output     # rendered characters; Discord's message limit
+
+
+DEFAULT_LIMITS = TemplateLimits()
+
+
+class Choice:
+    __slots__ = ('options',)
+
+    def __init__(self, options):
+        self.options = options   # tuple of plans
+
+
+class Variable:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Template:
+    """A compiled template"""
+    __slots__ = ('source', 'plan', 'variables')
+
+    def __init__(self, source, plan, variables):
+        self.source = source
+        self.plan = plan
+        self.variables = variables   # variable names used anywhere in the plan
+
+    def render(self, context, limits=DEFAULT_LIMITS):
+        """Render with ``context`` mapping variable names to strings"""
+        parts = []
+        size = _render(self.plan, context, parts, 0, limits.max_output)
+        text = ''.join(parts)
+        return text[:limits.max_output] if size > limits.max_output else text
+
+
+def _render(plan, context, parts, size, max_output):
+    for node in plan:
+        if size >= max_output:
+            break
+        if isinstance(node, str):
+            text = node
+        elif isinstance(node, Variable):
+            text = context[node.name]
+        else:
+            size = _render(random.choice(node.options), context, parts, size, max_output)
+            continue
+        parts.append(text)
+        size += len(text)
+    return size
+
+
+class _Parser:
+    def __init__(self, source, limits):
+        self.source = source
+        self.limits = limits
+        self.pos = 0
+        self.nodes = 0
+        self.variables = set()
+
+    def parse(self, depth=0, in_choice=False):
+        """Parse up to the end of the source, or to '|' or '}' inside a choice"""
+        plan = []
+        literal = []
+        source = self.source
+        while self.pos < len(source):
+            char = source[self.pos]
+            if char == '{' and source.startswith('{{', self.pos):
+                literal.append('{')
+                self.pos += 2
+            elif char == '}' and source.startswith('}}', self.pos) and not in_choice:
+                literal.append('}')
+                self.pos += 2
+            elif char == '{':
+                self._flush(plan, literal)
+                plan.append(self.placeholder(depth))
+            elif in_choice and char in '|}':
+                break
+            elif char == '}':
+                raise TemplateError(f"Unmatched '}}' at position {self.pos + 1}; use '}}}}' for a literal brace")
+            else:
+                literal.append(char)
+                self.pos += 1
+        self._flush(plan, literal)
+        return tuple(plan)
+
+    def _flush(self, plan, literal):
+        if literal:
+            self._count()
+            plan.append(''.join(literal))
+            literal.clear()
+
+    def _count(self):
+        self.nodes += 1
+        if self.nodes > self.limits.max_nodes:
+            raise TemplateError(f'Templates may have at most {self.limits.max_nodes} parts')
+
+    def placeholder(self, depth):
+        start = self.pos
+        self.pos += 1
+        self._count()
+        if self.source.startswith('choice:', self.pos):
+            if depth >= self.limits.max_depth:
+                raise TemplateError(f'Choices may be nested at most {self.limits.max_depth} deep')
+            self.pos += len('choice:')
+            options = [self.parse(depth + 1, in_choice=True)]
+            while self.pos < len(self.source) and self.source[self.pos] == '|':
+                self.pos += 1
+                options.append(self.parse(depth + 1, in_choice=True))
+            self._expect_close(start)
+            if len(options) > self.limits.max_choices:
+                raise TemplateError(f'A choice may have at most {self.limits.max_choices} options')
+            return Choice(tuple(options))
+
+        end = self.source.find('}', self.pos)
+        if end == -1:
+            raise TemplateError(f"Unclosed '{{' at position {start + 1}")
+        name = self.source[self.pos:end].strip().lower()
+        if name not in VARIABLES:
+            raise TemplateError(f'Unknown variable {{{name}}}. Available: '
+                                + ', '.join(f'{{{v}}}' for v in sorted(VARIABLES)) + ', {choice:a|b}')
+        self.pos = end + 1
+        self.variables.add(name)
+        return Variable(name)
+
+    def _expect_close(self, start):
+        if self.pos >= len(self.source) or self.source[self.pos] != '}':
+            raise TemplateError(f"Unclosed '{{choice:' at position {start + 1}")
+        self.pos += 1
+
+
+def literal_template(source):
+    """A template that renders ``source`` as is"""
+    return Template(source, (source,) if source else (), frozenset())
+
+
+def compile_template(source, limits=DEFAULT_LIMITS):
+    """Parse ``source`` into a Template, raising TemplateError if it is invalid or too large"""
+    if len(source) > limits.max_length:
+        raise TemplateError(f'Templates may be at most {limits.max_length} characters')
+    parser = _Parser(source, limits)
+    plan = parser.parse()
+    return Template(source, plan, frozenset(parser.variables))
+
+
+class TemplateCache:
+    """Compiled templates per guild, least recently used evicted first"""
+
+    def __init__(self, per_guild=256, limits=DEFAULT_LIMITS):
+        self.per_guild = per_guild
+        self.limits = limits
+        self.guilds = {}   # guild_id -> OrderedDict of name -> Template, or None for unknown names
+
+    def get(self, guild_id, name):
+        """Return (found, template); ``found`` is False if the name has not been looked up yet"""
+        templates = self.guilds.get(guild_id)
+        if templates is None or name not in templates:
+            return False, None
+        templates.move_to_end(name)
+        return True, templates[name]
+
+    def put(self, guild_id, name, template):
+        templates = self.guilds.setdefault(guild_id, OrderedDict())
+        templates[name] = template
+        templates.move_to_end(name)
+        if len(templates) > self.per_guild:
+            templates.popitem(last=False)
+
+    def invalidate(self, guild_id, name=None):
+        if name is None:
+            self.guilds.pop(guild_id, None)
+        elif guild_id in self.guilds:
+            self.guilds[guild_id].pop(name, None)
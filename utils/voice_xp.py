@@ -0,0 +1,137 @@
+"""Voice activity XP from join and leave intervals.
+
+Voice state events open and close earning intervals; nothing polls the voice
+channels. A member earns while they are in a voice channel, neither muted nor
+deafened, with at least one other person present. Closed intervals are banked
+as seconds per member, and ``drain`` turns whole banked minutes into XP for
+one batched write, keeping the remainder for next time.
+
+Each event touches the member's own session and, when the channel goes from
+one person to two or back, the one other member whose solo state changed, so
+the cost per event is constant however busy the channel is.
+"""
+import time
+from collections import defaultdict
+
+VOICE_XP_PER_MINUTE = 2
+
+
+class VoiceSession:
+    __slots__ = ('guild_id', 'user_id', 'channel_id', 'active', 'since')
+
+    def __init__(self, guild_id, user_id, channel_id, active):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.active = active   # neither muted nor deafened
+        self.since = None      # start of the open earning interval
+
+
+class VoiceTracker:
+    def __init__(self, xp_per_minute=VOICE_XP_PER_MINUTE):
+        self.xp_per_minute = xp_per_minute
+        self.sessions = {}                # member key -> VoiceSession
+        self.channels = defaultdict(set)  # channel_id -> member keys present
+        self.guilds = defaultdict(set)    # guild_id -> member keys in voice
+        self.banked = defaultdict(float)  # (guild_id, user_id) -> earned seconds not yet converted
+
+    @staticmethod
+    def key(guild_id, user_id):
+        return (guild_id << 64) | user_id
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _start(self, session, now):
+        if session.since is None and session.active and len(self.channels[session.channel_id]) >= 2:
+            session.since = now
+
+    def _stop(self, session, now):
+        if session.since is not None:
+            self.banked[(session.guild_id, session.user_id)] += now - session.since
+            session.since = None
+
+    def _join(self, key, guild_id, user_id, channel_id, active, now):
+        members = self.channels[channel_id]
+        members.add(key)
+        self.guilds[guild_id].add(key)
+        session = self.sessions[key] = VoiceSession(guild_id, user_id, channel_id, active)
+        if len(members) == 2:
+            # The member who was alone starts earning too
+            for other in members:
+                if other != key:
+                    self._start(self.sessions[other], now)
+        self._start(session, now)
+
+    def _leave(self, key, session, now):
+        self._stop(session, now)
+        del self.sessions[key]
+        members = self.channels[session.channel_id]
+        members.discard(key)
+        if len(members) == 1:
+            self._stop(self.sessions[next(iter(members))], now)
+        elif not members:
+            del self.channels[session.channel_id]
+        guild = self.guilds[session.guild_id]
+        guild.discard(key)
+        if not guild:
+            del self.guilds[session.guild_id]
+
+    def update(self, guild_id, user_id, channel_id, active, now=None):
+        """Apply a voice state: ``channel_id`` is None when the member is not in an earning channel"""
+        now = time.time() if now is None else now
+        key = self.key(guild_id, user_id)
+        session = self.sessions.get(key)
+        if session is not None and session.channel_id == channel_id:
+            if session.active != active:
+                self._stop(session, now)
+                session.active = active
+                self._start(session, now)
+            return
+        if session is not None:
+            self._leave(key, session, now)
+        if channel_id is not None:
+            self._join(key, guild_id, user_id, channel_id, active, now)
+
+    def sync_guild(self, guild_id, states, now=None):
+        """Replace a guild's sessions with (user_id, channel_id, active) states, e.g. after reconnecting"""
+        now = time.time() if now is None else now
+        for key in list(self.guilds.get(guild_id, ())):
+            self._leave(key, self.sessions[key], now)
+        for user_id, channel_id, active in states:
+            self.update(guild_id, user_id, channel_id, active, now)
+
+    def drain(self, now=None):
+        """Return (guild_id, user_id, xp) for whole earned minutes, one row per member"""
+        now = time.time() if now is None else now
+        for session in self.sessions.values():
+            if session.since is not None:
+                self._stop(session, now)
+                session.since = now
+        gains = []
+        banked = self.banked
+        for member, seconds in list(banked.items()):
+            minutes = int(seconds // 60)
+            if minutes:
+                gains.append((*member, minutes * self.xp_per_minute))
+                seconds -= minutes * 60
+            if seconds and self.key(*member) in self.sessions:
+                banked[member] = seconds
+            else:
+                # Less than a minute left and no longer in voice
+                del banked[member]
+        return gains
+
+    def dump_state(self, now=None):
+        """Banked seconds per member, with open intervals counted up to now"""
+        now = time.time() if now is None else now
+        seconds = defaultdict(float, self.banked)
+        for session in self.sessions.values():
+            if session.since is not None:
+                seconds[(session.guild_id, session.user_id)] += now - session.since
+        return [(guild_id, user_id, total) for (guild_id, user_id), total in seconds.items()]
+
+    def load_state(self, rows):
+        # Sessions themselves are rebuilt from live voice states once the bot is connected
+        for guild_id, user_id, seconds in rows:
+            self.banked[(guild_id, user_id)] += seconds
@@ -0,0 +1,59 @@
+"""Time-bucketed XP history.
+
+Gains are summed in memory per (guild, user, hour) and flushed to storage in
+batches. Compaction rolls hourly buckets into daily ones and daily into weekly
+ones, then drops weekly buckets past retention, so each active member costs at
+most about HOURLY_KEEP / HOUR + DAILY_KEEP / DAY + WEEKLY_KEEP / WEEK rows.
+"""
+import time
+from collections import defaultdict
+
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * DAY
+WEEK_OFFSET = 4 * DAY    # the Unix epoch is a Thursday; weeks start on Monday
+
+HOURLY_KEEP = 2 * DAY
+DAILY_KEEP = 35 * DAY
+WEEKLY_KEEP = 26 * WEEK
+
+
+def hour_start(ts):
+    return int(ts) - int(ts) % HOUR
+
+
+def day_start(ts):
+    return int(ts) - int(ts) % DAY
+
+
+def week_start(ts):
+    return int(ts) - (int(ts) - WEEK_OFFSET) % WEEK
+
+
+def compaction_cutoffs(now=None):
+    """Return (hourly, daily, weekly) cutoffs aligned to the coarser bucket size.
+
+    Hourly buckets before the first cutoff become daily, daily buckets before
+    the second become weekly, and weekly buckets before the third are deleted.
+    """
+    now = time.time() if now is None else now
+    return day_start(now - HOURLY_KEEP), week_start(now - DAILY_KEEP), week_start(now - WEEKLY_KEEP)
+
+
+class XPHistoryBuffer:
+    """Accumulates XP gains per hourly bucket until the next flush"""
+
+    def __init__(self):
+        self.pending = defaultdict(int)
+
+    def record(self, guild_id, user_id, amount, now=None):
+        bucket = hour_start(time.time() if now is None else now)
+        self.pending[(guild_id, user_id, bucket)] += amount
+
+    def drain(self):
+        """Return pending (guild_id, user_id, bucket_start, xp) rows and clear the buffer"""
+        pending, self.pending = self.pending, defaultdict(int)
+        return [(guild_id, user_id, bucket, xp) for (guild_id, user_id, bucket), xp in pending.items()]
+
+    def __len__(self):
+        return len(self.pending)